@@ -0,0 +1,155 @@
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Tuple, Union
+
+# ---------------------------------------------------------------------------- #
+#              In-memory caches shared between searches in a process           #
+# ---------------------------------------------------------------------------- #
+
+
+def nbytes(value: Any) -> int:
+    """Approximate size of a cached value in bytes"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    elif isinstance(value, (tuple, list)):
+        return sum(nbytes(v) for v in value)
+    elif isinstance(value, (str, bytes)):
+        return len(value)
+    return 64
+
+
+class LRUCache:
+    def __init__(
+            self,
+            max_bytes: int = 512 * 2**20,
+            ttl: float = None,
+            sizeof: Callable[[Any], int] = nbytes) -> None:
+        """Thread-safe least-recently-used cache bounded by total size
+
+        Args:
+            max_bytes (int, optional): maximum total size of cached values. Defaults to 512 MiB.
+            ttl (float, optional): default lifetime of entries, in seconds. Defaults to None (no expiry).
+            sizeof (Callable[[Any], int], optional): function that returns the size of a value in bytes.
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+
+        self._data: OrderedDict[Hashable, Tuple[Any, int, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, count=False) is not None
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def _pop(self, key: Hashable) -> None:
+        _, size, _ = self._data.pop(key)
+        self._size -= size
+
+    def get(self, key: Hashable, default: Any = None, count=True) -> Any:
+        with self._lock:
+            try:
+                value, _, expires = self._data[key]
+            except KeyError:
+                if count:
+                    self.misses += 1
+                return default
+
+            if expires is not None and expires < time.time():
+                self._pop(key)
+                if count:
+                    self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            if count:
+                self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, ttl: float = None) -> None:
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.time() + ttl
+
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+
+            self._data[key] = (value, size, expires)
+            self._size += size
+
+            while self._size > self.max_bytes:
+                self._pop(next(iter(self._data)))
+
+    def get_or_create(
+            self,
+            key: Hashable,
+            create: Callable[[], Any],
+            ttl: float = None) -> Any:
+        value = self.get(key)
+        if value is None:
+            value = create()
+            self.put(key, value, ttl=ttl)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        return dict(
+            entries=len(self._data),
+            bytes=self._size,
+            hits=self.hits,
+            misses=self.misses
+        )
+
+
+class SharedCaches:
+    def __init__(
+            self,
+            audio_bytes: int = 1024 * 2**20,
+            spectra_bytes: int = 256 * 2**20) -> None:
+        """Caches that outlive a single `Finder`
+
+        * `audio`: decoded bin audio, keyed by `(source id, start, stop)`
+        * `queries`: decoded query audio, keyed by query path or url
+        * `spectra`: query spectra, keyed by `(query hash, FFT length)`
+        * `urls`: resolved media urls, keyed by `(source url, format)`
+        * `meta`: video metadata, keyed by source url
+        """
+        self.audio = LRUCache(max_bytes=audio_bytes)
+        self.queries = LRUCache(max_bytes=audio_bytes // 4)
+        self.spectra = LRUCache(max_bytes=spectra_bytes)
+        self.urls = LRUCache(max_bytes=2**20)
+        self.meta = LRUCache(max_bytes=16 * 2**20)
+
+    def stats(self) -> dict:
+        return {
+            name: getattr(self, name).stats()
+            for name in ['audio', 'queries', 'spectra', 'urls', 'meta']
+        }
+
+
+def audio_key(
+        source_id: str,
+        start: Union[int, str],
+        stop: Union[int, str]) -> Tuple[str, str, str]:
+    """Cache key of the decoded audio for one bin"""
+    return (source_id, str(start), str(stop))
@@ -0,0 +1,216 @@
+import re
+import json
+import argparse
+import unicodedata
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple, Union
+
+from finder import sampling
+from finder.postplot import parse_corr_lines, remove_loginfo_header
+from finder.subtitles import fetch_subtitles
+
+# ---------------------------------------------------------------------------- #
+#              Visit the bins where the chat replay is busiest first           #
+# ---------------------------------------------------------------------------- #
+
+# Clips are cut from the moments chat reacts to. The chat replay of a past
+# stream (`yt-dlp --write-subs --sub-langs live_chat`, one JSON action per
+# line) gives the time of every message; their weighted count per second,
+# shifted back by the reaction delay of chat, is the prior that
+# `sampling.get_bins(..., binorder='chat', prior=...)` ranks bins by.
+
+# lowercase substrings, after NFKC normalization, and the weight each adds to a message
+KEYWORD_BOOSTS: Dict[str, float] = {
+    'lol': 1., 'lmao': 1., 'ww': 1., '草': 1., '笑': 1., 'kusa': 1.,
+    'clip': 2., 'omg': .5,
+}
+
+# seconds between a moment and the peak of chat's reaction to it
+REACTION_S = 10
+
+
+def _message_text(renderer: dict) -> str:
+    runs = renderer.get('message', {}).get('runs', [])
+    return "".join(
+        run['text'] if 'text' in run
+        else (run.get('emoji', {}).get('shortcuts') or [''])[0]
+        for run in runs
+    )
+
+
+def parse_chat(lines: List[str]) -> Tuple[np.ndarray, List[str]]:
+    """Times in seconds and texts of the messages in a `yt-dlp` chat replay
+
+    Lines that are not chat actions, e.g. membership and poll banners, are skipped.
+    """
+    times, texts = [], []
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        replay = json.loads(line).get('replayChatItemAction', {})
+        if 'videoOffsetTimeMsec' not in replay:
+            continue
+
+        for action in replay.get('actions', []):
+            item = action.get('addChatItemAction', {}).get('item', {})
+            renderer = (
+                item.get('liveChatTextMessageRenderer')
+                or item.get('liveChatPaidMessageRenderer')
+            )
+            if renderer is None:
+                continue
+
+            times.append(int(replay['videoOffsetTimeMsec']) / 1000)
+            texts.append(unicodedata.normalize('NFKC', _message_text(renderer)).lower())
+
+    return np.array(times, dtype=np.float64), texts
+
+
+def read_chat(path: Union[Path, str]) -> Tuple[np.ndarray, List[str]]:
+    with open(path, 'r', encoding='utf-8') as io:
+        return parse_chat(io.readlines())
+
+
+def fetch_chat(url: str, loc: Path = None) -> Path:
+    """Download the chat replay of a past stream once, to `loc/<id>.live_chat.json`"""
+    return fetch_subtitles(url, loc=loc, lang='live_chat', ext='json')
+
+
+def chat_rate(
+        times: np.ndarray,
+        texts: List[str] = None,
+        duration: int = 0,
+        boosts: Dict[str, float] = KEYWORD_BOOSTS,
+        reaction_s: float = REACTION_S) -> np.ndarray:
+    """Weighted messages per second of the source
+
+    Args:
+        times (np.ndarray): message times in seconds
+        texts (List[str], optional): lowercase message texts, for `boosts`. Defaults to None.
+        duration (int, optional): minimum length of the output. Defaults to 0.
+        boosts (Dict[str, float], optional): weight added to a message for each substring it contains. Defaults to KEYWORD_BOOSTS.
+        reaction_s (float, optional): seconds the messages are moved back by; earlier messages are dropped. Defaults to REACTION_S.
+
+    Returns:
+        np.ndarray: weight of the messages in each second
+    """
+    weights = np.ones(times.size)
+    if texts and boosts:
+        texts = np.array(texts, dtype=str)
+        for word, boost in boosts.items():
+            weights += boost * (np.char.find(texts, word) >= 0)
+
+    # messages sent before anyone could react to the stream have no moment to point at
+    keep = times >= reaction_s
+    seconds = np.floor(times[keep] - reaction_s).astype(np.int64)
+    return np.bincount(seconds, weights=weights[keep], minlength=duration)
+
+
+# ---------------------------- Replay over old logs -------------------------- #
+
+
+_LOG_BIN = re.compile(r"\['(\d+:\d\d:\d\d)' '(\d+:\d\d:\d\d)'\]")
+
+
+def _hms2sec(s: str) -> int:
+    h, m, sec = map(int, s.split(':'))
+    return h * 3600 + m * 60 + sec
+
+
+def read_log(path: Union[Path, str]) -> Tuple[np.ndarray, Dict[int, float]]:
+    """Bins of a search logged by `Finder`, in the order they were first listed, and the correlation of each scored bin by its start"""
+    with open(path, 'r') as io:
+        lines = [remove_loginfo_header(line) for line in io]
+
+    # runs resumed in the same log list their bins again
+    listed: Dict[int, int] = {}
+    scored: Dict[int, float] = {}
+    in_listing = False
+
+    for i, line in enumerate(lines):
+        if line.startswith('Corr:') and i + 1 < len(lines):
+            times = _LOG_BIN.findall(lines[i + 1])
+            if times:
+                corr, _, _ = parse_corr_lines(line)
+                start = _hms2sec(times[0][0])
+                scored[start] = max(corr, scored.get(start, corr))
+        elif line.startswith('[['):
+            in_listing = True
+        if in_listing:
+            for a, b in _LOG_BIN.findall(line):
+                listed.setdefault(_hms2sec(a), _hms2sec(b))
+            in_listing = not line.endswith(']]')
+
+    if not listed or not scored:
+        raise ValueError(f"No bin listing or scored bins in {path}")
+    return np.array(list(listed.items()), dtype=np.int64), scored
+
+
+class Replay(NamedTuple):
+    """Downloads until the best bin of a logged search, for each bin order"""
+    log: str
+    hit: Tuple[int, int]
+    nbins: int
+    logged: int
+    mirrored: int
+    chat: int
+
+
+def replay(log: Union[Path, str], rate: np.ndarray) -> Replay:
+    """Replay a search logged by `Finder` with the chat prior
+
+    The bin with the highest correlation in the log is taken as the hit.
+
+    Args:
+        log (Union[Path, str]): log file from `logs/`
+        rate (np.ndarray): `chat_rate` of the same source
+
+    Returns:
+        Replay: 1-based position of the hit in the logged order, in `mirrored` order and in `chat` order
+    """
+    logged, scored = read_log(log)
+    hit_start = max(scored, key=scored.get)
+
+    positional = logged[np.argsort(logged[:, 0], kind='stable')]
+    hit = int(np.flatnonzero(positional[:, 0] == hit_start)[0])
+    density = sampling.bin_density(rate, positional)
+
+    position = lambda order: int(np.flatnonzero(order == hit)[0]) + 1
+    return Replay(
+        str(log),
+        tuple(positional[hit].tolist()),
+        len(positional),
+        int(np.flatnonzero(logged[:, 0] == hit_start)[0]) + 1,
+        position(sampling.mirrored_order(len(positional))),
+        position(sampling.prior_order(density)),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Downloads until the hit of logged searches, with and without the chat prior")
+    parser.add_argument(
+        'pairs', nargs='+', metavar='LOG=CHAT',
+        help="a log from `logs/` and the chat replay of its source")
+    parser.add_argument('--no-boosts', action='store_true')
+    args = parser.parse_args()
+
+    results = []
+    for pair in args.pairs:
+        log, chat = pair.split('=', 1)
+        times, texts = read_chat(chat)
+        rate = chat_rate(times, texts, boosts={} if args.no_boosts else KEYWORD_BOOSTS)
+        results.append(replay(log, rate))
+
+        r = results[-1]
+        print(f"{Path(log).stem:<30} bins: {r.nbins:>3} logged: {r.logged:>3} mirrored: {r.mirrored:>3} chat: {r.chat:>3}")
+
+    mean = np.mean([[r.logged, r.mirrored, r.chat] for r in results], axis=0)
+    print(f"{'mean':<30} {'':>9} logged: {mean[0]:>5.1f} mirrored: {mean[1]:>5.1f} chat: {mean[2]:>5.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -31,6 +31,11 @@ class NoSignalException(RuntimeError):
 
 
 def seconds2str(secs: int, fmt=r"%H:%M:%S") -> str:
+    if fmt == r"%H:%M:%S":
+        # `time.strftime` would wrap around after 24 hours
+        h, rem = divmod(int(secs), 3600)
+        m, s = divmod(rem, 60)
+        return f"{h:02}:{m:02}:{s:02}"
     return time.strftime(fmt, time.gmtime(secs))
 
 
@@ -41,6 +46,11 @@ def str2hms(t: str) -> datetime:
     return datetime.strptime(t, "%H:%M:%S")
 
 
+def seconds2hms(secs: float) -> datetime:
+    """Inverse of `str2hms(seconds2str(secs))`, without the 24 hour limit of `strptime`"""
+    return datetime(1900, 1, 1) + timedelta(seconds=float(secs))
+
+
 def hms2str(s: datetime) -> str:
     return datetime.strftime(s, "%H:%M:%S")
 
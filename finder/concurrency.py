@@ -0,0 +1,251 @@
+import os
+import time
+import logging
+import threading
+import subprocess
+from collections import Counter, deque
+from urllib.parse import urlsplit
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Tuple
+
+# ---------------------------------------------------------------------------- #
+#            Adaptive download concurrency with throttling detection           #
+# ---------------------------------------------------------------------------- #
+
+# Downloads take a slot from `DOWNLOADS` before they start. The number of slots
+# (the limit) follows AIMD, as in TCP congestion control: after every round of
+# `limit` finished downloads, the aggregate throughput of the round is compared
+# with the previous round, and the limit grows by one while throughput keeps
+# improving and latency has not blown up. A throttling signal (HTTP 429 or 503,
+# "Too Many Requests") halves the limit at once; signals from downloads that
+# started before the last decrease belong to the same burst and are ignored.
+# Throttled downloads are retried after an exponential backoff. A per-host
+# cap can be pinned independently of the limit.
+
+THROTTLE_MARKERS = ['429', 'too many requests', 'rate limit', 'rate-limit', '503']
+TIMEOUT_MARKERS = ['timed out', 'timeout']
+
+
+class TaskSample(NamedTuple):
+    """Outcome of one download"""
+    host: str
+    seconds: float
+    bytes: int
+    error: str
+
+
+def host_of(url: str) -> str:
+    """Host of a url, or `local` for paths"""
+    return urlsplit(str(url)).netloc or 'local'
+
+
+def classify_error(e: BaseException) -> str:
+    """`throttle`, `timeout` or `other`"""
+    if isinstance(e, (subprocess.TimeoutExpired, TimeoutError)):
+        return 'timeout'
+
+    text = str(e)
+    if isinstance(e, subprocess.CalledProcessError):
+        for out in (e.stderr, e.output):
+            if isinstance(out, bytes):
+                text += " " + out.decode(errors='replace')
+            elif out:
+                text += f" {out}"
+    text = text.lower()
+
+    if any(m in text for m in THROTTLE_MARKERS):
+        return 'throttle'
+    if any(m in text for m in TIMEOUT_MARKERS):
+        return 'timeout'
+    return 'other'
+
+
+def output_bytes(result: Any) -> int:
+    """Size of what a fetch returned: bytes, or the file at a returned path"""
+    if isinstance(result, (bytes, bytearray)):
+        return len(result)
+    if isinstance(result, (str, os.PathLike)) and os.path.isfile(result):
+        return os.path.getsize(result)
+    return 0
+
+
+class AIMDController:
+    def __init__(
+            self,
+            initial: int = 4,
+            min_limit: int = 1,
+            max_limit: int = 64,
+            max_per_host: int = None,
+            increase: float = 1.,
+            decrease: float = 0.5,
+            min_gain: float = 0.05,
+            latency_factor: float = 3.,
+            retries: int = 3,
+            backoff_s: float = 1.,
+            window: int = 256) -> None:
+        """Limit concurrent downloads, adapting the limit to throughput and throttling
+
+        Args:
+            initial (int, optional): starting limit. Defaults to 4.
+            min_limit (int, optional): smallest limit. Defaults to 1.
+            max_limit (int, optional): largest limit. Defaults to 64.
+            max_per_host (int, optional): concurrent downloads per host, whatever the limit. Defaults to None (no cap).
+            increase (float, optional): additive increase per improving round. Defaults to 1.
+            decrease (float, optional): multiplicative decrease on throttling. Defaults to 0.5.
+            min_gain (float, optional): relative throughput gain of a round that counts as an improvement. Defaults to 0.05.
+            latency_factor (float, optional): no increase while the mean latency of a round exceeds the best by this factor. Defaults to 3.
+            retries (int, optional): retries of a throttled download. Defaults to 3.
+            backoff_s (float, optional): first backoff before a retry, doubled each time. Defaults to 1.
+            window (int, optional): number of recent samples kept. Defaults to 256.
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_per_host = max_per_host
+        self.increase = increase
+        self.decrease = decrease
+        self.min_gain = min_gain
+        self.latency_factor = latency_factor
+        self.retries = retries
+        self.backoff_s = backoff_s
+
+        self.limit = float(max(min(initial, max_limit), min_limit))
+        self.in_flight = 0
+        self.samples: Deque[TaskSample] = deque(maxlen=window)
+        self.errors: Counter = Counter()
+        self.history: List[Tuple[float, int]] = [(time.monotonic(), int(self.limit))]
+
+        self._hosts: Dict[str, int] = {}
+        self._host_caps: Dict[str, int] = {}
+        self._cond = threading.Condition()
+        self._last_decrease = float('-inf')
+        self._reset_round()
+        self._prev_tput: float = None
+        self._best_latency = float('inf')
+
+    # --------------------------------- Slots -------------------------------- #
+
+    def pin_host(self, host: str, cap: int) -> None:
+        """Allow at most `cap` concurrent downloads from `host`"""
+        with self._cond:
+            self._host_caps[host] = cap
+            self._cond.notify_all()
+
+    def _host_cap(self, host: str) -> float:
+        cap = self._host_caps.get(host, self.max_per_host)
+        return float('inf') if cap is None else cap
+
+    def acquire(self, host: str = 'local') -> float:
+        """Wait for a slot; returns the start time to pass to `release`"""
+        with self._cond:
+            while self.in_flight >= int(self.limit) or\
+                    self._hosts.get(host, 0) >= self._host_cap(host):
+                self._cond.wait()
+            self.in_flight += 1
+            self._hosts[host] = self._hosts.get(host, 0) + 1
+        return time.monotonic()
+
+    def release(
+            self,
+            host: str,
+            started: float,
+            nbytes: int = 0,
+            error: str = None) -> None:
+        now = time.monotonic()
+        sample = TaskSample(host, now - started, nbytes, error)
+
+        with self._cond:
+            self.in_flight -= 1
+            self._hosts[host] -= 1
+            self.samples.append(sample)
+            if error is not None:
+                self.errors[error] += 1
+
+            if error == 'throttle':
+                if started >= self._last_decrease:
+                    self._set_limit(self.limit * self.decrease, 'throttled')
+                    self._last_decrease = now
+                    self._prev_tput = None
+                    self._reset_round()
+            elif error is None:
+                self._add_to_round(sample, now)
+
+            self._cond.notify_all()
+
+    # --------------------------------- AIMD --------------------------------- #
+
+    def _reset_round(self) -> None:
+        self._round_start = time.monotonic()
+        self._round_bytes = 0
+        self._round_tasks = 0
+        self._round_latency = 0.
+
+    def _add_to_round(self, sample: TaskSample, now: float) -> None:
+        self._round_bytes += sample.bytes
+        self._round_tasks += 1
+        self._round_latency += sample.seconds
+        if self._round_tasks < max(int(self.limit), 1):
+            return
+
+        tput = self._round_bytes / max(now - self._round_start, 1e-9)
+        latency = self._round_latency / self._round_tasks
+        self._best_latency = min(self._best_latency, latency)
+
+        improving = self._prev_tput is None or\
+            tput > self._prev_tput * (1 + self.min_gain)
+        congested = latency > self.latency_factor * self._best_latency
+
+        if improving and not congested:
+            self._set_limit(self.limit + self.increase, f"{tput / 1e6:.2f} MB/s")
+
+        self._prev_tput = tput
+        self._reset_round()
+
+    def _set_limit(self, limit: float, reason: str) -> None:
+        old = int(self.limit)
+        self.limit = float(min(max(limit, self.min_limit), self.max_limit))
+        if int(self.limit) != old:
+            self.history.append((time.monotonic(), int(self.limit)))
+            logging.info(f"Download concurrency {old} -> {int(self.limit)} ({reason})")
+
+    # --------------------------------- Calls -------------------------------- #
+
+    def call(
+            self,
+            host: str,
+            fn: Callable[..., Any],
+            *args, **kwargs) -> Any:
+        """Run `fn(*args, **kwargs)` in a slot, retrying it when throttled
+
+        Raises:
+            Exception: whatever `fn` raised, once retries are used up or if it was not throttling
+        """
+        for attempt in range(self.retries + 1):
+            started = self.acquire(host)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                kind = classify_error(e)
+                self.release(host, started, error=kind)
+                if kind != 'throttle' or attempt == self.retries:
+                    raise
+                logging.warning(f"Throttled by {host}, retry {attempt + 1} of {self.retries}")
+                time.sleep(self.backoff_s * 2**attempt)
+                continue
+
+            self.release(host, started, nbytes=output_bytes(result))
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            samples = list(self.samples)
+            ok = [s for s in samples if s.error is None]
+            return dict(
+                limit=int(self.limit),
+                in_flight=self.in_flight,
+                errors=dict(self.errors),
+                mean_latency_s=sum(s.seconds for s in ok) / len(ok) if ok else None,
+                bytes=sum(s.bytes for s in ok),
+            )
+
+
+# shared by every download in this process
+DOWNLOADS = AIMDController()
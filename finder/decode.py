@@ -0,0 +1,154 @@
+import os
+import json
+import logging
+import numpy as np
+from pathlib import Path
+from subprocess import run, CalledProcessError
+from typing import Any, Dict, List, Union
+
+from finder.common import InvalidArgumentException
+from finder.singleflight import FileLock
+
+# ---------------------------------------------------------------------------- #
+#              Decode audio with ffmpeg into raw mono sample files             #
+# ---------------------------------------------------------------------------- #
+
+# numpy dtype -> ffmpeg raw sample format
+RAW_FORMATS = {
+    'float32': 'f32le',
+    'int16': 's16le',
+}
+
+
+def validate_dtype(dtype: str) -> str:
+    if dtype not in RAW_FORMATS:
+        raise InvalidArgumentException(
+            'dtype', dtype, list(RAW_FORMATS.keys())
+        )
+    return dtype
+
+
+def raw_path(
+        source_id: str,
+        rate: int,
+        dtype: str = 'float32',
+        loc: Path = None) -> Path:
+    """Path of the raw mono decode of a whole source, e.g. `data/abc_441hz.float32`"""
+    validate_dtype(dtype)
+    loc = Path.cwd() if loc is None else loc
+    return loc / f"{source_id}_{rate}hz.{dtype}"
+
+
+def read_raw_meta(path: Path) -> Dict[str, Any]:
+    """Metadata written next to a raw decode by `decode_to_raw`"""
+    with open(f"{path}.json", 'r') as io:
+        return json.load(io)
+
+
+def decode_to_raw(
+        src: str,
+        out: Path,
+        rate: int,
+        dtype: str = 'float32',
+        timeout: float = None) -> Path:
+    """Decode the whole of `src` once to a raw mono file sampled at `rate`
+
+    Sample `i` of the output is at time `i / rate` of the source. The file is decoded to a temporary path under a lock and renamed when complete, so it can be shared by later queries and other processes.
+
+    Args:
+        src (str): anything `ffmpeg` can read, e.g. a local file or a media url
+        out (Path): output path, e.g. from `raw_path`
+        rate (int): output sampling rate
+        dtype (str, optional): sample type, `float32` or `int16`. Defaults to 'float32'.
+        timeout (float, optional): seconds before `ffmpeg` is killed. Defaults to None.
+
+    Raises:
+        CalledProcessError: raised if `ffmpeg` fails
+
+    Returns:
+        Path: path of the raw file
+    """
+    validate_dtype(dtype)
+    out = Path(out)
+
+    with FileLock(out.with_name(f".{out.name}.lock")):
+        if out.is_file():
+            return out
+
+        part = out.with_name(f"{out.name}.part{os.getpid()}")
+        cmd = decode_cmd(src, rate, dtype, out=str(part))
+        logging.info(f"Decoding {src} to {out.name}")
+
+        try:
+            proc = run(cmd, timeout=timeout, capture_output=True)
+            if proc.returncode != 0:
+                raise CalledProcessError(
+                    proc.returncode, cmd, proc.stdout, proc.stderr)
+
+            with open(f"{out}.json", 'w') as io:
+                json.dump(dict(
+                    src=str(src), rate=rate, dtype=dtype,
+                    samples=part.stat().st_size // np.dtype(dtype).itemsize
+                ), io)
+
+            os.replace(part, out)
+        finally:
+            part.unlink(missing_ok=True)
+
+    return out
+
+
+def decode_cmd(src: str, rate: int, dtype: str = 'float32', out: str = "pipe:1") -> List[str]:
+    """`ffmpeg` command decoding `src` to raw mono samples at `rate`, resampled with anti-aliasing"""
+    return [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-i", str(src), "-vn", "-ac", "1", "-ar", str(rate),
+        "-f", RAW_FORMATS[dtype], out
+    ]
+
+
+def decode_to_array(
+        src: Union[Path, str, bytes],
+        rate: int,
+        dtype: str = 'float32',
+        timeout: float = None) -> np.ndarray:
+    """Decode audio with `ffmpeg` straight into a mono numpy array sampled at `rate`
+
+    Channels are averaged and the signal is low-pass filtered before resampling, so every file decoded at the same `rate` has the same effective rate, whatever its original rate. Nothing is written to disk and only the mono output is held in memory.
+
+    Args:
+        src (Union[Path, str, bytes]): anything `ffmpeg` can read, or the contents of a file
+        rate (int): output sampling rate
+        dtype (str, optional): sample type, `float32` or `int16`. Defaults to 'float32'.
+        timeout (float, optional): seconds before `ffmpeg` is killed. Defaults to None.
+
+    Raises:
+        CalledProcessError: raised if `ffmpeg` fails
+
+    Returns:
+        np.ndarray: read-only samples
+    """
+    validate_dtype(dtype)
+    data = src if isinstance(src, bytes) else None
+    cmd = decode_cmd("pipe:0" if data is not None else src, rate, dtype)
+
+    proc = run(cmd, input=data, timeout=timeout, capture_output=True)
+    if proc.returncode != 0:
+        raise CalledProcessError(proc.returncode, cmd, None, proc.stderr)
+
+    return np.frombuffer(proc.stdout, dtype=dtype)
+
+
+def open_raw(path: Union[Path, str], dtype: str = 'float32') -> np.memmap:
+    """Memory-map a raw mono file read-only"""
+    validate_dtype(dtype)
+    if Path(path).stat().st_size == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+def as_float(samples: np.ndarray) -> np.ndarray:
+    """Convert raw samples to float64 in [-1, 1]"""
+    if samples.dtype == np.int16:
+        return samples.astype(np.float64) / 32768
+    return samples.astype(np.float64)
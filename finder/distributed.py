@@ -0,0 +1,450 @@
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import logging
+import argparse
+import threading
+import subprocess
+import numpy as np
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Union
+
+from finder import sampling
+from finder.decode import open_raw, read_raw_meta, RAW_FORMATS
+from finder.download import fetch_bin
+from finder.findsignal import FindSignal, read_audio_file, log_result
+from finder.segments import SegmentedQuery
+
+# ---------------------------------------------------------------------------- #
+#          Spread the bins of one search over processes and machines           #
+# ---------------------------------------------------------------------------- #
+
+# The coordinator publishes the bin plan to a queue directory on a filesystem
+# shared by all nodes:
+#
+#   plan.json               source, rate, engine, format, lease and the bins
+#   query.npy               query samples at the plan's rate
+#   todo/<bin>.json         one file per unclaimed bin, claimed in name order
+#   claimed/<bin>.<worker>  claimed by an atomic rename; its mtime is the lease
+#   results/<bin>.json      first result of each bin, written with an atomic link
+#   STOP                    global early stop, e.g. after a confident match
+#
+# Workers refresh the mtime of their claims while they work. A claim whose
+# lease ran out belongs to a dead worker and is taken over by renaming it; a
+# claim that is merely slow is scored again by an idle worker, and whichever
+# result is linked first wins. A source that is a local raw file
+# (`decode.decode_to_raw`) is read directly, so everything runs offline.
+
+PLAN = 'plan.json'
+QUERY = 'query.npy'
+STOP = 'STOP'
+
+
+def _bin_name(k: int) -> str:
+    return f"{k:06d}"
+
+
+def publish(
+        queue: Union[Path, str],
+        source: str,
+        query: np.ndarray,
+        rate: int,
+        bins: np.ndarray,
+        engine: str = 'segments',
+        fmt: int = 139,
+        loc: Union[Path, str] = None,
+        lease_s: float = 120.,
+        stop_on_match: bool = True) -> Path:
+    """Write a bin plan to a fresh queue directory
+
+    Args:
+        queue (Union[Path, str]): queue directory on a filesystem shared by all workers; its previous contents are removed
+        source (str): YouTube url, or a local raw file from `decode.decode_to_raw`
+        query (np.ndarray): query samples at `rate`
+        rate (int): analysis sampling rate
+        bins (np.ndarray): `[start, stop]` seconds of each bin, in the order they should be searched
+        engine (str, optional): `FindSignal` engine; `segments` gives a confidence that can stop the search. Defaults to 'segments'.
+        fmt (int, optional): `yt-dl` format code of the bins. Defaults to 139.
+        loc (Union[Path, str], optional): shared directory for bin files. Defaults to `queue/bins`.
+        lease_s (float, optional): seconds without a heartbeat after which a claimed bin is taken over. Defaults to 120.
+        stop_on_match (bool, optional): whether the first confident match stops all workers. Defaults to True.
+
+    Returns:
+        Path: the queue directory
+    """
+    queue = Path(queue)
+    if queue.is_dir():
+        shutil.rmtree(queue)
+    for sub in ['todo', 'claimed', 'results']:
+        (queue / sub).mkdir(parents=True)
+
+    loc = queue / 'bins' if loc is None else Path(loc)
+    loc.mkdir(parents=True, exist_ok=True)
+
+    np.save(queue / QUERY, np.asarray(query, dtype=np.float64))
+    bins = np.asarray(bins, dtype=np.int64)
+
+    plan = dict(
+        source=str(source), rate=rate, engine=engine, fmt=fmt, loc=str(loc),
+        lease_s=lease_s, stop_on_match=stop_on_match, nbins=len(bins),
+        bins=bins.tolist()
+    )
+    with open(queue / f".{PLAN}.tmp", 'w') as io:
+        json.dump(plan, io)
+    os.replace(queue / f".{PLAN}.tmp", queue / PLAN)
+
+    for k, (start, stop) in enumerate(bins.tolist()):
+        with open(queue / 'todo' / f"{_bin_name(k)}.json", 'w') as io:
+            json.dump(dict(bin=k, start=start, stop=stop), io)
+
+    logging.info(f"Published {len(bins)} bins to {queue}")
+    return queue
+
+
+def read_plan(queue: Union[Path, str]) -> Dict[str, Any]:
+    with open(Path(queue) / PLAN, 'r') as io:
+        return json.load(io)
+
+
+def request_stop(queue: Union[Path, str]) -> None:
+    (Path(queue) / STOP).touch()
+
+
+def read_results(queue: Union[Path, str]) -> Dict[int, Dict[str, Any]]:
+    """Results written so far, by bin index"""
+    results = {}
+    for p in (Path(queue) / 'results').glob('*.json'):
+        try:
+            with open(p, 'r') as io:
+                rec = json.load(io)
+        except (json.JSONDecodeError, FileNotFoundError):
+            continue
+        results[rec['bin']] = rec
+    return results
+
+
+def status(queue: Union[Path, str]) -> Dict[str, int]:
+    queue = Path(queue)
+    return dict(
+        todo=len(list((queue / 'todo').glob('*.json'))),
+        claimed=len(list((queue / 'claimed').iterdir())),
+        done=len(list((queue / 'results').glob('*.json'))),
+        stopped=int((queue / STOP).exists())
+    )
+
+
+# --------------------------------- Worker ----------------------------------- #
+
+
+class Worker:
+    def __init__(
+            self,
+            queue: Union[Path, str],
+            name: str = None,
+            poll: float = 0.5,
+            steal_after: float = None) -> None:
+        """Claim, fetch and score bins from a queue until it is done or stopped
+
+        Args:
+            queue (Union[Path, str]): queue directory written by `publish`
+            name (str, optional): unique worker name. Defaults to `<host>-<pid>`.
+            poll (float, optional): seconds between checks when there is nothing to claim. Defaults to 0.5.
+            steal_after (float, optional): seconds after which an idle worker also scores a bin claimed by a slow worker. Defaults to half the lease.
+        """
+        self.queue = Path(queue)
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.poll = poll
+
+        self.plan = read_plan(self.queue)
+        self.rate = self.plan['rate']
+        self.lease_s = self.plan['lease_s']
+        self.steal_after = self.lease_s / 2 if steal_after is None else steal_after
+
+        self.query = np.load(self.queue / QUERY)
+        self._segments: SegmentedQuery = None
+        self._source: np.ndarray = None
+        self._duplicated: set = set()
+        self.scored: List[int] = []
+
+    # -------------------------------- Claims -------------------------------- #
+
+    def _claimed_path(self, k: int) -> Path:
+        return self.queue / 'claimed' / f"{_bin_name(k)}.{self.name}"
+
+    def claim(self) -> Union[Dict[str, Any], None]:
+        """Claim the first unclaimed bin, or take over an expired claim"""
+        for p in sorted((self.queue / 'todo').glob('*.json')):
+            k = int(p.stem)
+            try:
+                os.rename(p, self._claimed_path(k))
+            except FileNotFoundError:
+                continue
+            return self._task(k)
+
+        now = time.time()
+        done = set(read_results(self.queue))
+        for p in sorted((self.queue / 'claimed').iterdir()):
+            k = int(p.name.split('.')[0])
+            if k in done:
+                continue
+            try:
+                age = now - p.stat().st_mtime
+                if age > self.lease_s:
+                    os.rename(p, self._claimed_path(k))
+                    logging.info(f"{self.name}: took over bin {k} from {p.name}")
+                    return self._task(k)
+            except FileNotFoundError:
+                continue
+
+            # a slow but live worker: score the bin as well, first result wins
+            if age > self.steal_after and k not in self._duplicated \
+                    and not p.name.endswith(f".{self.name}"):
+                self._duplicated.add(k)
+                logging.info(f"{self.name}: also scoring slow bin {k}")
+                return self._task(k, duplicate=True)
+
+        return None
+
+    def _task(self, k: int, duplicate: bool = False) -> Dict[str, Any]:
+        start, stop = self.plan['bins'][k]
+        return dict(bin=k, start=start, stop=stop, duplicate=duplicate)
+
+    def _heartbeat(self, k: int, done: threading.Event) -> None:
+        while not done.wait(self.lease_s / 3):
+            try:
+                os.utime(self._claimed_path(k))
+            except FileNotFoundError:
+                return
+
+    # ------------------------------- Scoring -------------------------------- #
+
+    def _load_bin(self, start: int, stop: int) -> np.ndarray:
+        source = self.plan['source']
+        suffix = Path(source).suffix.lstrip('.')
+
+        if suffix in RAW_FORMATS and Path(source).is_file():
+            if self._source is None:
+                meta = read_raw_meta(source)
+                if meta['rate'] != self.rate:
+                    raise ValueError(
+                        f"{source} is sampled at {meta['rate']} Hz, not {self.rate} Hz")
+                self._source = open_raw(source, meta['dtype'])
+            return np.asarray(self._source[start * self.rate:stop * self.rate], dtype=np.float64)
+
+        fname = fetch_bin(
+            source, start, stop, self.plan['fmt'], loc=Path(self.plan['loc']))
+        data, _ = read_audio_file(fname, rate=self.rate)
+        return data
+
+    def score(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        data = self._load_bin(task['start'], task['stop'])
+
+        engine = self.plan['engine']
+        if engine == 'segments' and self._segments is None:
+            self._segments = SegmentedQuery(self.query, self.rate)
+
+        finder = FindSignal(data, self.query, self.rate, segments=self._segments)
+        result, peak = finder.findsignal(how=engine)
+
+        return dict(
+            bin=task['bin'], range=[task['start'], task['stop']],
+            peak=float(peak),
+            # seconds into the bin, as logged by `Finder` for `postplot`
+            t_peak=finder.argmax / self.rate,
+            result=None if result is None else [int(t) for t in result],
+            worker=self.name, seconds=time.perf_counter() - t0
+        )
+
+    def _report(self, rec: Dict[str, Any]) -> bool:
+        """Link the result into place unless another worker was first"""
+        results = self.queue / 'results'
+        tmp = results / f".{_bin_name(rec['bin'])}.{self.name}.tmp"
+        with open(tmp, 'w') as io:
+            json.dump(rec, io)
+
+        try:
+            os.link(tmp, results / f"{_bin_name(rec['bin'])}.json")
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            tmp.unlink(missing_ok=True)
+
+    # --------------------------------- Loop --------------------------------- #
+
+    def stopped(self) -> bool:
+        return (self.queue / STOP).exists()
+
+    def finished(self) -> bool:
+        return len(read_results(self.queue)) >= self.plan['nbins']
+
+    def run(self, max_idle: float = None) -> List[int]:
+        """Work until the queue is done or stopped, or after `max_idle` seconds without work
+
+        Returns:
+            List[int]: bins this worker reported first
+        """
+        idle_since = time.monotonic()
+
+        while not self.stopped() and not self.finished():
+            task = self.claim()
+            if task is None:
+                if max_idle is not None and time.monotonic() - idle_since > max_idle:
+                    break
+                time.sleep(self.poll)
+                continue
+
+            done = threading.Event()
+            if not task['duplicate']:
+                threading.Thread(
+                    target=self._heartbeat, args=(task['bin'], done), daemon=True
+                ).start()
+
+            try:
+                rec = self.score(task)
+            except Exception as e:
+                logging.error(f"{self.name}: bin {task['bin']} failed: {type(e).__name__}: {e}")
+                # give the bin back so another worker can try
+                if not task['duplicate']:
+                    try:
+                        os.rename(
+                            self._claimed_path(task['bin']),
+                            self.queue / 'todo' / f"{_bin_name(task['bin'])}.json")
+                    except FileNotFoundError:
+                        pass
+                time.sleep(self.poll)
+                continue
+            finally:
+                done.set()
+
+            if self._report(rec):
+                self.scored.append(rec['bin'])
+                if rec['result'] is not None and self.plan['stop_on_match']:
+                    request_stop(self.queue)
+
+            self._claimed_path(task['bin']).unlink(missing_ok=True)
+            idle_since = time.monotonic()
+
+        return self.scored
+
+
+# ------------------------------- Coordinator -------------------------------- #
+
+
+def collect(
+        queue: Union[Path, str],
+        poll: float = 0.5,
+        timeout: float = None) -> Iterator[Dict[str, Any]]:
+    """Yield results as workers report them, until all bins are done or the queue is stopped"""
+    queue = Path(queue)
+    nbins = read_plan(queue)['nbins']
+    seen: set = set()
+    t0 = time.monotonic()
+
+    while True:
+        stopped = (queue / STOP).exists()
+        for k, rec in sorted(read_results(queue).items()):
+            if k not in seen:
+                seen.add(k)
+                yield rec
+
+        if stopped or len(seen) >= nbins:
+            return
+        if timeout is not None and time.monotonic() - t0 > timeout:
+            logging.warning(f"Timed out with {len(seen)} of {nbins} bins done.")
+            return
+        time.sleep(poll)
+
+
+def spawn_workers(queue: Union[Path, str], n: int, max_idle: float = None) -> List[subprocess.Popen]:
+    """Start `n` local worker processes, e.g. for testing"""
+    cmd = [sys.executable, "-m", "finder.distributed", "worker", "--queue", str(queue)]
+    if max_idle is not None:
+        cmd += ["--max-idle", str(max_idle)]
+    return [
+        subprocess.Popen(cmd + ["--name", f"{socket.gethostname()}-local{i}"])
+        for i in range(n)
+    ]
+
+
+def coordinate(
+        queue: Union[Path, str],
+        poll: float = 0.5,
+        timeout: float = None) -> List[Dict[str, Any]]:
+    """Log results in the `postplot.ReadLog` format as they arrive and return the matches"""
+    matches = []
+    for rec in collect(queue, poll=poll, timeout=timeout):
+        log_result(
+            None if rec['result'] is None else tuple(rec['result']),
+            rec['peak'], rec['t_peak'])
+        logging.info(sampling.bin2str(np.array(rec['range'])))
+        if rec['result'] is not None:
+            matches.append(rec)
+
+    logging.info(f"Queue {queue}: {status(queue)}")
+    return matches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Distributed bin search over a shared-filesystem queue")
+    sub = parser.add_subparsers(dest='role', required=True)
+
+    coord = sub.add_parser('coordinator', help="publish a search and collect results")
+    coord.add_argument('source')
+    coord.add_argument('query', type=Path)
+    coord.add_argument('--queue', type=Path, required=True)
+    coord.add_argument('--source-start', default=None)
+    coord.add_argument('--source-stop', default=None)
+    coord.add_argument('--nbins', type=int, default=10)
+    coord.add_argument('--binorder', default='mirrored')
+    coord.add_argument('--max-binwidth', type=int, default=150)
+    coord.add_argument('--engine', default='segments')
+    coord.add_argument('--fmt', default='auto', help="`yt-dl` format code, or 'auto'")
+    coord.add_argument('--lease', type=float, default=120.)
+    coord.add_argument('--local-workers', type=int, default=0)
+
+    work = sub.add_parser('worker', help="claim and score bins")
+    work.add_argument('--queue', type=Path, required=True)
+    work.add_argument('--name', default=None)
+    work.add_argument('--max-idle', type=float, default=None)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.role == 'worker':
+        Worker(args.queue, name=args.name).run(max_idle=args.max_idle)
+        return
+
+    from finder.main import Finder
+
+    finder = Finder(
+        args.source, args.query,
+        source_start=args.source_start, source_stop=args.source_stop,
+        logfile=False, engine=args.engine)
+    finder.get_bins(
+        nbins=args.nbins, binorder=args.binorder, max_binwidth=args.max_binwidth)
+
+    publish(
+        args.queue, finder.url, finder.query, finder.query_rate, finder._bins,
+        engine=args.engine, fmt=finder.choose_format(args.fmt), lease_s=args.lease)
+
+    procs = spawn_workers(args.queue, args.local_workers)
+    try:
+        matches = coordinate(args.queue)
+        logging.info(f"{len(matches)} matching bins")
+        for rec in matches:
+            t0, t1 = (rec['range'][0] + t for t in rec['result'])
+            logging.info(
+                f"Match: {sampling.format_hms(t0)} - {sampling.format_hms(t1)}, peak {rec['peak']:.2f}")
+    finally:
+        for proc in procs:
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,17 @@
 from pathlib import Path
+import os
 import re
 import logging
 from types import NoneType
-from typing import List, Tuple, Union
-from subprocess import call, Popen
-from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Tuple, Union
+from subprocess import call, run, Popen, CalledProcessError
+from urllib.parse import urlparse, parse_qs
 import validators
+import yt_dlp
 
-from finder.common import InvalidArgumentException
+from finder import instrument
+from finder.common import InvalidArgumentException, seconds2str
+from finder.singleflight import FileLock
 
 # ---------------------------------------------------------------------------- #
 #                         Download videos from YouTube                         #
@@ -23,6 +27,91 @@ def removeNonNumeric(s: str) -> str:
 
 HMSFMTSTRING = r"{H:02}:{M:02}:{S:02}"
 
+# `yt-dl` format codes and file extensions: audio-only (AAC, and Opus in WebM), and video-only at 144p
+AUDIO_FORMATS = {
+    139: 'm4a', 140: 'm4a', 599: 'm4a',
+    249: 'webm', 250: 'webm', 251: 'webm', 600: 'webm',
+}
+VIDEO_FORMATS = {160: 'mp4', 278: 'webm'}
+
+
+def format_ext(fmt: int) -> str:
+    """File extension of the streams of format `fmt`"""
+    return {**AUDIO_FORMATS, **VIDEO_FORMATS}.get(int(fmt), 'm4a')
+
+
+class AudioFormat(NamedTuple):
+    """An audio-only format offered for a video"""
+    fmt: int
+    ext: str
+    bytes_per_s: float
+    asr: Union[int, NoneType]
+
+
+def audio_formats(meta: Dict[str, Any]) -> List[AudioFormat]:
+    """Formats in `AUDIO_FORMATS` that a video offers, cheapest first
+
+    Args:
+        meta (Dict[str, Any]): metadata from `yt-dlp`, e.g. `sampling.get_video_meta`
+
+    Returns:
+        List[AudioFormat]: formats, by increasing bytes per second; those of unknown bitrate last
+    """
+    found = []
+    for f in meta.get('formats') or []:
+        try:
+            fmt = int(f.get('format_id'))
+        except (TypeError, ValueError):
+            # e.g. `251-drc`, or HLS variants
+            continue
+        if fmt not in AUDIO_FORMATS or f.get('vcodec') not in (None, 'none'):
+            continue
+
+        kbps = f.get('abr') or f.get('tbr')
+        if kbps:
+            bytes_per_s = kbps * 1000 / 8
+        elif (f.get('filesize') or f.get('filesize_approx')) and meta.get('duration'):
+            bytes_per_s = (f.get('filesize') or f.get('filesize_approx')) / meta['duration']
+        else:
+            bytes_per_s = float('inf')
+
+        found.append(AudioFormat(fmt, AUDIO_FORMATS[fmt], bytes_per_s, f.get('asr')))
+
+    return sorted(found, key=lambda f: f.bytes_per_s)
+
+
+def select_audio_format(
+        formats: List[AudioFormat],
+        rate: int,
+        fmt: int = None) -> int:
+    """Audio format with the fewest bytes per second whose sampling rate is at least `rate`
+
+    Args:
+        formats (List[AudioFormat]): offered formats, from `audio_formats`
+        rate (int): analysis sampling rate the bins are decoded at
+        fmt (int, optional): format to use if offered. Defaults to None (the cheapest).
+
+    Raises:
+        ValueError: raised if no offered format is fast enough
+
+    Returns:
+        int: `yt-dl` format code
+    """
+    usable = [f for f in formats if f.asr is None or f.asr >= rate]
+    if fmt is not None:
+        if any(f.fmt == fmt for f in usable):
+            return fmt
+        logging.warning(f"Format {fmt} is not available, choosing another")
+
+    if not usable:
+        raise ValueError(
+            f"No audio format in {list(AUDIO_FORMATS)} is available at {rate} Hz")
+
+    best = usable[0]
+    logging.info(
+        f"Format {best.fmt} ({best.ext}, {best.bytes_per_s / 1000:.1f} kB/s) for analysis at {rate} Hz")
+    return best.fmt
+
 
 def clip_minsec(hms: List[str]) -> str:
 
@@ -64,6 +153,15 @@ def getTimestamp(s: str) -> str:
 
     return extract_hms(s, n)
 
+def range_suffix(start: Union[str, int], stop: Union[str, int]) -> str:
+    """Filename suffix that identifies a time range, e.g. `_000501-000600`"""
+    return "_{}-{}".format(*[
+        removeNonNumeric(getTimestamp(
+            t if isinstance(t, str) else seconds2str(t)
+        ))
+        for t in (start, stop)
+    ])
+
 # ---------- Main functions that create and send command line inputs --------- #
 
 
@@ -77,17 +175,63 @@ def run_cmd(cmd: List[str], concurrent=True, **kwargs) -> Tuple[str, str]:
     return proc
 
 
+def get_source_id(url: str) -> str:
+    """Get the video ID of a YouTube url, e.g. `H8a2odhdruY`"""
+    parsed = urlparse(url)
+    query = parse_qs(parsed.query)
+    if 'v' in query:
+        return query['v'][0]
+
+    return url.rstrip("/").split("/")[-1]
+
+
+def media_url_expiry(media_url: str) -> Union[float, NoneType]:
+    """Expiry time (epoch seconds) of a resolved media url, if present"""
+    query = parse_qs(urlparse(media_url).query)
+    try:
+        return float(query['expire'][0])
+    except (KeyError, ValueError):
+        return None
+
+
+def resolve_media_url(url: str, fmt: int) -> str:
+    """Resolve the direct media url of format `fmt` for a YouTube video
+
+    Args:
+        url (str): YouTube url
+        fmt (int): `yt-dl` format code
+
+    Raises:
+        ValueError: raised if the video has no format `fmt`
+
+    Returns:
+        str: url that `ffmpeg` can read directly
+    """
+    with instrument.stage('resolve'):
+        meta = yt_dlp.YoutubeDL(dict(quiet=True)).extract_info(
+            url, download=False
+        )
+
+    for f in meta.get('formats', []):
+        if str(f.get('format_id')) == str(fmt):
+            return f['url']
+
+    raise ValueError(f"Format {fmt} is not available for {url}")
+
+
 def get_filename(
         url: str,
         loc: Path,
         suffix: Union[str, int],
-        how_exists: str = "ignore") -> str:
+        how_exists: str = "ignore",
+        ext: str = "m4a") -> str:
     """Get output filename from download
 
     Args:
         url (str): YouTube url
         loc (Path): output directory.
         suffix (str, int): suffix to append to end of filename stem.
+        ext (str, optional): file extension, see `format_ext`. Defaults to "m4a".
     Raises:
         TypeError: Raised if `loc` is not `NoneType` or `Path` type.
     """
@@ -98,10 +242,10 @@ def get_filename(
         suffix = ''
 
     if loc is None:
-        fn = url.split("/")[-1] + suffix + '.m4a'
+        fn = get_source_id(url) + suffix + f'.{ext}'
     elif isinstance(loc, Path):
-        fn = loc / "{}.m4a".format(
-            url.split("/")[-1] + suffix
+        fn = loc / "{}.{}".format(
+            get_source_id(url) + suffix, ext
         )
 
     if isinstance(fn, Path) and fn.is_file():
@@ -132,9 +276,9 @@ def validate_cmd_args(
 
     validators.url(url)
 
-    if not fmt in [139, 140]:
+    if not (fmt in AUDIO_FORMATS or fmt in VIDEO_FORMATS):
         raise ValueError(
-            f"Currently, only audio formats (139, 140) are supported, not {fmt}.")
+            f"Currently, only audio formats {list(AUDIO_FORMATS)} and low-resolution video formats {list(VIDEO_FORMATS)} are supported, not {fmt}. See `select_audio_format`.")
 
     if not how_exists in ['overwrite', 'create', 'ignore']:
         raise InvalidArgumentException(
@@ -152,22 +296,26 @@ def validate_cmd_args(
 
 def get_cmd(
         url: str,
-        start: str,
-        stop: str,
+        start: Union[str, int],
+        stop: Union[str, int],
         fmt: int,
         suffix: Union[int, str] = None,
         how_exists: str = 'create',
-        loc: Path = None) -> Tuple[str, str]:
+        loc: Path = None,
+        media_url: str = None,
+        outfile: str = None) -> Tuple[str, str]:
     """Create command line input for downloading YouTube video
 
     Args:
         url (str): YouTube url
-        start (str): start timestamp, in HH:MM:SS
-        stop (str): stop timestamp, in HH:MM:SS
+        start (Union[str, int]): start timestamp, in HH:MM:SS or seconds
+        stop (Union[str, int]): stop timestamp, in HH:MM:SS or seconds
         fmt (int): `yt-dl` format code
         loc (str, optional): output directory. Defaults to None (`Path.cwd()`).
         suffix (str, int): suffix to append to end of filename stem.
         how_exists (str, Optional): what to do when a file already exists. Defaults to `create`, which creates a new file. 
+        media_url (str, optional): direct media url from `resolve_media_url`. If given, `ffmpeg` reads the range directly, skipping `yt-dlp` extraction. Defaults to None.
+        outfile (str, optional): write to this path instead of the returned filename, e.g. a temporary file. Defaults to None.
 
     Returns:
                 Tuple[str, str]: command line input, filename                 
@@ -175,18 +323,28 @@ def get_cmd(
 
     validate_cmd_args(url, fmt, loc, how_exists)
 
-    start = getTimestamp(start)
-    stop = getTimestamp(stop)
-    filename = get_filename(url, loc=loc, suffix=suffix)
-
-    ffmpeg_header = "--external-downloader ffmpeg --external-downloader-args"
-    ffmpeg_cmd = f"\"ffmpeg_i:-ss {start} -to {stop}\""
-    cmd = [
-        f"yt-dlp -f {fmt}",
-        f"-o \"{filename}\"",
-        ffmpeg_header,
-        ffmpeg_cmd, url
-    ]
+    start = getTimestamp(start if isinstance(start, str) else seconds2str(start))
+    stop = getTimestamp(stop if isinstance(stop, str) else seconds2str(stop))
+    filename = get_filename(url, loc=loc, suffix=suffix, ext=format_ext(fmt))
+    target = filename if outfile is None else outfile
+    # keep only the stream the format was chosen for
+    drop = "-an" if fmt in VIDEO_FORMATS else "-vn"
+
+    if media_url is None:
+        ffmpeg_header = "--external-downloader ffmpeg --external-downloader-args"
+        ffmpeg_cmd = f"\"ffmpeg_i:-ss {start} -to {stop}\""
+        cmd = [
+            f"yt-dlp -f {fmt}",
+            f"-o \"{target}\"",
+            ffmpeg_header,
+            ffmpeg_cmd, url
+        ]
+    else:
+        cmd = [
+            f"ffmpeg -y -loglevel error -ss {start} -to {stop}",
+            f"-i \"{media_url}\" {drop} -c copy",
+            f"\"{target}\""
+        ]
     cmd = ' '.join(cmd)
 
     try:
@@ -198,3 +356,61 @@ def get_cmd(
 
     logging.debug(f"\n\nffmpeg cmd:\n{cmd}")
     return cmd, filename
+
+
+def fetch_bin(
+        url: str,
+        start: Union[str, int],
+        stop: Union[str, int],
+        fmt: int,
+        loc: Path = None,
+        media_url: str = None,
+        timeout: float = None) -> str:
+    """Download one time range of a video, safely shared between processes
+
+    The range is written to a temporary file under a lock and renamed when complete, so readers never see a half-written file and a second process waiting on the lock reuses the first download.
+
+    Args:
+        url (str): YouTube url
+        start (Union[str, int]): start timestamp, in HH:MM:SS or seconds
+        stop (Union[str, int]): stop timestamp, in HH:MM:SS or seconds
+        fmt (int): `yt-dl` format code
+        loc (Path, optional): output directory. Defaults to None (`Path.cwd()`).
+        media_url (str, optional): direct media url from `resolve_media_url`. Defaults to None.
+        timeout (float, optional): seconds before the download is killed. Defaults to None.
+
+    Raises:
+        CalledProcessError: raised if the download command fails
+
+    Returns:
+        str: path of the downloaded file
+    """
+    suffix = range_suffix(start, stop)
+    filename = Path(get_filename(
+        url, loc=loc, suffix=suffix, ext=format_ext(fmt)))
+
+    with FileLock(filename.with_name(f".{filename.name}.lock")):
+        if filename.is_file():
+            return str(filename)
+
+        part = filename.with_name(
+            f"{filename.stem}.part{os.getpid()}{filename.suffix}")
+        cmd, _ = get_cmd(
+            url, start, stop, fmt,
+            suffix=suffix, loc=loc,
+            media_url=media_url,
+            outfile=str(part)
+        )
+
+        try:
+            proc = run(cmd, shell=True, timeout=timeout, capture_output=True)
+            if proc.returncode != 0 or not part.is_file():
+                raise CalledProcessError(
+                    proc.returncode, cmd, proc.stdout, proc.stderr)
+
+            instrument.count(bytes=part.stat().st_size)
+            os.replace(part, filename)
+        finally:
+            part.unlink(missing_ok=True)
+
+    return str(filename)
@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+import numpy as np
+from pathlib import Path
+from scipy import fft as sp_fft
+from typing import Any, Dict, List, Tuple, Union
+
+# ---------------------------------------------------------------------------- #
+#       FFT backend shared by all correlation code: fast lengths, threads      #
+# ---------------------------------------------------------------------------- #
+
+# Bins are `binwidth * rate` samples long, which is often a size with large
+# prime factors. Every transform in the package goes through `BACKEND`, which
+#
+#   - pads to lengths with small prime factors (`fast_len`), or to the block
+#     length found fastest by `autotune` for the nearest tuned (query, bin)
+#     size pair, since resampled or trimmed bins are rarely the exact tuned size,
+#   - keeps one zero-padded input buffer per thread and length, so bins of the
+#     same length neither allocate nor re-plan (pocketfft caches plans by length),
+#   - runs each transform with `workers` threads.
+#
+# `python -m finder.fftbackend --query 30 --binwidth 150` benchmarks candidate
+# block lengths on this machine and saves the fastest to `data/fft_config.json`,
+# which `load` reads back.
+
+CONFIG_PATH = Path.cwd() / 'data' / 'fft_config.json'
+# largest relative difference of query and bin sizes to a tuned pair for reusing its length
+TUNED_TOLERANCE = 0.1
+
+
+def size_key(query_size: int, data_size: int) -> str:
+    return f"{query_size}:{data_size}"
+
+
+def parse_size_key(key: str) -> Tuple[int, int]:
+    query_size, data_size = key.split(':')
+    return int(query_size), int(data_size)
+
+
+class FFTBackend:
+    def __init__(self, workers: int = 1) -> None:
+        """Real FFTs with fast lengths, reusable input buffers and a thread count
+
+        Args:
+            workers (int, optional): threads per transform, as in `scipy.fft`; -1 uses all CPUs. Defaults to 1.
+        """
+        self.workers = workers
+        # tuned FFT lengths by `size_key(query_size, data_size)`
+        self.tuned: Dict[str, int] = {}
+        self._local = threading.local()
+
+    # ------------------------------ Transforms ------------------------------ #
+
+    @staticmethod
+    def fast_len(n: int) -> int:
+        return sp_fft.next_fast_len(n, real=True)
+
+    def _buffer(self, nfft: int) -> np.ndarray:
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = self._local.buffers = {}
+
+        buf = buffers.get(nfft)
+        if buf is None:
+            # a few lengths at a time, e.g. bins, the query and a last short bin
+            if len(buffers) >= 8:
+                buffers.clear()
+            buf = buffers[nfft] = np.empty(nfft)
+        return buf
+
+    def rfft(self, x: np.ndarray, nfft: int) -> np.ndarray:
+        """Real FFT of `x` zero-padded (or truncated) to `nfft` points"""
+        n = min(x.size, nfft)
+        buf = self._buffer(nfft)
+        buf[:n] = x[:n]
+        buf[n:] = 0
+        return sp_fft.rfft(buf, workers=self.workers)
+
+    def irfft(self, spec: np.ndarray, nfft: int) -> np.ndarray:
+        return sp_fft.irfft(spec, nfft, overwrite_x=True, workers=self.workers)
+
+    # ------------------------------ Planning -------------------------------- #
+
+    def plan_len(self, query_size: int, data_size: int) -> int:
+        """FFT length for correlating `data_size` samples with `query_size` samples
+
+        The tuned length of the nearest tuned pair of sizes, within `TUNED_TOLERANCE`; it may be shorter than the full correlation, in which case overlap-save blocks of this length are used. Otherwise, or if the tuned pair was correlated whole but this one does not fit, the next fast length of the full correlation.
+        """
+        full = data_size + query_size - 1
+        tuned = self._nearest_tuned(query_size, data_size)
+        if tuned is not None:
+            nfft, tuned_full = tuned
+            if nfft >= full or (nfft < tuned_full and nfft >= 2 * query_size):
+                return nfft
+        return self.fast_len(full)
+
+    def _nearest_tuned(self, query_size: int, data_size: int) -> Union[Tuple[int, int], None]:
+        """Tuned length and full correlation length of the closest tuned pair of sizes"""
+        best, best_dist = None, TUNED_TOLERANCE
+        for key, nfft in self.tuned.items():
+            m, n = parse_size_key(key)
+            dist = max(abs(m - query_size) / m, abs(n - data_size) / n)
+            if dist <= best_dist:
+                best, best_dist = (nfft, m + n - 1), dist
+        return best
+
+    def load(self, path: Union[Path, str] = CONFIG_PATH) -> bool:
+        """Use the lengths and thread count saved by `autotune`, if the file exists"""
+        path = Path(path)
+        if not path.is_file():
+            return False
+
+        with open(path, 'r') as io:
+            config = json.load(io)
+
+        self.workers = config.get('workers', self.workers)
+        self.tuned.update({
+            k: v['nfft'] for k, v in config.get('sizes', {}).items()
+        })
+        logging.info(
+            f"FFT backend: {self.workers} workers, {len(self.tuned)} tuned sizes from {path}"
+        )
+        return True
+
+
+BACKEND = FFTBackend()
+
+
+def full_correlate(
+        data: np.ndarray,
+        query: np.ndarray,
+        qspec: np.ndarray,
+        nfft: int) -> np.ndarray:
+    """Full cross-correlation from the conjugate query spectrum of length `nfft`
+
+    If `nfft` is shorter than the full correlation, `data` is processed in overlap-save blocks.
+    """
+    n, m = data.size, query.size
+
+    if nfft >= n + m - 1:
+        spec = BACKEND.rfft(data, nfft)
+        spec *= qspec
+        circ = BACKEND.irfft(spec, nfft)
+        # negative lags wrap around to the end of the circular correlation
+        return np.concatenate((circ[nfft-(m-1):], circ[:n]))
+
+    # 'valid' correlation of `data` padded with `m - 1` zeros on both sides
+    padded = np.concatenate((np.zeros(m - 1), data, np.zeros(m - 1)))
+    step = nfft - m + 1
+    out = np.empty(n + m - 1)
+
+    for pos in range(0, out.size, step):
+        seg = padded[pos:pos + nfft]
+        spec = BACKEND.rfft(seg, nfft)
+        spec *= qspec
+        k = min(step, out.size - pos, seg.size - m + 1)
+        out[pos:pos + k] = BACKEND.irfft(spec, nfft)[:k]
+
+    return out
+
+
+# -------------------------------- Autotune ---------------------------------- #
+
+
+def _time(fn, repeats: int) -> float:
+    fn()
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times))
+
+
+def candidate_lengths(query_size: int, data_size: int) -> List[int]:
+    """Whole-bin lengths and power-of-two overlap-save blocks worth benchmarking"""
+    full = data_size + query_size - 1
+    lengths = {FFTBackend.fast_len(full), 2**int(np.ceil(np.log2(full)))}
+
+    block = 2**int(np.ceil(np.log2(2 * query_size)))
+    while block < full:
+        lengths.add(block)
+        block *= 2
+
+    return sorted(lengths)
+
+
+def autotune(
+        query_size: int,
+        data_size: int,
+        workers: List[int] = None,
+        repeats: int = 5) -> Dict[str, Any]:
+    """Benchmark FFT lengths and thread counts for one pair of sizes
+
+    Args:
+        query_size (int): query samples
+        data_size (int): bin samples, i.e. `binwidth * rate`
+        workers (List[int], optional): thread counts to try. Defaults to 1, 2, 4 and all CPUs.
+        repeats (int, optional): timed runs per candidate. Defaults to 5.
+
+    Returns:
+        Dict[str, Any]: fastest `nfft` and `workers`, their time per bin, and all timings
+    """
+    if workers is None:
+        workers = sorted({1, 2, 4, os.cpu_count() or 1})
+
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal(data_size)
+    query = rng.standard_normal(query_size)
+
+    saved = BACKEND.workers
+    timings: List[Tuple[int, int, float]] = []
+    try:
+        for w in workers:
+            BACKEND.workers = w
+            for nfft in candidate_lengths(query_size, data_size):
+                qspec = np.conj(BACKEND.rfft(query, nfft))
+                t = _time(lambda: full_correlate(data, query, qspec, nfft), repeats)
+                timings.append((nfft, w, t))
+                print(f"nfft: {nfft:<10} workers: {w:<4} {t*1e3:>10.3f} ms")
+    finally:
+        BACKEND.workers = saved
+
+    nfft, w, t = min(timings, key=lambda x: x[2])
+    return dict(
+        nfft=nfft, workers=w, seconds=t,
+        timings=[dict(nfft=a, workers=b, seconds=c) for a, b, c in timings]
+    )
+
+
+def save_tuning(
+        result: Dict[str, Any],
+        query_size: int,
+        data_size: int,
+        path: Union[Path, str] = CONFIG_PATH) -> None:
+    """Add the result of `autotune` to the config file, keeping other sizes"""
+    path = Path(path)
+    config: Dict[str, Any] = {}
+    if path.is_file():
+        with open(path, 'r') as io:
+            config = json.load(io)
+
+    config['workers'] = result['workers']
+    config.setdefault('sizes', {})[size_key(query_size, data_size)] = dict(
+        nfft=result['nfft'], workers=result['workers'], seconds=result['seconds']
+    )
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as io:
+        json.dump(config, io, indent=2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Find the fastest FFT length and thread count for a query length and bin width."
+    )
+    parser.add_argument('--query', type=float, required=True, help="query duration in seconds")
+    parser.add_argument('--binwidth', type=float, required=True, help="bin width in seconds")
+    parser.add_argument('--rate', type=int, default=441, help="analysis sampling rate")
+    parser.add_argument('--workers', type=int, nargs='*', default=None)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--out', type=Path, default=CONFIG_PATH)
+    args = parser.parse_args()
+
+    m = int(args.query * args.rate)
+    n = int(args.binwidth * args.rate)
+    result = autotune(m, n, workers=args.workers, repeats=args.repeats)
+    save_tuning(result, m, n, path=args.out)
+
+    print(
+        f"Fastest: nfft {result['nfft']} with {result['workers']} workers, "
+        f"{result['seconds']*1e3:.3f} ms per bin. Saved to {args.out}"
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -5,10 +5,15 @@ import audiofile
 import numpy as np
 from pathlib import Path
 import matplotlib.pyplot as plt
-from typing import Tuple, Union
-from scipy.signal import correlate, correlation_lags
+from typing import Hashable, List, Tuple, Union
+from scipy.signal import correlation_lags
 
+from finder import instrument
+from finder.decode import decode_to_array
+from finder.fftbackend import BACKEND, full_correlate
+from finder.peaks import Occurrence, top_k_peaks
 from finder.common import InvalidArgumentException
+from finder.segments import SegmentedQuery, Verdict
 
 # ---------------------------------------------------------------------------- #
 #        Find endpoints of a query signal inside a larger source signal        #
@@ -19,7 +24,8 @@ def read_audio_data(
         name: str,
         dir: Union[Path, str],
         ext: str = "m4a",
-        down_factor: int = 100) -> Tuple[np.ndarray, int]:
+        down_factor: int = 100,
+        rate: int = None) -> Tuple[np.ndarray, int]:
     """Read audio files as numpy ndarrays
 
     Args:
@@ -27,6 +33,7 @@ def read_audio_data(
         dir (Union[Path, str]): directory containing audio files
         ext (str, optional): extension. Defaults to ".m4a".
         down_factor (int, optional): downsampling factor. Defaults to 100.
+        rate (int, optional): see `read_audio_file`. Defaults to None.
 
     Raises:
         FileNotFoundError: raised if no files matching `dir/name*.ext` are found
@@ -60,15 +67,91 @@ def read_audio_data(
         raise FileNotFoundError(f"{dir}/{name}{ext}")
 
     for data in dataFiles:
-        print(f"Reading... {str(data):<8}")
-        signal, sampling_rate = audiofile.read(data)
+        yield read_audio_file(data, down_factor=down_factor, rate=rate)
+
+
+def read_audio_file(
+        path: Union[Path, str],
+        down_factor: int = 100,
+        rate: int = None) -> Tuple[np.ndarray, int]:
+    """Read a single audio file as a numpy ndarray
+
+    Args:
+        path (Union[Path, str]): path to the audio file
+        down_factor (int, optional): downsampling factor, keeping only the first channel and without anti-aliasing. Ignored if `rate` is given. Defaults to 100.
+        rate (int, optional): decode with `ffmpeg` straight to mono at this sampling rate (`decode.decode_to_array`), so files with different original rates match. Defaults to None.
+
+    Returns:
+        Tuple[np.ndarray, int]: amplitudes and sampling rate
+    """
+    print(f"Reading... {str(path):<8}")
+    with instrument.stage('decode'):
+        if rate is not None:
+            signal = decode_to_array(path, rate)
+            instrument.count(audio_seconds=signal.size / rate)
+            return signal, rate
+
+        signal, sampling_rate = audiofile.read(path)
         if down_factor > 0:
             signal = signal[0, ::down_factor]
             sampling_rate = int(sampling_rate / down_factor)
         else:
             signal = signal[0, :]
 
-        yield signal, sampling_rate
+        instrument.count(audio_seconds=signal.size / sampling_rate)
+
+    return signal, sampling_rate
+
+
+def xcorr(
+        data: np.ndarray,
+        query: np.ndarray,
+        spectra=None,
+        query_key: Hashable = None) -> np.ndarray:
+    """Full cross-correlation of `data` and `query` via real FFTs
+
+    Equivalent to `correlate(data, query, method='fft')`, but transforms go through `fftbackend.BACKEND` (fast or tuned lengths, reused buffers, threads), and the conjugate spectrum of `query` can be cached and reused for every bin of the same length.
+
+    Args:
+        data (np.ndarray): data signal
+        query (np.ndarray): query signal
+        spectra (LRUCache, optional): cache of query spectra keyed by `(query_key, nfft)`. Defaults to None.
+        query_key (Hashable, optional): key identifying `query`, e.g. a hash of its samples. Defaults to None.
+
+    Returns:
+        np.ndarray: cross-correlation of length `data.size + query.size - 1`
+    """
+    n, m = data.size, query.size
+    nfft = BACKEND.plan_len(m, n)
+
+    qspec = None
+    if spectra is not None and query_key is not None:
+        qspec = spectra.get((query_key, nfft))
+
+    if qspec is None:
+        qspec = np.conj(BACKEND.rfft(query, nfft))
+        if spectra is not None and query_key is not None:
+            spectra.put((query_key, nfft), qspec)
+
+    return full_correlate(data, query, qspec, nfft)
+
+
+def log_result(
+        result: Union[Tuple[int, int], None],
+        peak: float,
+        t_peak: float) -> str:
+    """Log the outcome of one comparison in the format parsed by `postplot.ReadLog`"""
+    if result is None:
+        msg = f"Peak: ({t_peak:.1f}, {peak:.1e})"
+    else:
+        t0, t1 = result
+        msg = f"Corr: {peak:<10} Start: {t0:<10} Stop: {t1:<10}"
+
+    logging.info(msg)
+    return msg
+
+
+ENGINES = ['xcorr', 'segments']
 
 
 class FindSignal:
@@ -78,7 +161,11 @@ class FindSignal:
             query: np.ndarray,
             rate: int,
             how_argmax='whole',
-            how_t0='query') -> None:
+            how_t0='query',
+            spectra=None,
+            query_key: Hashable = None,
+            segments: SegmentedQuery = None,
+            threshold: float = 0.5) -> None:
         """Find start and stop times of a `query` signal inside a `data` signal
 
         Args:
@@ -88,14 +175,17 @@ class FindSignal:
             how_argmax (str, optional): how to compute the `argmax` of cross-correlated `data` and `query`. Defaults to 'whole'.
 
             * `whole` : `argmax` over the entire cross-correlation array
-            * `inds` : pre-computes indices where cross-correlation is above 0.5, then finds the `argmax` over these
+            * `inds` : pre-computes indices where cross-correlation is above `threshold`, then finds the `argmax` over these
 
             how_t0 (str, optional): how to compute start time. Defaults to 'query'.
 
             * `query`: `stop time - query duration = start time`. 
             * `lags` : the start time is the `argmax` of cross-correlation lags.
 
-            plot (bool, optional): whether to plot results. Defaults to False.
+            spectra (LRUCache, optional): cache of query spectra shared between bins and searches. Defaults to None.
+            query_key (Hashable, optional): key identifying `query` in `spectra`. Defaults to None.
+            segments (SegmentedQuery, optional): segmented `query` for `findsignal(how='segments')`, shared between bins. Defaults to None (segment on demand).
+            threshold (float, optional): minimum correlation of a match: the raw peak of `xcorr`, or the normalized `accept` level of `SegmentedQuery.score`. Defaults to 0.5.
 
         Returns:
             Tuple[int, int]: start and stop times
@@ -123,10 +213,21 @@ class FindSignal:
         self._how_argmax = how_argmax
         self._how_t0 = how_t0
 
+        self._spectra = spectra
+        self._query_key = query_key
+
+        self._segments = segments
+        self.threshold = threshold
+
+        self.argmax: int = None
+        self.corr: np.ndarray = None
+        # outcome of `find_segments`, if it ran
+        self.verdict: Verdict = None
+
     def parse_times(self, corr: np.ndarray) -> Tuple[int, int]:
 
         if self._how_argmax == 'inds':
-            inds = np.where(corr > 0.5)[0]
+            inds = np.where(corr > self.threshold)[0]
             t1 = inds[np.argmax(corr[inds])]
         else:
             t1 = np.argmax(corr)
@@ -160,11 +261,72 @@ class FindSignal:
         ax.legend(loc='upper left', bbox_to_anchor=[0.9, 1.1])
         plt.show()
 
+    def find_segments(self, **score_kwargs) -> Tuple[tuple, float]:
+        """Score with the most distinctive query segment first, then confirm by offset voting
+
+        Bins where the first segment fails are rejected after a single short correlation. Clips with cuts are still found as long as enough segments agree on one offset.
+        """
+        if self._segments is None:
+            self._segments = SegmentedQuery(self.query, self.rate)
+
+        with instrument.stage('correlate', audio_seconds=self.data.size / self.rate):
+            verdict = self._segments.score(
+                self.data, **{'accept': self.threshold, **score_kwargs})
+        self.verdict = verdict
+
+        self.argmax = verdict.start + self.query.size - 1
+
+        if not verdict.found:
+            log_result(None, verdict.peak, verdict.start/self.rate)
+            return None, verdict.peak
+
+        t0 = math.floor(verdict.start / self.rate)
+        t1 = t0 + int(self.query.shape[0] / self.rate)
+        log_result((t0, t1), verdict.peak, verdict.start/self.rate)
+
+        return (t0, t1), verdict.peak
+
+    def find_peaks(self, k: int, window: float = 1.) -> List[Occurrence]:
+        """Top-`k` occurrences of the query in `data` after non-maximum suppression
+
+        Args:
+            k (int): maximum number of occurrences
+            window (float, optional): width of the suppression window, as a fraction of the query length. Defaults to 1.
+
+        Returns:
+            List[Occurrence]: occurrences, highest first, times in seconds of `data`
+        """
+        if self.corr is None:
+            with instrument.stage('correlate', audio_seconds=self.data.size / self.rate):
+                self.corr = xcorr(
+                    self.data, self.query,
+                    spectra=self._spectra,
+                    query_key=self._query_key
+                )
+
+        m = self.query.size
+        ind, val = top_k_peaks(self.corr, k, int(window * m))
+
+        # index `i` of the full correlation is where the query ends
+        return [
+            Occurrence(float((i - m + 1) / self.rate), float((i + 1) / self.rate), float(v))
+            for i, v in zip(ind, val) if i >= 0
+        ]
+
     def findsignal(self, how='xcorr', plot=False) -> Tuple[tuple, float]:
 
-        if how == 'xcorr':
+        if how == 'segments':
+            return self.find_segments()
+        elif how != 'xcorr':
+            raise InvalidArgumentException('how', how, ENGINES)
+
+        with instrument.stage('correlate', audio_seconds=self.data.size / self.rate):
             try:
-                res = correlate(self.data, self.query, method='fft')
+                res = xcorr(
+                    self.data, self.query,
+                    spectra=self._spectra,
+                    query_key=self._query_key
+                )
             except ValueError as e:
                 print(
                     f"""
@@ -174,18 +336,16 @@ class FindSignal:
                 )
                 raise ValueError(e)
 
-            peak = np.max(res)
-        else:
-            raise NotImplementedError()
+        self.corr = res
+        peak = np.max(res)
+        self.argmax = int(np.argmax(res))
 
-        if res[res > 0.5].shape[0] < 1:
-            t1 = np.argmax(res)/self.rate
-            logging.info(f"Peak: ({t1:.1f}, {peak:.1e})")
+        if res[res > self.threshold].shape[0] < 1:
+            log_result(None, peak, self.argmax/self.rate)
             return None, peak
 
         t0, t1 = self.parse_times(res)
-        msg = f"Corr: {peak:<10} Start: {t0:<10} Stop: {t1:<10}"
-        logging.info(msg)
+        msg = log_result((t0, t1), peak, self.argmax/self.rate)
 
         if plot:
             self._plot_found_signal(res, (t0, t1), msg)
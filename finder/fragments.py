@@ -0,0 +1,360 @@
+import os
+import struct
+import logging
+import threading
+import http.client
+import numpy as np
+from pathlib import Path
+from urllib.parse import urlsplit, urljoin
+from subprocess import run, CalledProcessError
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+from finder import instrument
+from finder.singleflight import FileLock
+from finder.download import get_filename, range_suffix
+
+# ---------------------------------------------------------------------------- #
+#     Fetch bins as exact fragment byte ranges of DASH audio (formats 139/140)  #
+# ---------------------------------------------------------------------------- #
+
+# YouTube's DASH audio formats are fragmented MP4:
+#
+#   ftyp | moov | sidx | moof mdat | moof mdat | ...
+#
+# The `sidx` box lists the byte size and duration of every fragment, so the
+# index is read once per media url and each bin maps to one contiguous byte
+# range. Ranges are requested over a pool of keep-alive connections (one TLS
+# handshake per connection, not per bin), the init segment (ftyp + moov) is
+# prepended, and ffmpeg reads the result from stdin to cut the exact bin.
+
+FRAGMENT_FORMATS = [139, 140]
+PROBE_BYTES = 64 * 1024
+
+
+# ------------------------------- HTTP client -------------------------------- #
+
+
+class ConnectionPool:
+    def __init__(self, max_per_host: int = 4, timeout: float = 30.) -> None:
+        """Keep-alive HTTP(S) connections, at most `max_per_host` in use per host
+
+        Args:
+            max_per_host (int, optional): concurrent requests per host. Defaults to 4.
+            timeout (float, optional): socket timeout in seconds. Defaults to 30.
+        """
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+
+        self._idle: Dict[tuple, List[http.client.HTTPConnection]] = {}
+        self._slots: Dict[tuple, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+        self.opened = 0
+        self.requests = 0
+
+    def _slot(self, key: tuple) -> threading.BoundedSemaphore:
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.max_per_host)
+            return self._slots[key]
+
+    def _checkout(self, key: tuple) -> http.client.HTTPConnection:
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+            self.opened += 1
+
+        scheme, netloc = key
+        cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return cls(netloc, timeout=self.timeout)
+
+    def _checkin(self, key: tuple, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+    def close(self) -> None:
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle.clear()
+
+    def get(
+            self,
+            url: str,
+            start: int = None,
+            stop: int = None,
+            max_redirects: int = 3) -> bytes:
+        """GET `url`, or bytes `start` to `stop` (inclusive) of it
+
+        Raises:
+            ConnectionError: raised if the server answers with an error status
+        """
+        headers = {}
+        if start is not None:
+            headers['Range'] = f"bytes={start}-{'' if stop is None else stop}"
+
+        for _ in range(max_redirects + 1):
+            parts = urlsplit(url)
+            key = (parts.scheme, parts.netloc)
+            path = parts.path + (f"?{parts.query}" if parts.query else '')
+
+            with self._slot(key):
+                status, location, body = self._request(key, path, headers)
+
+            if status in (301, 302, 303, 307, 308) and location:
+                url = urljoin(url, location)
+                continue
+            if status not in (200, 206):
+                raise ConnectionError(f"GET {parts.netloc}{parts.path}: HTTP {status}")
+
+            # the server ignored the range
+            if status == 200 and start is not None:
+                body = body[start:None if stop is None else stop + 1]
+
+            instrument.count(bytes=len(body))
+            return body
+
+        raise ConnectionError(f"Too many redirects for {url}")
+
+    def _request(
+            self,
+            key: tuple,
+            path: str,
+            headers: Dict[str, str]) -> Tuple[int, str, bytes]:
+
+        # an idle connection may have been closed by the server; retry once on a new one
+        for attempt in range(2):
+            conn = self._checkout(key)
+            try:
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+                body = resp.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if attempt:
+                    raise
+                continue
+
+            with self._lock:
+                self.requests += 1
+
+            if resp.will_close:
+                conn.close()
+            else:
+                self._checkin(key, conn)
+            return resp.status, resp.getheader('Location'), body
+
+
+POOL = ConnectionPool()
+
+
+# -------------------------------- MP4 index --------------------------------- #
+
+
+class SegmentIndex(NamedTuple):
+    """Fragments of a fragmented MP4 file, from its `sidx` box"""
+    init_size: int
+    starts: np.ndarray
+    durations: np.ndarray
+    offsets: np.ndarray
+    sizes: np.ndarray
+
+    def byte_range(self, start: float, stop: float) -> Tuple[int, int, float]:
+        """First and last byte (inclusive) of the fragments covering `[start, stop)` seconds, and the start time of the first"""
+        ends = self.starts + self.durations
+        i0 = int(np.searchsorted(ends, start, side='right'))
+        i1 = int(np.searchsorted(self.starts, stop, side='left'))
+        i0 = min(i0, len(self.starts) - 1)
+        i1 = max(i1, i0 + 1)
+
+        first = int(self.offsets[i0])
+        last = int(self.offsets[i1 - 1] + self.sizes[i1 - 1] - 1)
+        return first, last, float(self.starts[i0])
+
+
+def iter_boxes(data: bytes, offset: int = 0) -> Iterator[Tuple[str, int, int, int]]:
+    """Top-level boxes in `data`: type, start, size and header size
+
+    Stops at the first box whose header is incomplete; its size may exceed `data`.
+    """
+    pos = offset
+    while pos + 8 <= len(data):
+        size, kind = struct.unpack('>I4s', data[pos:pos + 8])
+        header = 8
+        if size == 1:
+            if pos + 16 > len(data):
+                return
+            size = struct.unpack('>Q', data[pos + 8:pos + 16])[0]
+            header = 16
+        elif size == 0:
+            size = len(data) - pos
+
+        if size < header:
+            raise ValueError(f"Invalid MP4 box size {size} at byte {pos}")
+
+        yield kind.decode('latin-1'), pos, size, header
+        pos += size
+
+
+def parse_sidx(data: bytes, start: int, size: int, header: int, init_size: int) -> SegmentIndex:
+    """Parse the `sidx` box at `data[start:start+size]`"""
+    p = start + header
+    version = data[p]
+    timescale = struct.unpack('>I', data[p + 8:p + 12])[0]
+    p += 12
+
+    if version == 0:
+        earliest, first_offset = struct.unpack('>II', data[p:p + 8])
+        p += 8
+    else:
+        earliest, first_offset = struct.unpack('>QQ', data[p:p + 16])
+        p += 16
+
+    count = struct.unpack('>H', data[p + 2:p + 4])[0]
+    p += 4
+
+    refs = np.frombuffer(data, dtype='>u4', count=3 * count, offset=p).reshape(count, 3)
+    if np.any(refs[:, 0] >> 31):
+        raise ValueError("Hierarchical segment indexes are not supported.")
+
+    sizes = (refs[:, 0] & 0x7FFFFFFF).astype(np.int64)
+    durations = refs[:, 1].astype(np.float64) / timescale
+    offsets = start + size + first_offset + np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    starts = earliest / timescale + np.concatenate(([0.], np.cumsum(durations)[:-1]))
+
+    return SegmentIndex(init_size, starts, durations, offsets, sizes)
+
+
+def read_index(url: str, pool: ConnectionPool = POOL) -> SegmentIndex:
+    """Read the `sidx` box of a fragmented MP4 file, fetching only the bytes before the first fragment"""
+    data = pool.get(url, 0, PROBE_BYTES - 1)
+    init_size = None
+
+    while True:
+        need = None
+        for kind, start, size, header in iter_boxes(data):
+            if kind in ('moof', 'mdat'):
+                break
+            if kind == 'sidx':
+                if start + size <= len(data):
+                    return parse_sidx(data, start, size, header, init_size or start)
+                need = start + size
+                break
+            if kind in ('ftyp', 'moov') and start + size > len(data):
+                need = start + size
+                break
+            init_size = start + size if kind in ('ftyp', 'moov') else init_size
+        else:
+            need = len(data) + PROBE_BYTES
+
+        if need is None:
+            raise ValueError(f"No segment index before the first fragment of {url}")
+
+        data += pool.get(url, len(data), need - 1)
+
+
+_INDEXES: Dict[str, SegmentIndex] = {}
+_INDEX_LOCK = threading.Lock()
+
+
+def get_index(url: str, pool: ConnectionPool = POOL) -> SegmentIndex:
+    """`read_index`, once per media url"""
+    with _INDEX_LOCK:
+        index = _INDEXES.get(url)
+    if index is None:
+        with instrument.stage('index'):
+            index = read_index(url, pool)
+        with _INDEX_LOCK:
+            _INDEXES[url] = index
+    return index
+
+
+# ------------------------------ Fetch and cut ------------------------------- #
+
+
+def read_range(
+        media_url: str,
+        start: float,
+        stop: float,
+        pool: ConnectionPool = POOL) -> Tuple[bytes, float]:
+    """Init segment and the fragments covering `[start, stop)` seconds, as one playable MP4
+
+    Returns:
+        Tuple[bytes, float]: file contents, and the source time at which they start
+    """
+    index = get_index(media_url, pool)
+    first, last, t0 = index.byte_range(start, stop)
+
+    init = _init_segment(media_url, index, pool)
+    return init + pool.get(media_url, first, last), t0
+
+
+_INITS: Dict[str, bytes] = {}
+
+
+def _init_segment(media_url: str, index: SegmentIndex, pool: ConnectionPool) -> bytes:
+    init = _INITS.get(media_url)
+    if init is None:
+        init = _INITS[media_url] = pool.get(media_url, 0, index.init_size - 1)
+    return init
+
+
+def cut_cmd(offset: float, duration: float, outfile: str) -> List[str]:
+    """`ffmpeg` command cutting `duration` seconds at `offset` from an MP4 on stdin"""
+    return [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "mp4", "-i", "pipe:0",
+        "-ss", f"{offset:.3f}", "-t", f"{duration:.3f}",
+        "-vn", "-c", "copy", "-f", "mp4", outfile
+    ]
+
+
+def fetch_fragments(
+        url: str,
+        media_url: str,
+        start: int,
+        stop: int,
+        loc: Path = None,
+        pool: ConnectionPool = POOL,
+        timeout: float = None) -> str:
+    """Drop-in for `download.fetch_bin` that fetches only the fragments of the bin
+
+    Args:
+        url (str): YouTube url, for the file name
+        media_url (str): direct url of a fragmented MP4 format, e.g. 139 or 140
+        start (int): start of the bin in seconds
+        stop (int): stop of the bin in seconds
+        loc (Path, optional): output directory. Defaults to None (`Path.cwd()`).
+        pool (ConnectionPool, optional): keep-alive connections. Defaults to POOL.
+        timeout (float, optional): seconds before `ffmpeg` is killed. Defaults to None.
+
+    Raises:
+        CalledProcessError: raised if `ffmpeg` fails
+
+    Returns:
+        str: path of the bin file
+    """
+    filename = Path(get_filename(url, loc=loc, suffix=range_suffix(start, stop)))
+
+    with FileLock(filename.with_name(f".{filename.name}.lock")):
+        if filename.is_file():
+            return str(filename)
+
+        data, t0 = read_range(media_url, start, stop, pool)
+        part = filename.with_name(
+            f"{filename.stem}.part{os.getpid()}{filename.suffix}")
+        cmd = cut_cmd(start - t0, stop - start, str(part))
+
+        try:
+            proc = run(cmd, input=data, timeout=timeout, capture_output=True)
+            if proc.returncode != 0 or not part.is_file():
+                raise CalledProcessError(
+                    proc.returncode, cmd, proc.stdout, proc.stderr)
+            os.replace(part, filename)
+        finally:
+            part.unlink(missing_ok=True)
+
+    logging.debug(f"{filename.name}: {len(data)} bytes from fragments")
+    return str(filename)
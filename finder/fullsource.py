@@ -0,0 +1,86 @@
+import logging
+import numpy as np
+from typing import Iterator, NamedTuple
+
+from finder import instrument
+from finder.overlapsave import (
+    OVERLAP_ADD_QUERY_SHARE, OverlapAdd, OverlapSave, block_size_for_budget)
+from finder.spectrumcache import SpectrumCache
+
+# ---------------------------------------------------------------------------- #
+#        Search a whole source decoded once to a memory-mapped raw file        #
+# ---------------------------------------------------------------------------- #
+
+
+class BlockPeak(NamedTuple):
+    """Best match inside one block of the source, all times in seconds of the source"""
+    block_start: float
+    block_stop: float
+    peak: float
+    start: float
+    stop: float
+
+
+def correlate_source(
+        source: np.ndarray,
+        query: np.ndarray,
+        rate: int,
+        memory_budget: int = 64 * 2**20,
+        start: float = 0,
+        stop: float = None,
+        spectra: SpectrumCache = None,
+        source_id: str = None) -> Iterator[BlockPeak]:
+    """Correlate `query` with `source[start:stop]` under a fixed memory budget
+
+    Args:
+        source (np.ndarray): mono source samples, e.g. `numpy.memmap` from `decode.open_raw`. Sample `i` is at time `i / rate`.
+        query (np.ndarray): query samples at the same `rate`
+        rate (int): sampling rate of both signals
+        memory_budget (int, optional): bytes available for FFT buffers. Defaults to 64 MiB.
+        start (float, optional): start of the searched range, in seconds. Defaults to 0.
+        stop (float, optional): stop of the searched range, in seconds. Defaults to None (end of source).
+        spectra (SpectrumCache, optional): cache of the spectra of the source blocks. With it, the forward FFTs of the source are computed once for all queries, and each query costs one product and one inverse FFT per block. Defaults to None.
+        source_id (str, optional): id of the source in `spectra`. Required with `spectra`.
+
+    Yields:
+        BlockPeak: peak correlation of each block
+    """
+    nfft = block_size_for_budget(memory_budget, query.size)
+
+    logging.info(
+        f"Full-source search: {source.shape[0]/rate:.0f} s at {rate} Hz, block size {nfft}"
+    )
+
+    n = source.shape[0]
+    stop_ind = n if stop is None else min(int(stop * rate), n)
+    dur = query.size / rate
+
+    if spectra is not None and query.size - 1 > nfft // OVERLAP_ADD_QUERY_SHARE:
+        logging.info("Query too long for cached block spectra at this block size")
+        spectra = None
+
+    if spectra is None:
+        blocks = OverlapSave(query, nfft).iter_correlate(source, int(start * rate), stop_ind)
+    else:
+        if source_id is None:
+            raise ValueError("`source_id` is required with `spectra`")
+        blocks = OverlapAdd(query, nfft).iter_correlate(
+            spectra.get(source_id, rate, nfft, source), n, int(start * rate), stop_ind)
+
+    while True:
+        with instrument.stage('correlate'):
+            offset, corr = next(blocks, (None, None))
+            if corr is None:
+                break
+            instrument.count(audio_seconds=(corr.size + query.size - 1) / rate)
+
+        i = int(np.argmax(corr))
+        t0 = (offset + i) / rate
+
+        yield BlockPeak(
+            block_start=offset / rate,
+            block_stop=(offset + corr.size) / rate + dur,
+            peak=float(corr[i]),
+            start=t0,
+            stop=t0 + dur
+        )
@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import cProfile
+import threading
+import tracemalloc
+import contextvars
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Union
+
+# ---------------------------------------------------------------------------- #
+#            Per-stage timing, throughput and memory instrumentation           #
+# ---------------------------------------------------------------------------- #
+
+# Stages recorded by the rest of the package:
+#
+#   resolve      yt-dlp metadata / media url extraction
+#   download     ffmpeg range extraction of one bin (bytes downloaded)
+#   decode       reading a bin into a numpy array (audio seconds)
+#   correlate    cross-correlation of one bin with the query (audio seconds)
+#   plot         plotting peak correlations
+#
+# Times are wall-clock (`perf_counter`), CPU of the calling thread (`thread_time`),
+# and CPU of finished child processes such as ffmpeg (`os.times`, process-wide and
+# always 0 on Windows). Peak allocations come from `tracemalloc` and are only
+# recorded when `trace_memory=True`; for stages running concurrently in several
+# threads they are upper bounds.
+
+COUNTERS = ['bytes', 'audio_seconds']
+
+_current: contextvars.ContextVar = contextvars.ContextVar(
+    'finder_instrumentation', default=None)
+_open: contextvars.ContextVar = contextvars.ContextVar(
+    'finder_open_stages', default=())
+
+
+class Instrumentation:
+    def __init__(
+            self,
+            trace_memory: bool = False,
+            profile_dir: Union[Path, str] = None) -> None:
+        """Record wall/CPU time, counters and peak allocations per stage and bin
+
+        Args:
+            trace_memory (bool, optional): whether to record peak allocations with `tracemalloc`. Defaults to False.
+            profile_dir (Union[Path, str], optional): if given, `run` dumps a `cProfile` profile per run to this directory. Defaults to None.
+        """
+        self.trace_memory = trace_memory
+        self.profile_dir = None if profile_dir is None else Path(profile_dir)
+
+        self.records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    # ------------------------------- Recording ------------------------------ #
+
+    @contextmanager
+    def activate(self) -> Iterator["Instrumentation"]:
+        """Make this the recorder used by `stage` and `count` in the current context"""
+        token = _current.set(self)
+        started = False
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started = True
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+            if started:
+                tracemalloc.stop()
+
+    @contextmanager
+    def stage(self, name: str, bin: int = None, **counters) -> Iterator[Dict[str, Any]]:
+        """Time a stage; counters can be added to the yielded record or with `count`"""
+        parents = _open.get()
+        if bin is None and parents:
+            bin = parents[-1]['bin']
+
+        rec: Dict[str, Any] = dict(stage=name, bin=bin)
+        rec.update({k: counters.get(k, 0) for k in COUNTERS})
+
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            base, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+
+        token = _open.set(parents + (rec,))
+        children = os.times()
+        t0, c0 = time.perf_counter(), time.thread_time()
+        try:
+            yield rec
+        finally:
+            rec['wall_s'] = time.perf_counter() - t0
+            rec['cpu_s'] = time.thread_time() - c0
+            after = os.times()
+            rec['child_cpu_s'] = (
+                after.children_user + after.children_system
+                - children.children_user - children.children_system
+            )
+            _open.reset(token)
+
+            if tracing:
+                _, peak = tracemalloc.get_traced_memory()
+                rec['peak_bytes'] = max(peak - base, rec.get('peak_bytes', 0))
+                # resetting the peak hides it from enclosing stages, so pass it up
+                for parent in parents:
+                    parent['peak_bytes'] = max(
+                        parent.get('peak_bytes', 0), peak - base)
+
+            with self._lock:
+                self.records.append(rec)
+
+    @contextmanager
+    def run(self, name: str) -> Iterator["Instrumentation"]:
+        """Activate this recorder for one run, profiling it if `profile_dir` is set"""
+        with self.activate():
+            if self.profile_dir is None:
+                yield self
+                return
+
+            prof = cProfile.Profile()
+            prof.enable()
+            try:
+                yield self
+            finally:
+                prof.disable()
+                self.profile_dir.mkdir(parents=True, exist_ok=True)
+                stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+                prof.dump_stats(self.profile_dir / f"{name}_{stamp}.prof")
+
+    # ------------------------------- Summaries ------------------------------ #
+
+    @staticmethod
+    def _aggregate(records: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+        out: Dict[str, Dict[str, float]] = {}
+        for rec in records:
+            agg = out.setdefault(rec['stage'], dict(
+                count=0, wall_s=0., cpu_s=0., child_cpu_s=0., peak_bytes=0,
+                **{k: 0 for k in COUNTERS}
+            ))
+            agg['count'] += 1
+            for k in ['wall_s', 'cpu_s', 'child_cpu_s'] + COUNTERS:
+                agg[k] += rec.get(k, 0)
+            agg['peak_bytes'] = max(agg['peak_bytes'], rec.get('peak_bytes', 0))
+
+        for agg in out.values():
+            if agg['wall_s'] > 0:
+                agg['bytes_per_s'] = agg['bytes'] / agg['wall_s']
+                agg['audio_seconds_per_s'] = agg['audio_seconds'] / agg['wall_s']
+        return out
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            records = list(self.records)
+
+        bins: Dict[str, List[Dict[str, Any]]] = {}
+        for rec in records:
+            if rec['bin'] is not None:
+                bins.setdefault(str(rec['bin']), []).append(rec)
+
+        return dict(
+            stages=self._aggregate(records),
+            bins={k: self._aggregate(v) for k, v in bins.items()}
+        )
+
+    def write_json(self, path: Union[Path, str]) -> None:
+        with open(path, 'w') as io:
+            json.dump(self.summary(), io, indent=2)
+
+    def write_prometheus(self, path: Union[Path, str], prefix: str = 'finder') -> None:
+        """Write stage totals in the Prometheus text exposition format"""
+        metrics = [
+            ('count', 'stage_runs_total', 'counter', "Number of times a stage ran"),
+            ('wall_s', 'stage_wall_seconds_total', 'counter', "Wall-clock time per stage"),
+            ('cpu_s', 'stage_cpu_seconds_total', 'counter', "CPU time of the calling thread per stage"),
+            ('child_cpu_s', 'stage_child_cpu_seconds_total', 'counter', "CPU time of child processes per stage"),
+            ('bytes', 'stage_bytes_total', 'counter', "Bytes downloaded per stage"),
+            ('audio_seconds', 'stage_audio_seconds_total', 'counter', "Seconds of audio processed per stage"),
+            ('peak_bytes', 'stage_peak_bytes', 'gauge', "Peak traced allocations per stage"),
+        ]
+
+        stages = self.summary()['stages']
+        lines: List[str] = []
+        for key, name, kind, help in metrics:
+            lines.append(f"# HELP {prefix}_{name} {help}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for stage, agg in stages.items():
+                lines.append(f'{prefix}_{name}{{stage="{stage}"}} {agg[key]}')
+
+        with open(path, 'w') as io:
+            io.write("\n".join(lines) + "\n")
+
+
+# ------------------ Module-level hooks used by other modules ----------------- #
+
+
+def current() -> Union[Instrumentation, None]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str, bin: int = None, **counters) -> Iterator[Dict[str, Any]]:
+    """Time a stage with the active recorder; does nothing if none is active"""
+    instr = _current.get()
+    if instr is None:
+        yield dict(stage=name, bin=bin, **counters)
+        return
+
+    with instr.stage(name, bin=bin, **counters) as rec:
+        yield rec
+
+
+def count(**counters) -> None:
+    """Add to the counters of the innermost open stage"""
+    parents = _open.get()
+    if not parents:
+        return
+    for k, v in counters.items():
+        parents[-1][k] = parents[-1].get(k, 0) + v
+
+
+def bind(fn):
+    """Wrap `fn` so it runs in a copy of the current context, e.g. in a thread pool"""
+    ctx = contextvars.copy_context()
+
+    def wrapper(*args, **kwargs):
+        return ctx.run(fn, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,263 @@
+import os
+import math
+import time
+import logging
+import threading
+import subprocess
+import numpy as np
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Union
+
+from finder import instrument
+from finder.decode import RAW_FORMATS, validate_dtype, as_float
+from finder.overlapsave import OverlapSave
+from finder.peaks import top_k_peaks
+
+# ---------------------------------------------------------------------------- #
+#           Follow a live source and match the query as audio arrives          #
+# ---------------------------------------------------------------------------- #
+
+# A live stream is decoded by ffmpeg into a growing raw mono file, in the same
+# format as `decode.decode_to_raw`. `tail_raw` reads new samples as they are
+# written, and `LiveCorrelator` scores every possible start of the query
+# exactly once: each new segment is correlated together with the last
+# `query.size - 1` samples kept in a ring buffer, so already scanned audio is
+# never processed again. Latency is set by the segment length, and memory by
+# the FFT length of the overlap-save engine.
+
+EPS = 1e-12
+
+
+class LiveMatch(NamedTuple):
+    """A match in a live source, all times in seconds of the stream"""
+    start: float
+    stop: float
+    peak: float
+    detected: float
+
+
+class RingBuffer:
+    def __init__(self, capacity: int) -> None:
+        """Fixed-capacity buffer of the most recent samples"""
+        self.capacity = capacity
+        self.data = np.zeros(capacity)
+        self.total = 0
+        self._head = 0
+
+    def extend(self, samples: np.ndarray) -> None:
+        samples = samples[-self.capacity:]
+        n = samples.size
+        first = min(n, self.capacity - self._head)
+
+        self.data[self._head:self._head + first] = samples[:first]
+        self.data[:n - first] = samples[first:]
+
+        self._head = (self._head + n) % self.capacity
+        self.total += n
+
+    def latest(self, n: int) -> np.ndarray:
+        """Copy of the last `n` samples, oldest first"""
+        n = min(n, self.capacity, self.total)
+        start = self._head - n
+        if start >= 0:
+            return self.data[start:self._head].copy()
+        return np.concatenate((self.data[start:], self.data[:self._head]))
+
+
+class LiveCorrelator:
+    def __init__(
+            self,
+            query: np.ndarray,
+            rate: int,
+            segment_s: float = 10.,
+            threshold: float = 0.5) -> None:
+        """Incremental normalized cross-correlation of a query with a growing signal
+
+        Args:
+            query (np.ndarray): query signal
+            rate (int): sampling rate of the query and the stream
+            segment_s (float, optional): longest stretch of new audio correlated at once, in seconds. Defaults to 10.
+            threshold (float, optional): minimum normalized correlation of a match, between 0 and 1. Defaults to 0.5.
+        """
+        self.rate = rate
+        self.threshold = threshold
+        self.m = query.size
+
+        seglen = max(int(segment_s * rate), 1)
+        nfft = 2**math.ceil(math.log2(max(2 * self.m, self.m - 1 + seglen)))
+        self.engine = OverlapSave(query, nfft)
+        self.qnorm = np.linalg.norm(as_float(query))
+
+        self.ring = RingBuffer(nfft)
+        # query starts scored so far; position `i` covers samples `[i, i + m)`
+        self.scanned = 0
+        self._last_match = -self.m - 1
+
+    def feed(self, samples: np.ndarray) -> List[LiveMatch]:
+        """Add new samples of the stream and return the matches they complete"""
+        samples = as_float(samples)
+        matches: List[LiveMatch] = []
+
+        for k in range(0, samples.size, self.engine.step):
+            self.ring.extend(samples[k:k + self.engine.step])
+            matches += self._scan()
+
+        return matches
+
+    def _scan(self) -> List[LiveMatch]:
+        n_new = self.ring.total - self.m + 1 - self.scanned
+        if n_new <= 0:
+            return []
+
+        with instrument.stage('correlate'):
+            window = self.ring.latest(n_new + self.m - 1)
+            corr = self.engine.correlate_segment(window)
+
+            energy = np.concatenate(([0.], np.cumsum(window**2)))
+            norm = np.sqrt(np.maximum(energy[self.m:] - energy[:-self.m], EPS))
+            ncc = corr / (norm * self.qnorm + EPS)
+            instrument.count(audio_seconds=n_new / self.rate)
+
+        offset = self.scanned
+        self.scanned += n_new
+
+        # peaks are at least `m / 2` apart, so a window holds this many at most
+        inds, _ = top_k_peaks(ncc, 2 * n_new // self.m + 2, self.m)
+
+        matches: List[LiveMatch] = []
+        for i in np.sort(inds[inds >= 0]):
+            pos = offset + int(i)
+            if ncc[i] < self.threshold or pos - self._last_match <= self.m:
+                continue
+
+            self._last_match = pos
+            matches.append(LiveMatch(
+                start=pos / self.rate,
+                stop=(pos + self.m) / self.rate,
+                peak=float(ncc[i]),
+                detected=self.ring.total / self.rate
+            ))
+        return matches
+
+
+# ------------------------------- Live sources ------------------------------- #
+
+
+def tail_raw(
+        path: Union[Path, str],
+        dtype: str = 'float32',
+        chunk: int = 2**16,
+        poll: float = 0.5,
+        idle_timeout: float = 30.,
+        stop: threading.Event = None) -> Iterator[np.ndarray]:
+    """Read samples from a raw file as they are appended to it
+
+    If the file is truncated or replaced, e.g. by a new decode, reading restarts from its beginning.
+
+    Args:
+        path (Union[Path, str]): raw mono file, e.g. written by `start_live_decode`
+        dtype (str, optional): sample type, `float32` or `int16`. Defaults to 'float32'.
+        chunk (int, optional): maximum number of samples per yielded array. Defaults to 2**16.
+        poll (float, optional): seconds between checks for new data. Defaults to 0.5.
+        idle_timeout (float, optional): stop after this many seconds without new data. Defaults to 30.
+        stop (threading.Event, optional): stop as soon as this is set. Defaults to None.
+
+    Yields:
+        np.ndarray: new samples, in order
+    """
+    validate_dtype(dtype)
+    itemsize = np.dtype(dtype).itemsize
+    path = Path(path)
+    idle_since = time.monotonic()
+
+    def stopped() -> bool:
+        return (stop is not None and stop.is_set()) or \
+            time.monotonic() - idle_since > idle_timeout
+
+    while not path.is_file():
+        if stopped():
+            return
+        time.sleep(poll)
+
+    rest = b''
+    io = open(path, 'rb')
+    try:
+        while not stopped():
+            data = rest + io.read(chunk * itemsize - len(rest))
+            whole = len(data) - len(data) % itemsize
+            rest = data[whole:]
+
+            if whole == 0:
+                if _restarted(path, io):
+                    logging.info(f"{path.name} was rewritten, reading from the start")
+                    io.close()
+                    io = open(path, 'rb')
+                    rest = b''
+                    continue
+                time.sleep(poll)
+                continue
+
+            idle_since = time.monotonic()
+            yield np.frombuffer(data[:whole], dtype=dtype)
+    finally:
+        io.close()
+
+
+def _restarted(path: Path, io) -> bool:
+    """Whether `path` is now shorter than what was read from `io`, or another file"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return False
+    return st.st_ino != os.fstat(io.fileno()).st_ino or st.st_size < io.tell()
+
+
+def start_live_decode(
+        src: str,
+        out: Path,
+        rate: int,
+        dtype: str = 'float32') -> subprocess.Popen:
+    """Start `ffmpeg` decoding a live source into a growing raw mono file
+
+    Args:
+        src (str): live media url, e.g. from `download.resolve_media_url`
+        out (Path): output path; an existing file is removed first, so that it is never read as part of this stream
+        rate (int): output sampling rate
+        dtype (str, optional): sample type, `float32` or `int16`. Defaults to 'float32'.
+
+    Returns:
+        subprocess.Popen: the running `ffmpeg` process
+    """
+    validate_dtype(dtype)
+    # `ffmpeg` truncates `out` only once it has opened the source
+    Path(out).unlink(missing_ok=True)
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-i", str(src), "-vn", "-ac", "1", "-ar", str(rate),
+        "-f", RAW_FORMATS[dtype], str(out)
+    ]
+    logging.info(f"Following {src} into {Path(out).name}")
+    return subprocess.Popen(cmd, stdin=subprocess.DEVNULL)
+
+
+def follow(
+        path: Union[Path, str],
+        query: np.ndarray,
+        rate: int,
+        dtype: str = 'float32',
+        segment_s: float = 10.,
+        threshold: float = 0.5,
+        poll: float = 0.5,
+        idle_timeout: float = 30.,
+        stop: threading.Event = None) -> Iterator[LiveMatch]:
+    """Match `query` against a growing raw file, yielding matches as soon as they are complete
+
+    See `tail_raw` and `LiveCorrelator` for the arguments.
+    """
+    corr = LiveCorrelator(query, rate, segment_s=segment_s, threshold=threshold)
+    chunk = max(int(segment_s * rate), 1)
+
+    for samples in tail_raw(
+            path, dtype=dtype, chunk=chunk, poll=poll,
+            idle_timeout=idle_timeout, stop=stop):
+        yield from corr.feed(samples)
@@ -1,22 +1,49 @@
 from multiprocessing.sharedctypes import Value
+from subprocess import CalledProcessError
 import validators
+import math
 import time
+import hashlib
+import asyncio
+import threading
 import logging
 import numpy as np
 from pathlib import Path
-from subprocess import Popen
+from contextlib import nullcontext
+from concurrent.futures import Future, CancelledError, TimeoutError, wait as wait_futures
 
 import matplotlib.pyplot as plt
+from scipy.signal import resample_poly
 
 from datetime import datetime, timedelta
 
 from types import NoneType
-from typing import List, Tuple, Union
-
-from finder import sampling
-from finder.download import get_cmd, run_cmd
-from finder.common import str2hms, str2td, create_figure
-from finder.findsignal import FindSignal, read_audio_data
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, NamedTuple, Tuple, Union
+
+from finder import sampling, instrument, live, planner
+from finder.instrument import Instrumentation
+from finder.cache import SharedCaches, audio_key
+from finder.download import (
+    get_cmd, get_filename, run_cmd, fetch_bin, range_suffix,
+    get_source_id, resolve_media_url, media_url_expiry, VIDEO_FORMATS,
+    audio_formats, format_ext, select_audio_format)
+from finder.singleflight import FETCHES
+from finder.concurrency import DOWNLOADS, host_of
+from finder.scheduler import BUDGET, fetch_bytes, score_bytes
+from finder.common import str2td, seconds2hms, create_figure
+from finder.findsignal import FindSignal, ENGINES, read_audio_file, log_result, xcorr
+from finder.segments import SegmentedQuery
+from finder.preflight import Preflight, preflight
+from finder.peaks import Occurrence, rank_occurrences
+from finder.planner import BinPlan, CostModel, DEFAULT_COSTS, costs_from_metrics
+from finder.common import InvalidArgumentException
+from finder.resultcache import ResultCache, hash_samples, params_key
+from finder.fullsource import correlate_source
+from finder.spectrumcache import SpectrumCache
+from finder.decode import raw_path, decode_to_raw, open_raw
+from finder.fragments import FRAGMENT_FORMATS, fetch_fragments
+from finder.videohash import VideoMatch, hash_video, search_hashes
+from finder.subtitles import SubtitleIndex, TextWindow, fetch_subtitles
 
 # ---------------------------------------------------------------------------- #
 #                   Download and compare clips by their audio                  #
@@ -24,6 +51,34 @@ from finder.findsignal import FindSignal, read_audio_data
 
 DATADIR = Path.cwd() / 'data'
 
+# sampling rate assumed for queries given as arrays: 44.1 kHz / 100
+DEFAULT_RATE = 441
+
+
+class BinResult(NamedTuple):
+    """Outcome of one scored bin; times in seconds, `result` relative to the bin"""
+    bin: int
+    start: int
+    stop: int
+    peak: float
+    result: Union[Tuple[int, int], None]
+    occurrences: List[Occurrence]
+    wait_s: float
+    score_s: float
+
+    def as_dict(self) -> Dict[str, Any]:
+        """JSON-friendly record, as passed to `Finder.run(on_bin=...)`"""
+        return dict(
+            bin=self.bin,
+            range=sampling.format_hms(np.array([self.start, self.stop])).tolist(),
+            seconds=[self.start, self.stop],
+            peak=self.peak,
+            result=None if self.result is None else list(self.result),
+            occurrences=[o._asdict() for o in self.occurrences],
+            wait_s=self.wait_s,
+            score_s=self.score_s
+        )
+
 
 # -------------------------------- Main class -------------------------------- #
 
@@ -35,14 +90,60 @@ class Finder:
             query: Union[str, np.ndarray],
             source_start: str=None, 
             source_stop: str=None, 
+            caches: SharedCaches=None,
+            logfile: bool=True,
+            metrics: Instrumentation=None,
+            results: ResultCache=None,
+            engine: str='xcorr',
+            top_k: int=0,
+            rate: int=DEFAULT_RATE,
             **query_kwargs) -> None:
+        """Find where a query clip occurs in a source video
+
+        Args:
+            source (str): url of the source video
+            query (Union[str, np.ndarray]): query audio, as a path, url, or array
+            source_start (str, optional): start of the searched range, in HH:MM:SS. Defaults to None.
+            source_stop (str, optional): stop of the searched range, in HH:MM:SS. Defaults to None.
+            caches (SharedCaches, optional): in-memory caches shared with other `Finder`s, e.g. by `finder.service`. Defaults to None.
+            logfile (bool, optional): whether to write results to `logs/<query>.log`. Defaults to True.
+            metrics (Instrumentation, optional): records per-stage timings, throughput and memory of `run` and `run_fullsource`. Defaults to None.
+            results (ResultCache, optional): persistent cache of correlation outcomes, so bins already scored against this query are not scored again. Defaults to None.
+            engine (str, optional): how bins are scored. Defaults to 'xcorr'.
+
+            * `xcorr`: cross-correlation with the whole query
+            * `segments`: the most distinctive short segment of the query first, rejecting the bin early if it fails, then offset voting over all segments. Faster for long queries, and robust to cuts in the clip.
+
+            top_k (int, optional): also keep up to this many occurrences per bin after non-maximum suppression, ranked over all bins by `ranked_occurrences`. Finds every repetition of the query in one search. Defaults to 0 (best match only).
+            rate (int, optional): analysis sampling rate. The query and every bin are decoded with `ffmpeg` to mono at this rate, so their rates always match. Defaults to DEFAULT_RATE. An array `query` must already be at this rate.
+        """
 
         self.url = source
+        self.source_id = get_source_id(source)
+        self.caches = caches
+        self.metrics = metrics
+        self.results = results
+
+        if engine not in ENGINES:
+            raise InvalidArgumentException('engine', engine, ENGINES)
+        self.engine = engine
+        self._segments: SegmentedQuery = None
+        # minimum normalized correlation of a match with `segments` or in a live stream, see `preflight`
+        self.threshold = 0.5
+        self._subtitles: SubtitleIndex = None
+
+        self.top_k = top_k
+        self.occurrences: List[Occurrence] = []
+        self._bin_peaks: Dict[Any, List[Occurrence]] = {}
         
         self._source_start_stop = (source_start, source_stop)
+        self._loghandler: logging.Handler = None
+        self.query_rate = rate
         
         self.query = self.get_query(query, **query_kwargs)
-        self.create_logger()
+        self._query_key = hashlib.sha1(self.query.tobytes()).hexdigest()
+        self.name = str(self.logname)
+        self.create_logger(logfile)
         
     def get_query(
             self,
@@ -50,6 +151,7 @@ class Finder:
             **query_kwargs) -> np.ndarray:
 
         if isinstance(query, np.ndarray):
+            self.logname = 'query'
             return query
         elif isinstance(query, (Path, str)):
             pass 
@@ -59,6 +161,25 @@ class Finder:
                 not {type(query)}"
             )        
 
+        if self.caches is None:
+            return self._read_query(query, **query_kwargs)
+
+        key = (str(query), self.query_rate)
+        cached = self.caches.queries.get(key)
+        if cached is not None:
+            self.logname, query_data, self.query_rate = cached
+            return query_data
+
+        query_data = self._read_query(query, **query_kwargs)
+        self.caches.queries.put(
+            key, (self.logname, query_data, self.query_rate))
+        return query_data
+
+    def _read_query(
+            self,
+            query: Union[str, Path],
+            **query_kwargs) -> np.ndarray:
+
         if validators.url(str(query)):
             cmd, fn = get_cmd(query, **query_kwargs)
             fn = Path(fn)
@@ -96,11 +217,8 @@ class Finder:
         except KeyboardInterrupt:
             proc.kill()
 
-    @staticmethod
-    def load_query(p: Path) -> np.ndarray:
-        query, _ = next(read_audio_data(
-            p.stem, p.parent, p.suffix
-        ))
+    def load_query(self, p: Path) -> np.ndarray:
+        query, self.query_rate = read_audio_file(p, rate=self.query_rate)
         
         logging.info(
             f"Query downloaded to {str(p)}"
@@ -108,19 +226,28 @@ class Finder:
 
         return query
 
-    def create_logger(self) -> None:
+    def create_logger(self, logfile: bool = True) -> None:
+        """Write log records to `logs/<query>.log` without replacing other handlers"""
+
+        if not logfile:
+            self.logname = None
+            return
         
         logdir = Path.cwd() / 'logs' 
         if not logdir.is_dir():
             logdir.mkdir()
         
         logname = logdir / f'{self.logname}.log' 
-        logging.basicConfig(
-            filename=logname,
-            encoding='utf-8',
-            level=logging.INFO,
-            force=True
-        )
+        handler = logging.FileHandler(logname, encoding='utf-8')
+        handler.setLevel(logging.INFO)
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+        root = logging.getLogger()
+        root.addHandler(handler)
+        if root.level == logging.NOTSET or root.level > logging.INFO:
+            root.setLevel(logging.INFO)
+
+        self._loghandler = handler
 
         if logname.is_file():
             self.logname = logname 
@@ -128,19 +255,77 @@ class Finder:
         else:
             raise FileNotFoundError(f"Log file was not created.")
 
+    def close(self) -> None:
+        """Detach this `Finder`'s log file handler"""
+        if self._loghandler is not None:
+            logging.getLogger().removeHandler(self._loghandler)
+            self._loghandler.close()
+            self._loghandler = None
+
+    def _get_source_range(self) -> Tuple[int, Union[int, NoneType]]:
+        """Start and stop of the searched range in seconds; stop is None if not given"""
+        ts = [
+            None if s is None else int(str2td(s).total_seconds())
+            for s in self._source_start_stop
+        ]
+        return (ts[0] or 0), ts[1]
+
+    def preflight(self, apply: bool = False) -> Preflight:
+        """Check the query before any download; see `preflight.preflight`
+
+        Args:
+            apply (bool, optional): whether to score with the recommended engine and threshold. The recommended rate needs a new `Finder`, since the query is decoded at `rate`. Defaults to False.
+
+        Returns:
+            Preflight: measurements and recommendations, with warnings if the query is unlikely to be found
+        """
+        report = preflight(self.query, self.query_rate)
+        report.log()
+
+        if apply:
+            if report.engine != self.engine:
+                self._segments = None
+            self.engine = report.engine
+            self.threshold = report.threshold
+        return report
+
+    def video_meta(self, loc: Path = DATADIR) -> Dict[str, Any]:
+        """Metadata of the source, cached in `caches.meta` and `loc`; see `sampling.get_video_meta`"""
+        return sampling.get_video_meta(
+            self.url,
+            cache=None if self.caches is None else self.caches.meta,
+            loc=loc
+        )
+
+    def choose_format(self, fmt: Union[int, str] = 'auto', rate: int = None) -> int:
+        """Audio format of the bins: the cheapest one offered that meets `rate`, or `fmt` if offered
+
+        Args:
+            fmt (Union[int, str], optional): `yt-dl` format code to prefer, or 'auto'. Defaults to 'auto'.
+            rate (int, optional): analysis sampling rate. Defaults to the sampling rate of the query.
+
+        Returns:
+            int: `yt-dl` format code; see `download.select_audio_format`
+        """
+        rate = self.query_rate if rate is None else rate
+        fmt = None if fmt == 'auto' else int(fmt)
+
+        formats = audio_formats(self.video_meta())
+        if not formats:
+            logging.warning("No known audio formats listed for the source")
+            return 139 if fmt is None else fmt
+        return select_audio_format(formats, rate, fmt=fmt)
+
     def _get_source_duration(self) -> tuple[int]:
         
-        ts: list[int] = [0]*2 
-        for i, s in enumerate(self._source_start_stop):
-            if s is None: continue 
-            ts[i] = int( str2td(s).total_seconds() )
+        start, stop = self._get_source_range()
         
-        if ts[1] > 0: 
-            dur = ts[1] 
+        if stop: 
+            dur = stop 
         else:
-            dur, _ = sampling.get_video_duration(self.url)
+            dur = self.video_meta()['duration']
         
-        return ts[0], dur - ts[0] 
+        return start, dur - start 
 
     def get_bins(
             self,
@@ -154,6 +339,11 @@ class Finder:
 
         start, dur_int = self._get_source_duration()
 
+        if binorder == 'heatmap' and binkwargs.get('prior') is None:
+            # most replayed moments first, or mirrored order without a heatmap
+            heatmap = self.video_meta().get('heatmap')
+            binkwargs['prior'] = sampling.heatmap_rate(heatmap) if heatmap else None
+
         bins_int = sampling.get_bins(
             dur_int - end_delta,
             nbins=nbins,
@@ -164,8 +354,126 @@ class Finder:
             **binkwargs
         )
         
-        self._bins_str = sampling.bins2str(bins_int)
-        # logging.debug(self._bins_str)
+        # integer seconds; formatted only for commands and output
+        self._bins: np.ndarray = bins_int
+        self._bins_str_cache: np.ndarray = None
+
+    def text_windows(
+            self,
+            quote: str,
+            subtitles: Union[Path, str] = None,
+            lang: str = 'en',
+            loc: Path = DATADIR,
+            **search_kwargs) -> List[TextWindow]:
+        """Windows of the source whose subtitles match a quote from the query, best first
+
+        Pass them as `priority` to `get_bins` so that their bins are searched first.
+
+        Args:
+            quote (str): a quote from the query, or keywords
+            subtitles (Union[Path, str], optional): local `.vtt` or `.srv*` file. Defaults to None (fetched once into `loc` with `yt-dlp`).
+            lang (str, optional): language of fetched subtitles. Defaults to 'en'.
+            loc (Path, optional): directory for fetched subtitles. Defaults to DATADIR.
+            **search_kwargs: passed to `SubtitleIndex.search`; `window_s` defaults to the query duration.
+
+        Returns:
+            List[TextWindow]: windows, in seconds of the source
+        """
+        if self._subtitles is None:
+            if subtitles is None:
+                subtitles = fetch_subtitles(self.url, loc=loc, lang=lang)
+            self._subtitles = SubtitleIndex.from_file(subtitles)
+
+        search_kwargs.setdefault('window_s', max(self.query.size / self.query_rate, 10.))
+        return self._subtitles.search(quote, **search_kwargs)
+
+    def plan_bins(
+            self,
+            costs: CostModel = None,
+            binorder: str = 'mirrored',
+            priority: List[Tuple[float, float]] = None,
+            prior: np.ndarray = None,
+            skipsize: int = 0,
+            **plan_kwargs) -> BinPlan:
+        """Choose bin width, overlap and batch size with `planner.plan`, then make the bins
+
+        Args:
+            costs (CostModel, optional): download and scoring costs. Defaults to None (from `self.metrics` if it has recorded a run, else `planner.DEFAULT_COSTS`).
+            binorder (str, optional): bin order. Defaults to 'mirrored'.
+            priority (List[Tuple[float, float]], optional): windows whose bins go first, e.g. from `text_windows`. Defaults to None.
+            prior (np.ndarray, optional): activity of the source per second, for `binorder='chat'`. Defaults to None.
+            skipsize (int, optional): see `sampling.get_bins`. Defaults to 0.
+
+        Returns:
+            BinPlan: the plan; pass `plan.batch` as `max_dl` to `run`
+        """
+        if costs is None:
+            if self.metrics is not None and self.metrics.records:
+                costs = costs_from_metrics(self.metrics)
+            else:
+                costs = DEFAULT_COSTS
+
+        _, dur = self._get_source_duration()
+        chosen = planner.plan(
+            dur, self.query.size / self.query_rate, costs, **plan_kwargs)
+
+        self.get_bins(
+            binorder=binorder, priority=priority, prior=prior, skipsize=skipsize,
+            **chosen.bin_kwargs())
+        return chosen
+
+    def measure_costs(
+            self,
+            fmt: int = 139,
+            loc: Path = DATADIR,
+            lengths: Tuple[int, ...] = (10, 60)) -> CostModel:
+        """Probe the download and scoring costs of the source with `planner.measure`
+
+        Ranges of `lengths` seconds from the start of the searched range are downloaded, decoded and scored with the query, without logging a result, then deleted.
+
+        Args:
+            fmt (int, optional): `yt-dl` format code of the bins. Defaults to 139.
+            loc (Path, optional): directory of the probe downloads. Defaults to DATADIR.
+            lengths (Tuple[int, ...], optional): probe lengths in seconds. Defaults to (10, 60).
+
+        Returns:
+            CostModel: measured costs, for `plan_bins`
+        """
+        start, _ = self._get_source_range()
+        probes: List[Path] = []
+
+        def fetch(t0: int, t1: int) -> Path:
+            probes.append(Path(fetch_bin(
+                self.url, t0, t1, fmt, loc=loc, media_url=self._media_url(fmt))))
+            return probes[-1]
+
+        def score(path: Path) -> None:
+            data, rate = read_audio_file(path, rate=self.query_rate)
+            if self.engine == 'segments':
+                if self._segments is None:
+                    self._segments = SegmentedQuery(self.query, rate)
+                self._segments.score(data)
+            else:
+                xcorr(data, self.query)
+
+        try:
+            costs = planner.measure(fetch, score, lengths=lengths, start=start)
+        finally:
+            for p in probes:
+                p.unlink(missing_ok=True)
+
+        logging.info(
+            f"Measured costs: latency {costs.latency_s:.2f} s, "
+            f"bandwidth {costs.bandwidth:.1f} audio s/s, scoring {costs.correlate_s:.2e} s per audio s"
+        )
+        return costs
+
+    @property
+    def _bins_str(self) -> np.ndarray:
+        """Bins as `HH:MM:SS` strings"""
+        if self._bins_str_cache is None:
+            self._bins_str_cache = sampling.bins2str(self._bins)
+        return self._bins_str_cache
 
     def run_ytdl(
             self,
@@ -174,91 +482,298 @@ class Finder:
             fmt: int,
             wait: bool,
             loc: Path,
-            max_wait_time: int) -> None:
+            max_wait_time: int,
+            fragments: bool = False) -> None:
 
-        cmd_kw = dict(fmt=fmt, loc=loc)
+        fragments = fragments and fmt in FRAGMENT_FORMATS
+        media_url = None
 
         self._fnames: List[Path] = []
-        self._running: List[Union[Popen, NoneType]] = []
-
-        for i, bin in enumerate(self._bins_str[start_bin:]):
-            start, stop = bin
-
-            cmd, fn = get_cmd(
-                self.url, start, stop,
-                suffix=f"_{i+start_bin}",
-                **cmd_kw
-            )
-
-            if Path(fn).is_file():
-                proc = None
+        self._running: List[Union[Future, NoneType]] = []
+        self._keys: List[tuple] = []
+        self._fetch_keys: List[tuple] = []
+
+        for i, bin in enumerate(self._bins[start_bin:]):
+            start, stop = int(bin[0]), int(bin[1])
+            key = audio_key(self.source_id, start, stop)
+            fetch_key = (self.source_id, start, stop, fmt)
+            fn = Path(get_filename(
+                self.url, loc=loc, suffix=range_suffix(start, stop),
+                ext=format_ext(fmt)))
+
+            # identical ranges requested by concurrent searches share one fetch
+            if self._is_cached(key) or fn.is_file():
+                fut = None
+            elif fragments:
+                if media_url is None:
+                    media_url = self._media_url(fmt) or resolve_media_url(self.url, fmt)
+                fut = FETCHES.submit(
+                    fetch_key,
+                    instrument.bind(self._fetch), i + start_bin, fetch_key,
+                    fetch_bytes(stop - start, fmt, fragments=True), fetch_fragments,
+                    self.url, media_url, start, stop,
+                    loc=loc
+                )
             else:
-                proc = run_cmd(cmd, shell=True)
-
-            self._running.append(proc)
-            self._fnames.append(Path(fn))
+                fut = FETCHES.submit(
+                    fetch_key,
+                    instrument.bind(self._fetch), i + start_bin, fetch_key,
+                    fetch_bytes(stop - start, fmt), fetch_bin,
+                    self.url, start, stop, fmt,
+                    loc=loc,
+                    media_url=self._media_url(fmt)
+                )
+
+            self._running.append(fut)
+            self._fnames.append(fn)
+            self._keys.append(key)
+            self._fetch_keys.append(fetch_key)
 
             if i + 1 >= max_dl:
                 break
 
-        if isinstance(self._running[-1], NoneType):
+        if all(fut is None for fut in self._running):
             logging.info("All bins already exist on the file system.")
             return
 
-        if wait:
-            while not self._fnames[0].is_file():
-                time.sleep(max_wait_time/10)
+        if wait and self._running[0] is not None:
+            wait_futures(self._running[:1])
+
+    @staticmethod
+    def _fetch(
+            k: int,
+            fetch_key: tuple,
+            nbytes: int,
+            fetch: Callable[..., str],
+            url: str,
+            *args, **kwargs) -> str:
+
+        def fetch_unless_abandoned(*args, **kwargs) -> str:
+            # every search that wanted this bin may have stopped while it waited
+            if FETCHES.abandoned(fetch_key):
+                raise CancelledError(f"Fetch of {fetch_key} abandoned")
+            # memory is only held once a download can start, so queued downloads do not starve scoring
+            with BUDGET.reserve(nbytes):
+                return fetch(*args, **kwargs)
+
+        # waits for a slot of the adaptive download limit, then for memory
+        with instrument.stage('download', bin=k):
+            return DOWNLOADS.call(
+                host_of(url), fetch_unless_abandoned, url, *args, **kwargs)
+
+    def _abandon_fetches(self) -> None:
+        """Give up on the downloads of the current batch that are still pending"""
+        for key, fut in zip(self._fetch_keys, self._running):
+            if fut is not None and not fut.done():
+                FETCHES.abandon(key, fut)
+
+    def _instrumented(self, name: str):
+        """Activate `self.metrics` for a run, if given and not already active"""
+        if self.metrics is None or instrument.current() is self.metrics:
+            return nullcontext()
+        return self.metrics.run(name)
+
+    def _is_cached(self, key: tuple) -> bool:
+        return self.caches is not None and key in self.caches.audio
+
+    def _is_ready(self, i: int) -> bool:
+        return self._is_cached(self._keys[i]) or self._fnames[i].is_file()
+
+    def _media_url(self, fmt: int) -> Union[str, NoneType]:
+        """Direct media url of the source, resolved once and kept in `caches.urls`"""
+        if self.caches is None:
+            return None
+
+        key = (self.url, fmt)
+        url = self.caches.urls.get(key)
+        if url is not None:
+            return url
+
+        try:
+            url = resolve_media_url(self.url, fmt)
+        except Exception as e:
+            logging.warning(f"Could not resolve media url: {e}")
+            return None
+
+        # refresh a few minutes before the signed url expires
+        expires = media_url_expiry(url)
+        ttl = None if expires is None else max(expires - time.time() - 300, 0)
+        self.caches.urls.put(key, url, ttl=ttl)
+        return url
 
     def find_times(
             self,
-            fname: Path) -> Union[None, Tuple[int, int]]:
+            fname: Path,
+            key: tuple = None) -> Union[None, Tuple[int, int]]:
+
+        data, rate, audio_hash = None, None, None
+        if key is not None and self.caches is not None:
+            cached = self.caches.audio.get(key)
+            if cached is not None:
+                data, rate = cached
+
+        # a bin file scored before does not need to be decoded again
+        if data is None and self.results is not None:
+            known = self.results.file_hash(fname)
+            if known is not None and known[1] == self.query_rate:
+                audio_hash, rate = known
+                hit = self._cached_result(audio_hash, rate, key)
+                if hit is not None:
+                    return hit
+
+        # bins decoded at another rate, e.g. by a `Finder` with another `rate`, are not reused
+        if data is not None and rate != self.query_rate:
+            data = None
+
+        from_file = data is None
+        if from_file:
+            data, rate = read_audio_file(fname, rate=self.query_rate)
+            if key is not None and self.caches is not None:
+                self.caches.audio.put(key, (data, rate))
+
+        if self.results is not None:
+            audio_hash = hash_samples(data)
+            if from_file:
+                self.results.remember_file(fname, audio_hash, rate)
+
+            hit = self._cached_result(audio_hash, rate, key)
+            if hit is not None:
+                return hit
+
+        spectra = None if self.caches is None else self.caches.spectra
+        if self.engine == 'segments' and self._segments is None:
+            self._segments = SegmentedQuery(self.query, rate)
+
+        finder = FindSignal(
+            data, self.query, rate,
+            spectra=spectra,
+            query_key=self._query_key,
+            segments=self._segments,
+            threshold=self._bin_threshold
+        )
+        result, peak = finder.findsignal(how=self.engine)
+
+        if self.top_k > 0:
+            # a bin rejected by the first segment is not correlated in full
+            rejected = finder.verdict is not None and finder.verdict.rejected
+            peaks = [] if rejected else finder.find_peaks(self.top_k)
+            self._bin_peaks[key] = peaks
+            if self.results is not None:
+                self.results.store_peaks(
+                    self._query_key, audio_hash, self._peak_params(rate), peaks)
+
+        if self.results is not None:
+            self.results.store(
+                self._query_key, audio_hash, self._score_params(rate),
+                peak, finder.argmax, result
+            )
+        return result, peak
 
-        data, rate = next(read_audio_data(
-            fname.stem,
-            fname.parent,
-            fname.suffix,
-        ))
-        
-        return FindSignal(
-            data, self.query, rate
-        ).findsignal()
+    @property
+    def _bin_threshold(self) -> float:
+        # raw `xcorr` peaks are not normalized, so the preflight level does not apply to them
+        return self.threshold if self.engine == 'segments' else 0.5
 
-    def _compare_signals(
+    def _score_params(self, rate: int) -> str:
+        return params_key(
+            engine=self.engine, rate=rate,
+            how_argmax='whole', how_t0='query', threshold=self._bin_threshold
+        )
+
+    def _peak_params(self, rate: int) -> str:
+        # peaks come from a full xcorr, but `segments` skips the bins it rejects
+        return params_key(engine=self.engine, rate=rate, top_k=self.top_k, window=1.)
+
+    def _cached_result(
+            self,
+            audio_hash: str,
+            rate: int,
+            key: tuple = None) -> Union[Tuple[Union[tuple, NoneType], float], NoneType]:
+
+        if self.top_k > 0:
+            peaks = self.results.lookup_peaks(
+                self._query_key, audio_hash, self._peak_params(rate))
+            if peaks is None:
+                return None
+            self._bin_peaks[key] = [Occurrence(*p) for p in peaks]
+
+        hit = self.results.lookup(
+            self._query_key, audio_hash, self._score_params(rate))
+        if hit is None:
+            return None
+
+        log_result(hit.candidates, hit.peak, hit.argmax/rate)
+        return hit.candidates, hit.peak
+
+    def _await_bin(
             self,
             i: int,
             fname: Path,
             max_wait_time: int,
-            wait: bool) -> Tuple[Union[tuple, NoneType], float]:
-
-        if not fname.is_file():
-            if isinstance(self._running[i], NoneType):
+            wait: bool,
+            stop: threading.Event = None) -> Path:
+        """Wait for the download of the `i`-th bin of the batch; returns its file"""
+        if self._is_cached(self._keys[i]):
+            return fname
+
+        fut = self._running[i]
+        if fut is None:
+            if not fname.is_file():
                 raise FileNotFoundError(fname)
-            elif wait:
-                logging.info(f"Waiting for {max_wait_time} seconds.")
-                time.sleep(max_wait_time)
+            return fname
 
-        if not fname.is_file():
-            proc = self._running[i]
-            proc.kill()
-            logging.error(proc.communicate()[1])
+        try:
+            return Path(self._wait_fetch(fut, max_wait_time if wait else 0, stop))
+        except TimeoutError:
+            logging.error(f"Timed out waiting for {fname.name}")
+        except CalledProcessError as e:
+            logging.error(e.stderr)
+        return fname
 
-        return self.find_times(fname)
+    @staticmethod
+    def _wait_fetch(
+            fut: Future,
+            timeout: float,
+            stop: threading.Event = None,
+            poll: float = 0.2) -> str:
+        """`fut.result(timeout)`, giving up with `CancelledError` as soon as `stop` is set"""
+        if stop is None:
+            return fut.result(timeout=timeout)
+
+        deadline = time.monotonic() + timeout
+        while True:
+            if stop.is_set():
+                raise CancelledError("Run stopped")
+            remaining = deadline - time.monotonic()
+            try:
+                return fut.result(timeout=max(min(poll, remaining), 0))
+            except TimeoutError:
+                if remaining <= poll:
+                    raise
 
-    def _midtime(self, ind: int, delta: timedelta = None) -> datetime:
+    def _score_bytes(self, k: int) -> int:
+        """Memory reserved for decoding and scoring bin `k`"""
+        a, b = self._bins[k]
+        return score_bytes(int(b - a), self.query_rate, self.query.size)
 
-        bin = self._bins_str[ind, :]
-        if isinstance(bin[0], np.ndarray):
-            bin = bin[0]
+    def _midtime(self, ind: int, delta: timedelta = None) -> datetime:
 
-        a, b = [str2hms(s) for s in bin]
+        a, b = self._bins[ind]
 
         if delta is None:
-            return a + (b-a)/2
+            return seconds2hms((a + b) / 2)
         else:
-            return a + delta
+            return seconds2hms(a) + delta
 
     @staticmethod
     def _plot_peak_corr(peaks: np.ndarray, title: str=None, save_path=None):
+        with instrument.stage('plot'):
+            Finder._draw_peak_corr(peaks, title=title, save_path=save_path)
+
+        plt.show()
+
+    @staticmethod
+    def _draw_peak_corr(peaks: np.ndarray, title: str=None, save_path=None):
         peaks = np.array(peaks)
 
         _, ax = create_figure()
@@ -285,9 +800,7 @@ class Finder:
             plt.savefig(save_path, bbox_inches='tight')
             print(f"Figure saved at {save_path}")
 
-        plt.show()
-
-    def run(
+    def iter_run(
             self,
             start_bin: int = 0,
             max_dl: int = 5,
@@ -295,57 +808,464 @@ class Finder:
             fmt=139,
             keepfiles=True,
             loc=DATADIR,
-            max_wait_time: int = 120) -> List[Tuple[int, int]]:
+            max_wait_time: int = 120,
+            fragments: bool = False,
+            stop: threading.Event = None) -> Iterator[BinResult]:
+        """Download and compare a batch of up to `max_dl` bins, yielding each bin as soon as it is scored
+
+        Closing the generator (e.g. `break` in a `for` loop) or setting `stop` ends the run and abandons the downloads of the batch that have not finished; downloads shared with other searches go on.
+
+        Args:
+            start_bin (int, optional): index of the first bin. Defaults to 0.
+            max_dl (int, optional): number of bins in the batch. Defaults to 5.
+            wait (bool, optional): whether to wait for downloads, up to `max_wait_time` seconds each. Defaults to True.
+            fmt (Union[int, str], optional): `yt-dl` format code, or 'auto' for `choose_format`. Defaults to 139.
+            keepfiles (bool, optional): whether to keep bin files after scoring. Defaults to True.
+            loc (Path, optional): directory for bin files. Defaults to DATADIR.
+            max_wait_time (int, optional): seconds to wait for each download. Defaults to 120.
+            fragments (bool, optional): for formats 139 and 140, fetch only the MP4 fragments of each bin over keep-alive connections, instead of letting `ffmpeg` open and seek the remote file for every bin. Defaults to False.
+            stop (threading.Event, optional): stop the run, e.g. from another thread. Defaults to None.
+
+        Yields:
+            BinResult: one record per scored bin, in bin order
+        """
+        with self._instrumented(f"{self.name}_{start_bin}"):
+            if fmt == 'auto':
+                fmt = self.choose_format()
+
+            # download clips from source
+            with instrument.stage('run_ytdl'):
+                self.run_ytdl(
+                    start_bin=start_bin,
+                    max_dl=max_dl,
+                    wait=wait,
+                    fmt=fmt,
+                    loc=loc,
+                    max_wait_time=max_wait_time,
+                    fragments=fragments
+                )
+
+            try:
+                # if download was not successful
+                if not self._is_ready(0):
+                    raise FileNotFoundError(str(self._fnames))
+
+                logging.info("Comparing query and source audio...")
+
+                for i, fname in enumerate(self._fnames):
+                    k = i + start_bin
+                    if stop is not None and stop.is_set():
+                        return
+
+                    t0 = time.perf_counter()
+                    try:
+                        fname = self._await_bin(i, fname, max_wait_time, wait, stop)
+                    except CancelledError:
+                        return
+                    t1 = time.perf_counter()
+
+                    with BUDGET.reserve(self._score_bytes(k), urgent=True),\
+                            instrument.stage('bin', bin=k):
+                        result, peak = self.find_times(fname, key=self._keys[i])
+                    t2 = time.perf_counter()
+
+                    if result is None:
+                        logging.info(f"Not in {sampling.bin2str(self._bins[k])}")
+                    else:
+                        logging.info(sampling.bin2str(self._bins[k]))
+
+                    # bin files start at the first second of their bin
+                    offset = int(self._bins[k][0])
+                    occurrences = [
+                        Occurrence(offset + o.start, offset + o.stop, o.value)
+                        for o in self._bin_peaks.pop(self._keys[i], [])
+                    ]
+                    self.occurrences += occurrences
+
+                    if not keepfiles:
+                        fname.unlink(missing_ok=True)
+
+                    yield BinResult(
+                        bin=k,
+                        start=int(self._bins[k][0]),
+                        stop=int(self._bins[k][1]),
+                        peak=float(peak),
+                        result=None if result is None else tuple(int(t) for t in result),
+                        occurrences=occurrences,
+                        wait_s=t1 - t0,
+                        score_s=t2 - t1
+                    )
+            finally:
+                self._abandon_fetches()
+
+            if self.top_k > 0:
+                for o in self.ranked_occurrences():
+                    logging.info(
+                        f"Occurrence: {o.value:<10} Start: {o.start:<10.1f} Stop: {o.stop:<10.1f}"
+                    )
+
+    def fetch_batch(
+            self,
+            start_bin: int = 0,
+            max_dl: int = 5,
+            fmt=139,
+            loc=DATADIR,
+            max_wait_time: int = 120,
+            fragments: bool = False,
+            stop: threading.Event = None) -> List[Path]:
+        """Download a batch of bins without scoring them; `iter_run` on the same batch then only scores
+
+        Args:
+            See `iter_run`.
 
-        # download clips from source
+        Returns:
+            List[Path]: files of the bins of the batch, in bin order
+        """
         self.run_ytdl(
             start_bin=start_bin,
             max_dl=max_dl,
-            wait=wait,
+            wait=False,
             fmt=fmt,
             loc=loc,
-            max_wait_time=max_wait_time
+            max_wait_time=max_wait_time,
+            fragments=fragments
         )
 
-        # if download was not successful
-        if not self._fnames[0].is_file():
-            raise FileNotFoundError(str(self._fnames))
+        fnames: List[Path] = []
+        try:
+            for i, fname in enumerate(self._fnames):
+                fnames.append(self._await_bin(i, fname, max_wait_time, True, stop))
+        except CancelledError:
+            self._abandon_fetches()
+        return fnames
+
+    async def aiter_run(self, **run_kwargs) -> AsyncIterator[BinResult]:
+        """`iter_run` as an async iterator; the bins are fetched and scored in a worker thread
+
+        Leaving the `async for` loop, or cancelling the task running it, stops the run and abandons pending downloads.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def produce() -> None:
+            gen = self.iter_run(stop=stop, **run_kwargs)
+            try:
+                for rec in gen:
+                    loop.call_soon_threadsafe(queue.put_nowait, rec)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                gen.close()
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        producer = loop.run_in_executor(None, instrument.bind(produce))
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            # the current bin finishes scoring before the producer stops
+            await asyncio.shield(producer)
 
+    def run(
+            self,
+            start_bin: int = 0,
+            max_dl: int = 5,
+            wait=True,
+            fmt=139,
+            keepfiles=True,
+            loc=DATADIR,
+            max_wait_time: int = 120,
+            plot: bool = True,
+            on_bin: Callable[[Dict[str, Any]], None] = None,
+            fragments: bool = False) -> List[Tuple[int, int]]:
+        """Download and compare a batch of up to `max_dl` bins, starting at `start_bin`
+
+        Args:
+            plot (bool, optional): whether to plot the peak correlation of each bin. Defaults to True.
+            on_bin (Callable[[Dict[str, Any]], None], optional): called with `BinResult.as_dict()` as soon as each bin is scored. Defaults to None.
+            fragments (bool, optional): for formats 139 and 140, fetch only the MP4 fragments of each bin over keep-alive connections, instead of letting `ffmpeg` open and seek the remote file for every bin. Defaults to False.
+
+        Returns:
+            List[Tuple[int, int]]: start and stop times of candidates, relative to their bins
+        """
         candidates: List[Tuple[int, int]] = []
         peak_corr: List[float] = []
 
-        bins_str = self._bins_str
-        delta = self._midtime(0) - self._midtime(1)
+        with self._instrumented(f"{self.name}_{start_bin}"):
+            for rec in self.iter_run(
+                    start_bin=start_bin, max_dl=max_dl, wait=wait, fmt=fmt,
+                    keepfiles=keepfiles, loc=loc, max_wait_time=max_wait_time,
+                    fragments=fragments):
 
-        logging.info("Comparing query and source audio...")
+                peak_corr.append([self._midtime(rec.bin), rec.peak])
+                if rec.result is not None:
+                    candidates.append(rec.result)
+                if on_bin is not None:
+                    on_bin(rec.as_dict())
 
-        for i, fname in enumerate(self._fnames):
-            k = i + start_bin
+            if plot:
+                self._plot_peak_corr(peak_corr)
+        return candidates
 
-            result, peak = self._compare_signals(
-                i, fname,
-                max_wait_time=max_wait_time,
-                wait=wait
-            )
+    def ranked_occurrences(
+            self,
+            k: int = None,
+            min_ratio: float = 0.5) -> List[Occurrence]:
+        """Occurrences of the query found so far in all bins, highest first
+
+        Requires `top_k > 0`. Peaks closer than half the query length are one occurrence, e.g. where bins overlap.
+
+        Args:
+            k (int, optional): maximum number of occurrences. Defaults to None (all).
+            min_ratio (float, optional): drop occurrences below this fraction of the best one. Defaults to 0.5.
+
+        Returns:
+            List[Occurrence]: occurrences, times in seconds of the source
+        """
+        return rank_occurrences(
+            self.occurrences,
+            min_distance=self.query.size / self.query_rate / 2,
+            k=k, min_ratio=min_ratio
+        )
 
-            if result is None:
-                logging.info(f"Not in {bins_str[k]}")
-                peak_corr.append([
-                    self._midtime(k),
-                    peak
-                ])
-            else:
-                logging.info(bins_str[k])
-                candidates.append(result)
+    def run_video(
+            self,
+            query_video: Union[str, Path],
+            fmt: int = 160,
+            fps: float = 1.,
+            start_bin: int = 0,
+            max_dl: int = 10,
+            loc=DATADIR,
+            max_wait_time: int = 120,
+            max_bits: int = 10,
+            min_matched: float = 0.6) -> List[VideoMatch]:
+        """Find the query video by its frames, for clips whose audio was replaced
+
+        Bins are fetched with the same range extraction as `run`, but in a video-only 144p format, and hashed at `fps` frames per second. After each batch, all frames hashed so far are searched at once, so a clip spanning two bins is found as well.
+
+        Args:
+            query_video (Union[str, Path]): the clip, anything `ffmpeg` can read
+            fmt (int, optional): low-resolution video format, see `download.VIDEO_FORMATS`. Defaults to 160.
+            fps (float, optional): frames hashed per second. Defaults to 1.
+            start_bin (int, optional): first bin. Defaults to 0.
+            max_dl (int, optional): bins per batch. Defaults to 10.
+            loc (Path, optional): directory for downloaded bins. Defaults to DATADIR.
+            max_wait_time (int, optional): seconds to wait for each bin. Defaults to 120.
+            max_bits (int, optional): largest Hamming distance of matching frames. Defaults to 10.
+            min_matched (float, optional): fraction of query frames that must align. Defaults to 0.6.
+
+        Returns:
+            List[VideoMatch]: matches in seconds of the source, best first
+        """
+        if fmt not in VIDEO_FORMATS:
+            raise InvalidArgumentException('fmt', fmt, list(VIDEO_FORMATS))
+
+        query = hash_video(query_video, fps=fps)
+        times: List[np.ndarray] = []
+        hashes: List[np.ndarray] = []
+
+        with self._instrumented(f"{self.name}_video"):
+            for b0 in range(start_bin, len(self._bins), max_dl):
+                futures = []
+                for k in range(b0, min(b0 + max_dl, len(self._bins))):
+                    start, stop = int(self._bins[k][0]), int(self._bins[k][1])
+                    fetch_key = (self.source_id, start, stop, fmt)
+                    futures.append((start, FETCHES.submit(
+                        fetch_key,
+                        instrument.bind(self._fetch), k, fetch_key,
+                        fetch_bytes(stop - start, fmt), fetch_bin,
+                        self.url, start, stop, fmt,
+                        loc=loc,
+                        media_url=self._media_url(fmt)
+                    )))
+
+                for start, fut in futures:
+                    path = fut.result(timeout=max_wait_time)
+                    with instrument.stage('decode'):
+                        h = hash_video(path, fps=fps)
+                    hashes.append(h)
+                    times.append(start + np.arange(len(h)) / fps)
+
+                t = np.concatenate(times)
+                order = np.argsort(t, kind='stable')
+                with instrument.stage('correlate'):
+                    matches = search_hashes(
+                        np.concatenate(hashes)[order], query, fps,
+                        max_bits=max_bits, min_matched=min_matched,
+                        times=t[order])
+
+                for m in matches:
+                    logging.info(
+                        f"Frames: {m.distance:<10.1f} Start: {m.start:<10.1f} Stop: {m.stop:<10.1f} Aligned: {m.matched:.0%}"
+                    )
+                if matches:
+                    return matches
+
+        logging.info("No match in the video frames.")
+        return []
+
+    def run_fullsource(
+            self,
+            rate: int = None,
+            dtype: str = 'float32',
+            memory_budget: int = 64 * 2**20,
+            fmt=139,
+            loc=DATADIR,
+            threshold: float = 0.5,
+            plot: bool = True,
+            spectra: SpectrumCache = None) -> List[Tuple[int, int]]:
+        """Search the whole source at once, decoded to a memory-mapped raw file
+
+        The source is decoded once to `loc/<id>_<rate>hz.<dtype>` and reused by later queries. Correlation runs block by block, so memory use is set by `memory_budget`, not the length of the source.
+
+        Args:
+            rate (int, optional): analysis sampling rate. Defaults to the sampling rate of the query.
+            dtype (str, optional): sample type of the raw file, `float32` or `int16`. Defaults to 'float32'.
+            memory_budget (int, optional): bytes available for FFT buffers. Defaults to 64 MiB.
+            fmt (Union[int, str], optional): `yt-dl` format code of the decoded stream, or 'auto' for `choose_format`. Defaults to 139.
+            loc (Path, optional): directory of the raw file. Defaults to DATADIR.
+            threshold (float, optional): minimum peak correlation of a candidate. Defaults to 0.5.
+            plot (bool, optional): whether to plot the peak correlation of each block. Defaults to True.
+            spectra (SpectrumCache, optional): keep the spectra of the source blocks on disk, so that later queries against this source skip the forward FFTs. Defaults to None.
+
+        Returns:
+            List[Tuple[int, int]]: start and stop times of candidates, in seconds of the source
+        """
+        rate = self.query_rate if rate is None else rate
+        query = self.query
+        if rate != self.query_rate:
+            query = resample_poly(query, rate, self.query_rate)
+
+        path = raw_path(self.source_id, rate, dtype=dtype, loc=loc)
+        start, stop = self._get_source_range()
+
+        with self._instrumented(f"{self.name}_fullsource"):
+            if not path.is_file():
+                if Path(self.url).is_file():
+                    src = self.url
+                else:
+                    if fmt == 'auto':
+                        fmt = self.choose_format(rate=rate)
+                    src = self._media_url(fmt) or resolve_media_url(self.url, fmt)
+                with instrument.stage('decode'):
+                    decode_to_raw(src, path, rate, dtype=dtype)
+
+            blocks = correlate_source(
+                open_raw(path, dtype), query, rate,
+                memory_budget=memory_budget,
+                start=start, stop=stop,
+                spectra=spectra, source_id=self.source_id)
+            peak_corr, candidates = self._collect_blocks(blocks, threshold)
+
+            if plot and peak_corr:
+                self._plot_peak_corr(peak_corr)
 
-                peak_corr.append([
-                    self._midtime(k),
-                    peak
-                ])
+        return candidates
+
+    def run_live(
+            self,
+            rate: int = None,
+            dtype: str = 'float32',
+            segment_s: float = 10.,
+            threshold: float = None,
+            fmt=139,
+            loc=DATADIR,
+            poll: float = 0.5,
+            idle_timeout: float = 60.,
+            stop_on_match: bool = True,
+            stop: threading.Event = None,
+            on_match: Callable[[live.LiveMatch], None] = None) -> List[Tuple[int, int]]:
+        """Follow a live source and match the query as new audio arrives
+
+        The stream is decoded by `ffmpeg` into `loc/<id>_<rate>hz_live.<dtype>` and correlated segment by segment, so a match is reported at most `segment_s` seconds after the end of the clip has been streamed. If `source` is a local raw file, it is followed directly instead, e.g. a decode started elsewhere.
+
+        Args:
+            rate (int, optional): analysis sampling rate. Defaults to the sampling rate of the query.
+            dtype (str, optional): sample type of the raw file, `float32` or `int16`. Defaults to 'float32'.
+            segment_s (float, optional): seconds of new audio correlated at once. Defaults to 10.
+            threshold (float, optional): minimum normalized correlation of a match. Defaults to `threshold`, 0.5 unless set by `preflight`.
+            fmt (int, optional): `yt-dl` format code of the followed stream. Defaults to 139.
+            loc (Path, optional): directory of the raw file. Defaults to DATADIR.
+            poll (float, optional): seconds between checks for new audio. Defaults to 0.5.
+            idle_timeout (float, optional): stop after this many seconds without new audio. Defaults to 60.
+            stop_on_match (bool, optional): whether to stop at the first match. Defaults to True.
+            stop (threading.Event, optional): stop following as soon as this is set. Defaults to None.
+            on_match (Callable[[live.LiveMatch], None], optional): called with each match as soon as it is found. Defaults to None.
+
+        Returns:
+            List[Tuple[int, int]]: start and stop times of matches, in seconds of the stream
+        """
+        rate = self.query_rate if rate is None else rate
+        threshold = self.threshold if threshold is None else threshold
+        query = self.query
+        if rate != self.query_rate:
+            query = resample_poly(query, rate, self.query_rate)
+
+        proc = None
+        if Path(self.url).is_file():
+            path = Path(self.url)
+        else:
+            path = loc / f"{self.source_id}_{rate}hz_live.{dtype}"
+            src = self._media_url(fmt) or resolve_media_url(self.url, fmt)
+            proc = live.start_live_decode(src, path, rate, dtype=dtype)
 
-            if not keepfiles:
-                fname.unlink()
+        candidates: List[Tuple[int, int]] = []
+        try:
+            with self._instrumented(f"{self.name}_live"):
+                matches = live.follow(
+                    path, query, rate, dtype=dtype,
+                    segment_s=segment_s, threshold=threshold,
+                    poll=poll, idle_timeout=idle_timeout, stop=stop)
+
+                for match in matches:
+                    t0, t1 = int(match.start), int(math.ceil(match.stop))
+                    logging.info(
+                        f"Corr: {match.peak:<10} Start: {t0:<10} Stop: {t1:<10}"
+                    )
+                    logging.info(f"Detected at {sampling.format_hms(int(match.detected))}")
+                    candidates.append((t0, t1))
+
+                    if on_match is not None:
+                        on_match(match)
+                    if stop_on_match:
+                        break
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
 
-        self._plot_peak_corr(peak_corr)
         return candidates
 
+    @staticmethod
+    def _collect_blocks(blocks, threshold: float) -> Tuple[list, list]:
+
+        candidates: List[Tuple[int, int]] = []
+        peak_corr: List[list] = []
+
+        for block in blocks:
+
+            mid = (block.block_start + block.block_stop) / 2
+            peak_corr.append([
+                seconds2hms(mid),
+                block.peak
+            ])
+
+            if block.peak > threshold:
+                t0, t1 = int(block.start), int(math.ceil(block.stop))
+                logging.info(
+                    f"Corr: {block.peak:<10} Start: {t0:<10} Stop: {t1:<10}"
+                )
+                logging.info(sampling.bin2str(np.array(
+                    [block.block_start, block.block_stop], dtype=int
+                )))
+                candidates.append((t0, t1))
+
+        return peak_corr, candidates
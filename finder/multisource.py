@@ -0,0 +1,380 @@
+import json
+import hashlib
+import logging
+import argparse
+import threading
+import audiofile
+import numpy as np
+from pathlib import Path
+from datetime import datetime
+from math import gcd
+from concurrent.futures import ThreadPoolExecutor
+from scipy.signal import resample_poly
+from typing import Any, Dict, Iterator, List, NamedTuple, Union
+
+from finder import instrument
+from finder.cache import SharedCaches
+from finder.decode import RAW_FORMATS, as_float, decode_to_raw, open_raw, raw_path, read_raw_meta
+from finder.findsignal import read_audio_file
+from finder.live import LiveCorrelator
+from finder.main import Finder, DATADIR, DEFAULT_RATE
+
+# ---------------------------------------------------------------------------- #
+#            Search for a query across many candidate source videos            #
+# ---------------------------------------------------------------------------- #
+
+# Sources come from a playlist export, e.g.
+#
+#   yt-dlp --flat-playlist -J "https://www.youtube.com/@channel/streams" > streams.json
+#
+# or from a directory of local audio files (anything `ffmpeg` reads, or raw
+# files written by `decode.decode_to_raw`). They are ranked by cheap metadata,
+# then searched concurrently: remote sources bin by bin with `Finder`, local ones
+# block by block with a normalized correlation. Downloads and correlations are
+# limited globally, and the first confident match stops all remaining work.
+
+AUDIO_EXTS = ['.wav', '.flac', '.ogg', '.mp3', '.m4a', '.webm', '.opus']
+
+
+class SourceInfo(NamedTuple):
+    source: str
+    duration: Union[float, None]
+    upload_date: Union[str, None]
+    title: str
+
+
+class SourceMatch(NamedTuple):
+    """A confident match, times in seconds of the source"""
+    source: str
+    start: float
+    stop: float
+    peak: float
+
+
+# --------------------------------- Sources ---------------------------------- #
+
+
+def read_playlist(path: Union[Path, str]) -> List[SourceInfo]:
+    """Sources from `yt-dlp -J` (one JSON document with `entries`) or `yt-dlp -j` (one JSON per line)"""
+    with open(path, 'r', encoding='utf-8') as io:
+        text = io.read()
+
+    try:
+        docs = [json.loads(text)]
+    except json.JSONDecodeError:
+        docs = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    sources = []
+    for e in _entries(docs):
+        url = e.get('webpage_url') or e.get('url')
+        if url is None and e.get('id'):
+            url = f"https://www.youtube.com/watch?v={e['id']}"
+        if url is None:
+            continue
+
+        sources.append(SourceInfo(
+            source=url,
+            duration=e.get('duration'),
+            upload_date=e.get('upload_date'),
+            title=e.get('title') or url
+        ))
+
+    return sources
+
+
+def _entries(docs: List[Any]) -> Iterator[Dict[str, Any]]:
+    """Flatten nested playlists, e.g. the tabs of a channel, skipping unavailable entries"""
+    for doc in docs:
+        if not isinstance(doc, dict):
+            continue
+        if doc.get('entries') is not None:
+            yield from _entries(doc['entries'])
+        else:
+            yield doc
+
+
+def scan_directory(
+        dir: Union[Path, str],
+        exts: List[str] = AUDIO_EXTS) -> List[SourceInfo]:
+    """Local audio files and raw decodes in `dir`; the upload date is the modification date"""
+    sources = []
+    raw_exts = [f".{dtype}" for dtype in RAW_FORMATS]
+
+    for p in sorted(Path(dir).iterdir()):
+        if p.suffix in raw_exts and Path(f"{p}.json").is_file():
+            meta = read_raw_meta(p)
+            duration = meta['samples'] / meta['rate']
+        elif p.suffix in exts:
+            try:
+                duration = audiofile.duration(str(p))
+            except Exception:
+                duration = None
+        else:
+            continue
+
+        sources.append(SourceInfo(
+            source=str(p),
+            duration=duration,
+            upload_date=datetime.fromtimestamp(p.stat().st_mtime).strftime("%Y%m%d"),
+            title=p.stem
+        ))
+
+    return sources
+
+
+def rank_sources(
+        sources: List[SourceInfo],
+        query_duration: float = 0,
+        near_date: str = None) -> List[SourceInfo]:
+    """Order sources by how cheaply they are likely to contain the query
+
+    Sources shorter than the query are dropped. Clips are usually cut from recent streams, so the newest come first, or the closest to `near_date` (YYYYMMDD) if given; ties and unknown dates go to the shortest, which are the cheapest to search.
+    """
+    def days(date: str) -> int:
+        return datetime.strptime(date, "%Y%m%d").toordinal()
+
+    def key(s: SourceInfo):
+        if s.upload_date is None:
+            d = float('inf')
+        elif near_date is None:
+            d = -days(s.upload_date)
+        else:
+            d = abs(days(s.upload_date) - days(near_date))
+        return (d, float('inf') if s.duration is None else s.duration)
+
+    usable = [
+        s for s in sources
+        if s.duration is None or s.duration >= query_duration
+    ]
+    return sorted(usable, key=key)
+
+
+# --------------------------------- Search ----------------------------------- #
+
+
+class MultiSourceSearch:
+    def __init__(
+            self,
+            query: Union[str, Path, np.ndarray],
+            rate: int = DEFAULT_RATE,
+            threshold: float = 0.5,
+            max_sources: int = 2,
+            max_downloads: int = 1,
+            max_correlations: int = 1,
+            segment_s: float = 60.,
+            bin_kwargs: Dict[str, Any] = None,
+            max_dl: int = 10,
+            loc: Path = DATADIR,
+            caches: SharedCaches = None) -> None:
+        """Search many sources for one query, stopping everything at the first confident match
+
+        Args:
+            query (Union[str, Path, np.ndarray]): query audio, as a path or samples at `rate`
+            rate (int, optional): analysis sampling rate. Defaults to DEFAULT_RATE.
+            threshold (float, optional): minimum normalized correlation of a match, in local and remote sources. Defaults to 0.5.
+            max_sources (int, optional): sources searched at the same time. Defaults to 2.
+            max_downloads (int, optional): batches of bins downloaded at the same time, over all remote sources. Defaults to 1.
+            max_correlations (int, optional): blocks or bins correlated at the same time, over all sources. Defaults to 1.
+            segment_s (float, optional): block length of local sources, in seconds. Defaults to 60.
+            bin_kwargs (Dict[str, Any], optional): `Finder.get_bins` arguments for remote sources. Defaults to None.
+            max_dl (int, optional): bins per batch of a remote source. Defaults to 10.
+            loc (Path, optional): directory for downloaded bins and decodes of local files. Defaults to DATADIR.
+            caches (SharedCaches, optional): caches shared by the `Finder`s of remote sources. Defaults to new caches.
+        """
+        if isinstance(query, np.ndarray):
+            self.query = query
+        else:
+            self.query, _ = read_audio_file(query, rate=rate)
+
+        self.rate = rate
+        self.threshold = threshold
+        self.max_sources = max_sources
+        self.segment_s = segment_s
+        self.bin_kwargs = bin_kwargs or {}
+        self.max_dl = max_dl
+        self.loc = loc
+        self.caches = SharedCaches() if caches is None else caches
+
+        self.stop = threading.Event()
+        self.searched: List[str] = []
+        self._net = threading.BoundedSemaphore(max_downloads)
+        self._cpu = threading.BoundedSemaphore(max_correlations)
+        self._lock = threading.Lock()
+
+    @property
+    def query_duration(self) -> float:
+        return self.query.size / self.rate
+
+    def run(
+            self,
+            sources: List[SourceInfo],
+            near_date: str = None) -> Union[SourceMatch, None]:
+        """Search ranked `sources` and return the first confident match, if any"""
+        ranked = rank_sources(sources, self.query_duration, near_date=near_date)
+        logging.info(f"Searching {len(ranked)} of {len(sources)} sources")
+
+        self.stop.clear()
+        matches: List[SourceMatch] = []
+
+        def search(info: SourceInfo) -> None:
+            if self.stop.is_set():
+                return
+            with self._lock:
+                self.searched.append(info.source)
+
+            try:
+                match = self._search(info)
+            except Exception as e:
+                logging.error(f"{info.title}: {type(e).__name__}: {e}")
+                return
+
+            if match is not None:
+                with self._lock:
+                    matches.append(match)
+                self.stop.set()
+
+        # sources are submitted in ranked order, so the best start first
+        with ThreadPoolExecutor(max_workers=self.max_sources) as pool:
+            for info in ranked:
+                pool.submit(instrument.bind(search), info)
+
+        if not matches:
+            logging.info("No confident match in any source.")
+            return None
+
+        best = max(matches, key=lambda m: m.peak)
+        logging.info(
+            f"Found in {best.source}: {best.start:.1f} - {best.stop:.1f} s, peak {best.peak:.2f}"
+        )
+        return best
+
+    def _search(self, info: SourceInfo) -> Union[SourceMatch, None]:
+        logging.info(f"Searching {info.title}")
+        if Path(info.source).is_file():
+            return self._search_local(info)
+        return self._search_remote(info)
+
+    # ------------------------------ Local files ----------------------------- #
+
+    def _raw_path(self, path: Path) -> Path:
+        """Where the decode of a local file goes, e.g. `data/vod_1a2b3c4d_441hz.float32`"""
+        key = hashlib.sha1(str(path.resolve()).encode()).hexdigest()[:8]
+        return raw_path(f"{path.stem}_{key}", self.rate, loc=self.loc)
+
+    def _blocks(self, path: Path) -> Iterator[np.ndarray]:
+        """Blocks of `segment_s` of a local source at `rate`, read from a memory-mapped raw file
+
+        Audio files are decoded once to mono at `rate` by `ffmpeg` (`decode.decode_to_raw`), so only one block of a long source is in memory at a time. Raw files at another rate are resampled block by block.
+        """
+        if path.suffix in [f".{dtype}" for dtype in RAW_FORMATS]:
+            meta = read_raw_meta(path)
+            samples = open_raw(path, meta['dtype'])
+            rate = meta['rate']
+        else:
+            with instrument.stage('decode'):
+                out = decode_to_raw(path, self._raw_path(path), self.rate)
+            samples = open_raw(out)
+            rate = self.rate
+
+        size = max(int(self.segment_s * rate), 1)
+        for k in range(0, samples.shape[0], size):
+            yield _resample(as_float(samples[k:k + size]), rate, self.rate)
+
+    def _search_local(self, info: SourceInfo) -> Union[SourceMatch, None]:
+        corr = LiveCorrelator(
+            self.query, self.rate,
+            segment_s=self.segment_s, threshold=self.threshold)
+
+        for block in self._blocks(Path(info.source)):
+            if self.stop.is_set():
+                return None
+
+            with self._cpu:
+                matches = corr.feed(block)
+
+            if matches:
+                best = max(matches, key=lambda m: m.peak)
+                return SourceMatch(info.source, best.start, best.stop, best.peak)
+
+        return None
+
+    # ----------------------------- Remote sources --------------------------- #
+
+    def _search_remote(self, info: SourceInfo) -> Union[SourceMatch, None]:
+        finder = Finder(
+            info.source, self.query, rate=self.rate,
+            caches=self.caches, logfile=False, engine='segments')
+        # local and remote matches are held to the same level
+        finder.threshold = self.threshold
+        try:
+            finder.get_bins(**self.bin_kwargs)
+
+            for start_bin in range(0, len(finder._bins), self.max_dl):
+                if self.stop.is_set():
+                    return None
+
+                # a match elsewhere stops the batch and abandons its downloads
+                with self._net:
+                    finder.fetch_batch(
+                        start_bin, max_dl=self.max_dl, loc=self.loc, stop=self.stop)
+
+                # the bins are on disk, so each step of the run only scores one
+                records = finder.iter_run(
+                    start_bin, max_dl=self.max_dl, loc=self.loc, stop=self.stop)
+                try:
+                    while True:
+                        with self._cpu:
+                            rec = next(records, None)
+                        if rec is None:
+                            break
+                        if rec.result is not None:
+                            t0, t1 = rec.result
+                            return SourceMatch(
+                                info.source, rec.start + t0, rec.start + t1, rec.peak)
+                finally:
+                    records.close()
+        finally:
+            finder.close()
+
+        return None
+
+
+def _resample(x: np.ndarray, rate: int, target: int) -> np.ndarray:
+    if rate == target:
+        return x
+    g = gcd(int(rate), int(target))
+    return resample_poly(x, target // g, rate // g)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Search many candidate sources for one query clip")
+    parser.add_argument('query', type=Path)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--playlist', type=Path, help="output of `yt-dlp --flat-playlist -J`")
+    group.add_argument('--dir', type=Path, help="directory of local audio files")
+    parser.add_argument('--near-date', default=None, help="YYYYMMDD, search sources near this date first")
+    parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--max-sources', type=int, default=2)
+    parser.add_argument('--max-downloads', type=int, default=1)
+    parser.add_argument('--max-correlations', type=int, default=1)
+    parser.add_argument('--datadir', type=Path, default=DATADIR)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    sources = read_playlist(args.playlist) if args.playlist else scan_directory(args.dir)
+
+    search = MultiSourceSearch(
+        args.query,
+        threshold=args.threshold,
+        max_sources=args.max_sources,
+        max_downloads=args.max_downloads,
+        max_correlations=args.max_correlations,
+        loc=args.datadir
+    )
+    match = search.run(sources, near_date=args.near_date)
+    print(match)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import math
+import numpy as np
+from typing import Iterator, Tuple
+
+from finder.decode import as_float
+from finder.fftbackend import BACKEND
+
+# ---------------------------------------------------------------------------- #
+#        Block-wise cross-correlation of a long source with a short query      #
+# ---------------------------------------------------------------------------- #
+
+# float64 segment, its spectrum, the product and the inverse, per FFT point
+BYTES_PER_POINT = 8 + 16 + 16 + 8
+
+
+def block_size_for_budget(budget: int, query_size: int) -> int:
+    """Largest power-of-two FFT length whose working buffers fit in `budget` bytes
+
+    Args:
+        budget (int): memory budget in bytes
+        query_size (int): number of query samples
+
+    Raises:
+        ValueError: raised if the budget cannot hold a block twice the query length
+
+    Returns:
+        int: FFT length
+    """
+    nfft = 2**int(math.log2(max(budget // BYTES_PER_POINT, 1)))
+    if nfft < 2 * query_size:
+        raise ValueError(
+            f"A memory budget of {budget} bytes is too small for a query of {query_size} samples."
+        )
+    return nfft
+
+
+class OverlapSave:
+    def __init__(self, query: np.ndarray, nfft: int) -> None:
+        """Overlap-save cross-correlation with a fixed FFT length
+
+        Correlations are 'valid'-mode: value `i` of a block at `offset` is the correlation of the query with `source[offset + i : offset + i + query.size]`, so `offset + i` is the sample where the query starts.
+
+        Args:
+            query (np.ndarray): query signal
+            nfft (int): FFT length, at least twice the query length
+        """
+        if nfft < 2 * query.size:
+            raise ValueError(
+                f"FFT length {nfft} must be at least twice the query length {query.size}"
+            )
+
+        self.m = query.size
+        self.nfft = nfft
+        self.step = nfft - self.m + 1
+        self.qspec = np.conj(BACKEND.rfft(as_float(query), nfft))
+
+    def correlate_segment(self, segment: np.ndarray) -> np.ndarray:
+        """Valid-mode correlation of the query with a segment of at most `nfft` samples"""
+        n = segment.size
+        if n < self.m:
+            return np.zeros(0)
+
+        spec = BACKEND.rfft(as_float(segment), self.nfft)
+        spec *= self.qspec
+        return BACKEND.irfft(spec, self.nfft)[:n - self.m + 1]
+
+    def iter_correlate(
+            self,
+            source: np.ndarray,
+            start: int = 0,
+            stop: int = None) -> Iterator[Tuple[int, np.ndarray]]:
+        """Correlate the query with `source[start:stop]` one block at a time
+
+        Only one block of `source` is read at a time, so `source` can be a `numpy.memmap` of any length.
+
+        Yields:
+            Tuple[int, np.ndarray]: offset of the block in `source`, and its correlation
+        """
+        stop = source.shape[0] if stop is None else min(stop, source.shape[0])
+
+        for pos in self.offsets(start, stop):
+            seg = source[pos:min(pos + self.nfft, stop)]
+            yield pos, self.correlate_segment(seg)
+
+    def offsets(self, start: int, stop: int) -> range:
+        """Offsets of the blocks that cover `[start, stop)`"""
+        return range(start, max(stop - self.m + 1, start), self.step)
+
+
+# fraction of the FFT length kept for the query by `OverlapAdd`; blocks are the rest
+OVERLAP_ADD_QUERY_SHARE = 8
+
+
+class OverlapAdd:
+    def __init__(self, query: np.ndarray, nfft: int) -> None:
+        """Overlap-add cross-correlation over precomputed spectra of the source
+
+        The source is cut into blocks of `nfft - nfft // OVERLAP_ADD_QUERY_SHARE` samples whatever the query, each zero-padded to `nfft` points, so the spectra of its blocks (`block_spectrum`) can be computed once and reused by every query up to `nfft // OVERLAP_ADD_QUERY_SHARE + 1` samples long. Correlations are 'valid'-mode, as in `OverlapSave`.
+
+        Args:
+            query (np.ndarray): query signal
+            nfft (int): FFT length
+        """
+        self.m = query.size
+        self.nfft = nfft
+        self.block = nfft - nfft // OVERLAP_ADD_QUERY_SHARE
+
+        if self.m - 1 > nfft - self.block:
+            raise ValueError(
+                f"Query length {self.m} must be at most {nfft - self.block + 1} for FFT length {nfft}"
+            )
+        self.qspec = np.conj(BACKEND.rfft(as_float(query), nfft))
+
+    def block_spectrum(self, segment: np.ndarray) -> np.ndarray:
+        """Spectrum of one block of the source, of at most `self.block` samples"""
+        return BACKEND.rfft(as_float(segment), self.nfft)
+
+    def _lags(self, spectrum: np.ndarray) -> np.ndarray:
+        # lags 0 .. block-1 at the start, -(m-1) .. -1 at the end
+        return BACKEND.irfft(spectrum * self.qspec, self.nfft)
+
+    def iter_correlate(
+            self,
+            spectra: np.ndarray,
+            size: int,
+            start: int = 0,
+            stop: int = None) -> Iterator[Tuple[int, np.ndarray]]:
+        """Correlate the query with `source[start:stop]` from the spectra of its blocks
+
+        Each block costs one spectral product and one inverse FFT.
+
+        Args:
+            spectra (np.ndarray): `block_spectrum` of every block of the source, e.g. a memmap from `spectrumcache.SpectrumCache`
+            size (int): number of samples of the source
+
+        Yields:
+            Tuple[int, np.ndarray]: offset in the source of the first correlation value, and the values of one block
+        """
+        stop = size if stop is None else min(stop, size)
+        last = stop - self.m
+        if last < start:
+            return
+
+        L, m = self.block, self.m
+        lags = self._lags(spectra[start // L])
+
+        for b in range(start // L, last // L + 1):
+            corr = lags[:L]
+            lags = self._lags(spectra[b + 1]) if b + 1 < len(spectra) else None
+            # query starts near the end of block `b` run into block `b + 1`
+            if lags is not None and m > 1:
+                corr[L - m + 1:] += lags[self.nfft - m + 1:]
+
+            lo = max(start - b * L, 0)
+            hi = min(last - b * L + 1, L)
+            yield b * L + lo, corr[lo:hi]
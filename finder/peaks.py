@@ -0,0 +1,95 @@
+import numpy as np
+from scipy.ndimage import maximum_filter1d
+from typing import List, NamedTuple, Tuple
+
+# ---------------------------------------------------------------------------- #
+#          Top-K peaks with non-maximum suppression, ranked across bins        #
+# ---------------------------------------------------------------------------- #
+
+# A repeated segment (an intro, a jingle, a song sung twice) correlates with the
+# query at several places. `top_k_peaks` keeps the local maxima of each
+# correlation over a window tied to the query length and returns the K highest,
+# in one vectorized pass over one bin or a stack of equally long bins.
+# `rank_occurrences` merges the peaks of all bins in absolute source time,
+# suppressing duplicates where bins overlap, into one global ranking.
+
+
+class Occurrence(NamedTuple):
+    """A candidate occurrence of the query, times in seconds of the source"""
+    start: float
+    stop: float
+    value: float
+
+
+def top_k_peaks(
+        corr: np.ndarray,
+        k: int,
+        window: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Indices and values of the `k` highest local maxima of `corr` along its last axis
+
+    A sample is a local maximum if it is the first largest value within `window // 2` samples on either side, so two peaks are at least about `window / 2` samples apart.
+
+    Args:
+        corr (np.ndarray): correlation of one bin, or a 2D stack of bins of the same length
+        k (int): maximum number of peaks per bin
+        window (int): width of the suppression window in samples, e.g. the query length
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: indices and values, highest first, with shape `corr.shape[:-1] + (k,)`. Bins with fewer than `k` peaks are padded with index -1 and value `-inf`.
+    """
+    corr = np.asarray(corr, dtype=np.float64)
+    n = corr.shape[-1]
+    k = max(min(k, n), 1)
+
+    local = maximum_filter1d(
+        corr, size=max(window, 1) | 1, axis=-1, mode='constant', cval=-np.inf)
+    peak = corr == local
+    # on a plateau keep only the first sample
+    peak[..., 1:] &= ~(peak[..., :-1] & (corr[..., 1:] == corr[..., :-1]))
+
+    masked = np.where(peak, corr, -np.inf)
+    ind = np.argpartition(-masked, k - 1, axis=-1)[..., :k]
+    val = np.take_along_axis(masked, ind, axis=-1)
+
+    order = np.argsort(-val, axis=-1, kind='stable')
+    ind = np.take_along_axis(ind, order, axis=-1)
+    val = np.take_along_axis(val, order, axis=-1)
+
+    ind = np.where(np.isfinite(val), ind, -1)
+    return ind, val
+
+
+def rank_occurrences(
+        occurrences: List[Occurrence],
+        min_distance: float,
+        k: int = None,
+        min_ratio: float = 0.) -> List[Occurrence]:
+    """Global ranking of occurrences from all bins, without duplicates
+
+    Args:
+        occurrences (List[Occurrence]): peaks of all bins, in absolute source time
+        min_distance (float): occurrences starting closer than this, in seconds, are the same occurrence; the highest is kept
+        k (int, optional): maximum number of occurrences. Defaults to None (all).
+        min_ratio (float, optional): drop occurrences below this fraction of the highest value. Defaults to 0.
+
+    Returns:
+        List[Occurrence]: occurrences, highest first
+    """
+    if not occurrences:
+        return []
+
+    starts = np.array([o.start for o in occurrences])
+    values = np.array([o.value for o in occurrences])
+    order = np.argsort(-values, kind='stable')
+
+    kept: List[int] = []
+    for i in order:
+        if values[i] < min_ratio * values[order[0]]:
+            break
+        if kept and np.min(np.abs(starts[kept] - starts[i])) < min_distance:
+            continue
+        kept.append(i)
+        if k is not None and len(kept) >= k:
+            break
+
+    return [occurrences[i] for i in kept]
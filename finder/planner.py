@@ -0,0 +1,282 @@
+import math
+import time
+import logging
+import numpy as np
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence, Tuple
+
+from finder.instrument import Instrumentation
+
+# ---------------------------------------------------------------------------- #
+#           Choose bin width, overlap and batch size from measured costs       #
+# ---------------------------------------------------------------------------- #
+
+# Searching a source of `D` seconds for a query of `q` seconds in bins of width
+# `w` (plus `o` seconds of overlap, so that a query crossing a bin edge is still
+# wholly inside a bin) and batches of `b` concurrent downloads costs
+#
+#   T_batch = L + (w + o) / min(B, B_link / b) + b (w + o) c
+#
+# per batch, where `L` is the fixed latency of a download (process start, url
+# resolution, first byte), `B` the rate of one download in audio seconds per
+# second (YouTube throttles each stream), `B_link` the rate of all concurrent
+# downloads together and `c` the decode and correlation time per audio second,
+# paid one bin after another. A clip equally likely to be in any of the
+# `N = D / w` bins is reported after the batch that holds its bin, so the
+# expected time-to-hit is `T_batch E[ceil(j / b)]` for `j` uniform in `1..N`.
+# Wide bins and large batches amortize `L`, narrow ones stop sooner after the
+# hit; the planner searches both for the minimum.
+
+
+class CostModel(NamedTuple):
+    """Costs of one bin, in seconds"""
+    latency_s: float
+    bandwidth: float
+    correlate_s: float
+    link_bandwidth: float = float('inf')
+
+    def batch_seconds(self, length: np.ndarray, batch: np.ndarray) -> np.ndarray:
+        """Time to download and score `batch` bins of `length` seconds at once"""
+        rate = np.minimum(self.bandwidth, self.link_bandwidth / batch)
+        return self.latency_s + length / rate + batch * length * self.correlate_s
+
+
+# ~1.5 s to start yt-dlp/ffmpeg and seek, m4a at ~50x real time, xcorr at 441 Hz
+DEFAULT_COSTS = CostModel(latency_s=1.5, bandwidth=50., correlate_s=0.002)
+
+
+class BinPlan(NamedTuple):
+    binwidth: int
+    overlap: int
+    batch: int
+    nbins: int
+    expected_s: float
+
+    def bin_kwargs(self) -> Dict[str, Any]:
+        """Arguments of `Finder.get_bins` for this plan"""
+        return dict(
+            nbins=self.nbins, min_binwidth=self.binwidth,
+            max_binwidth=self.binwidth, overlap=self.overlap)
+
+
+# ------------------------------- Measurement -------------------------------- #
+
+
+def fit_download(
+        lengths: Sequence[float],
+        walls: Sequence[float],
+        default_latency: float = DEFAULT_COSTS.latency_s) -> Tuple[float, float]:
+    """Latency and rate of downloads from their lengths and wall times
+
+    Fits `wall = latency + length / rate` by least squares. If all lengths are equal the two cannot be separated, and `default_latency` is assumed.
+
+    Returns:
+        Tuple[float, float]: latency in seconds, rate in audio seconds per second
+    """
+    lengths = np.asarray(lengths, dtype=np.float64)
+    walls = np.asarray(walls, dtype=np.float64)
+
+    if lengths.size >= 2 and np.ptp(lengths) > 0:
+        slope, latency = np.polyfit(lengths, walls, 1)
+        if slope > 0 and latency >= 0:
+            return float(latency), float(1. / slope)
+
+    logging.warning(
+        f"Cannot separate download latency from rate; assuming {default_latency:.2f} s latency")
+    latency = min(default_latency, float(np.min(walls)) if walls.size else default_latency)
+    rest = np.maximum(walls - latency, 1e-3)
+    return latency, float(np.sum(lengths) / np.sum(rest))
+
+
+def costs_from_metrics(
+        metrics: Instrumentation,
+        default: CostModel = DEFAULT_COSTS) -> CostModel:
+    """Cost model from the `download`, `decode` and `correlate` stages of a run
+
+    Download lengths are the audio seconds decoded from the same bin. Stages that were not recorded keep their `default` costs.
+    """
+    downloads: Dict[Any, float] = {}
+    seconds: Dict[Any, float] = {}
+    for rec in list(metrics.records):
+        if rec['bin'] is None:
+            continue
+        if rec['stage'] == 'download':
+            downloads[rec['bin']] = downloads.get(rec['bin'], 0.) + rec['wall_s']
+        elif rec['stage'] == 'decode':
+            seconds[rec['bin']] = seconds.get(rec['bin'], 0.) + rec['audio_seconds']
+
+    bins = [k for k in downloads if seconds.get(k, 0) > 0]
+    if bins:
+        latency, bandwidth = fit_download(
+            [seconds[k] for k in bins], [downloads[k] for k in bins],
+            default_latency=default.latency_s)
+    else:
+        latency, bandwidth = default.latency_s, default.bandwidth
+
+    stages = metrics.summary()['stages']
+    work = [stages[s] for s in ['decode', 'correlate'] if s in stages]
+    audio = stages['correlate']['audio_seconds'] if 'correlate' in stages else 0
+    if audio > 0:
+        correlate_s = sum(s['wall_s'] for s in work) / audio
+    else:
+        correlate_s = default.correlate_s
+
+    return default._replace(
+        latency_s=latency, bandwidth=bandwidth, correlate_s=correlate_s)
+
+
+def measure(
+        fetch: Callable[[int, int], Any],
+        score: Callable[[Any], Any] = None,
+        lengths: Sequence[int] = (10, 60),
+        start: int = 0,
+        clock: Callable[[], float] = time.perf_counter) -> CostModel:
+    """Probe a source with downloads of different lengths
+
+    Args:
+        fetch (Callable[[int, int], Any]): downloads seconds `start` to `stop`, e.g. `download.fetch_bin` with the url bound
+        score (Callable[[Any], Any], optional): decodes and correlates what `fetch` returned. Defaults to None (no scoring cost).
+        lengths (Sequence[int], optional): probe lengths in seconds. Defaults to (10, 60).
+        start (int, optional): start of the probes in the source. Defaults to 0.
+        clock (Callable[[], float], optional): time source. Defaults to `time.perf_counter`.
+
+    Returns:
+        CostModel: measured costs
+    """
+    walls, scoring = [], 0.
+    for n in lengths:
+        t0 = clock()
+        out = fetch(start, start + n)
+        walls.append(clock() - t0)
+
+        if score is not None:
+            t0 = clock()
+            score(out)
+            scoring += clock() - t0
+
+    latency, bandwidth = fit_download(lengths, walls)
+    return CostModel(latency, bandwidth, scoring / sum(lengths))
+
+
+# --------------------------------- Planning --------------------------------- #
+
+
+def expected_batches(nbins: np.ndarray, batch: np.ndarray) -> np.ndarray:
+    """`E[ceil(j / batch)]` for `j` uniform in `1..nbins`"""
+    full, rest = np.divmod(nbins, batch)
+    total = batch * full * (full + 1) / 2 + rest * (full + 1)
+    return total / np.maximum(nbins, 1)
+
+
+def time_to_hit(
+        duration: float,
+        binwidth: np.ndarray,
+        overlap: np.ndarray,
+        batch: np.ndarray,
+        costs: CostModel) -> np.ndarray:
+    """Expected seconds until the batch holding a uniformly placed clip is scored"""
+    nbins = np.maximum(np.floor(duration / binwidth), 1)
+    per_batch = np.minimum(batch, nbins)
+    t_batch = costs.batch_seconds(binwidth + overlap, per_batch)
+    return t_batch * expected_batches(nbins, per_batch)
+
+
+def plan(
+        duration: float,
+        query_s: float,
+        costs: CostModel = DEFAULT_COSTS,
+        min_binwidth: int = 30,
+        max_binwidth: int = 900,
+        max_batch: int = 50,
+        margin_s: int = 2) -> BinPlan:
+    """Bin width, overlap and batch size with the smallest expected time-to-hit
+
+    Args:
+        duration (float): seconds of source to search
+        query_s (float): query length in seconds
+        costs (CostModel, optional): measured costs. Defaults to DEFAULT_COSTS.
+        min_binwidth (int, optional): smallest bin width considered. Defaults to 30.
+        max_binwidth (int, optional): largest bin width considered. Defaults to 900.
+        max_batch (int, optional): largest batch of concurrent downloads. Defaults to 50.
+        margin_s (int, optional): overlap beyond the query length. Defaults to 2.
+
+    Returns:
+        BinPlan: the chosen plan
+    """
+    overlap = int(math.ceil(query_s)) + margin_s
+    # a bin must hold the query, and at least one bin must fit
+    lo = max(min_binwidth, overlap)
+    hi = max(min(max_binwidth, int(duration)), lo)
+
+    widths = np.arange(lo, hi + 1, dtype=np.float64)
+    batches = np.arange(1, max_batch + 1, dtype=np.float64)
+    w, b = np.meshgrid(widths, batches, indexing='ij')
+
+    cost = time_to_hit(duration, w, overlap, b, costs)
+    # a batch larger than the number of bins is the same plan; prefer the smallest
+    i, j = np.unravel_index(np.argmin(cost), cost.shape)
+
+    binwidth = int(widths[i])
+    nbins = max(int(duration // binwidth), 1)
+    chosen = BinPlan(
+        binwidth=binwidth, overlap=overlap, batch=int(min(batches[j], nbins)),
+        nbins=nbins, expected_s=float(cost[i, j]))
+
+    logging.info(
+        f"Costs: latency {costs.latency_s:.2f} s, {costs.bandwidth:.1f} audio s/s per download "
+        f"({costs.link_bandwidth:.1f} in all), "
+        f"scoring {costs.correlate_s * 1e3:.2f} ms per audio s"
+    )
+    logging.info(
+        f"Plan: binwidth {chosen.binwidth} s, overlap {chosen.overlap} s, batch {chosen.batch}, "
+        f"{chosen.nbins} bins, expected time-to-hit {chosen.expected_s:.1f} s"
+    )
+    return chosen
+
+
+# ---------------------------- Simulated backend ----------------------------- #
+
+
+class SimulatedBackend:
+    def __init__(self, costs: CostModel) -> None:
+        """Downloads and scoring on a virtual clock, following `costs` exactly
+
+        The downloads of a batch run concurrently and share the link; their bins are scored one after another.
+        """
+        self.costs = costs
+        self.clock = 0.
+        self.downloads = 0
+
+    def now(self) -> float:
+        return self.clock
+
+    def fetch(self, start: int, stop: int) -> Tuple[int, int]:
+        self.fetch_batch([(start, stop)])
+        return start, stop
+
+    def fetch_batch(self, bins: List[Tuple[int, int]]) -> None:
+        rate = min(self.costs.bandwidth, self.costs.link_bandwidth / len(bins))
+        longest = max(stop - start for start, stop in bins)
+        self.clock += self.costs.latency_s + longest / rate
+        self.downloads += len(bins)
+
+    def score(self, bin: Tuple[int, int]) -> None:
+        start, stop = bin
+        self.clock += (stop - start) * self.costs.correlate_s
+
+    def search(
+            self,
+            bins: np.ndarray,
+            batch: int,
+            clip_start: float,
+            clip_s: float) -> float:
+        """Virtual seconds until the batch holding the clip is scored, `inf` if no bin holds it"""
+        self.clock = 0.
+        for k in range(0, len(bins), batch):
+            chunk = [tuple(b) for b in np.asarray(bins[k:k + batch]).tolist()]
+            self.fetch_batch(chunk)
+            for b in chunk:
+                self.score(b)
+
+            if any(b[0] <= clip_start and clip_start + clip_s <= b[1] for b in chunk):
+                return self.clock
+        return float('inf')
@@ -0,0 +1,169 @@
+import logging
+import argparse
+import numpy as np
+from pathlib import Path
+from typing import List, NamedTuple, Tuple
+
+from finder.segments import EPS, distinctiveness, frame_rms
+
+# ---------------------------------------------------------------------------- #
+#          Check that a query can be localized before searching for it         #
+# ---------------------------------------------------------------------------- #
+
+# Measured on the query alone:
+#
+#   energy over time  RMS of 0.5 s frames; frames below `SILENCE_REL` of the
+#                     loud frames are silent, and the span from the first to the
+#                     last active frame is what is worth searching for
+#   sidelobe ratio    largest normalized autocorrelation of that span outside
+#                     its main lobe (`segments.distinctiveness`); near 1 for
+#                     loops and steady tones, which match at every repeat
+#   bandwidth         frequencies holding the central 90% of the spectral energy;
+#                     with the active duration it bounds how sharp the peak can be
+#
+# From these, `preflight` recommends the analysis rate, the engine and the
+# normalized-correlation threshold, and warns when a search is likely wasted.
+
+FRAME_S = 0.5
+SILENCE_REL = 0.1
+MIN_ACTIVE_S = 3.
+MAX_SIDELOBE = 0.8
+# duration x bandwidth below which peaks are too broad to place the clip
+MIN_TIME_BANDWIDTH = 50.
+# queries this long, or with this much silence trimmed, are scored by segments
+SEGMENTS_MIN_S = 15.
+SEGMENTS_MIN_TRIM = 0.1
+
+
+class Preflight(NamedTuple):
+    """Analysis of a query, times in seconds of the query"""
+    duration_s: float
+    span: Tuple[float, float]
+    active_fraction: float
+    sidelobe: float
+    band: Tuple[float, float]
+    rate: int
+    engine: str
+    threshold: float
+    warnings: List[str]
+
+    @property
+    def localizable(self) -> bool:
+        return not self.warnings
+
+    def log(self) -> None:
+        logging.info(
+            f"Preflight: {self.span[1] - self.span[0]:.1f} of {self.duration_s:.1f} s active "
+            f"({self.span[0]:.1f} - {self.span[1]:.1f} s), sidelobe {self.sidelobe:.2f}, "
+            f"band {self.band[0]:.0f} - {self.band[1]:.0f} Hz"
+        )
+        logging.info(
+            f"Recommended: rate {self.rate} Hz, engine {self.engine}, threshold {self.threshold:.2f}")
+        for w in self.warnings:
+            logging.warning(w)
+
+
+def active_span(query: np.ndarray, rate: int) -> Tuple[int, int, float]:
+    """Samples from the first to the last active frame, and the fraction of frames that are active"""
+    frame = max(int(FRAME_S * rate), 1)
+    rms = frame_rms(query, frame)
+    active = np.flatnonzero(rms >= SILENCE_REL * np.percentile(rms, 95))
+
+    if active.size == 0 or rms.max() < EPS:
+        return 0, 0, 0.
+
+    start = int(active[0] * frame)
+    stop = query.size if active[-1] == rms.size - 1 else int((active[-1] + 1) * frame)
+    return start, stop, active.size / rms.size
+
+
+def energy_band(x: np.ndarray, rate: int, share: float = 0.9) -> Tuple[float, float]:
+    """Lowest and highest frequencies of the central `share` of the spectral energy"""
+    power = np.abs(np.fft.rfft(x - np.mean(x)))**2
+    cum = np.cumsum(power)
+    if cum[-1] < EPS:
+        return 0., 0.
+
+    freqs = np.fft.rfftfreq(x.size, 1 / rate)
+    tail = (1 - share) / 2
+    lo, hi = np.searchsorted(cum / cum[-1], [tail, 1 - tail])
+    return float(freqs[min(lo, freqs.size - 1)]), float(freqs[min(hi, freqs.size - 1)])
+
+
+def recommend_rate(band: Tuple[float, float], rate: int, sidelobe: float) -> int:
+    """Analysis rate for a query whose energy lies in `band` at `rate`
+
+    Halved while the band fits in a quarter of the rate, so bins are smaller and faster to score; doubled if an ambiguous query has energy up to Nyquist, where higher frequencies may tell repeats apart.
+    """
+    if band[1] >= 0.45 * rate and sidelobe > MAX_SIDELOBE:
+        return 2 * rate
+    while band[1] < rate / 4 and rate // 2 >= 100:
+        rate //= 2
+    return rate
+
+
+def preflight(query: np.ndarray, rate: int) -> Preflight:
+    """Measure a query and recommend how to search for it
+
+    Args:
+        query (np.ndarray): query signal
+        rate (int): its sampling rate
+
+    Returns:
+        Preflight: measurements, recommendations, and warnings; no warnings if the query is likely to be found
+    """
+    query = np.asarray(query, dtype=np.float64)
+    duration = query.size / rate
+    start, stop, active_fraction = active_span(query, rate)
+    active = query[start:stop]
+    active_s = active.size / rate
+
+    sidelobe = 1 - distinctiveness(active, rate) if active.size else 1.
+    band = energy_band(active, rate) if active.size else (0., 0.)
+
+    warnings = []
+    if active_s < MIN_ACTIVE_S:
+        warnings.append(
+            f"Only {active_s:.1f} s of the query has signal; at least {MIN_ACTIVE_S:.0f} s is needed")
+    if sidelobe > MAX_SIDELOBE:
+        warnings.append(
+            f"The query repeats itself (sidelobe {sidelobe:.2f}): it will match at many places")
+    if active_s * (band[1] - band[0]) < MIN_TIME_BANDWIDTH:
+        warnings.append(
+            f"Too little duration and bandwidth ({active_s:.1f} s x {band[1] - band[0]:.0f} Hz) for a sharp peak")
+
+    trimmed = 1 - active_s / duration if duration > 0 else 0.
+    engine = 'segments' if duration >= SEGMENTS_MIN_S or trimmed >= SEGMENTS_MIN_TRIM else 'xcorr'
+    # above the query's own sidelobes, so repeats inside the bin are not accepted
+    threshold = float(np.clip(sidelobe + 0.2, 0.4, 0.9))
+
+    return Preflight(
+        duration_s=duration,
+        span=(start / rate, stop / rate),
+        active_fraction=active_fraction,
+        sidelobe=sidelobe,
+        band=band,
+        rate=recommend_rate(band, rate, sidelobe),
+        engine=engine,
+        threshold=threshold,
+        warnings=warnings,
+    )
+
+
+def main() -> None:
+    from finder.findsignal import read_audio_file
+
+    parser = argparse.ArgumentParser(description="Check a query clip before searching for it")
+    parser.add_argument('query', type=Path)
+    parser.add_argument('--rate', type=int, default=441, help="analysis sampling rate")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    query, rate = read_audio_file(args.query, rate=args.rate)
+    report = preflight(query, rate)
+    report.log()
+    print("localizable" if report.localizable else "unlikely to be localizable")
+
+
+if __name__ == '__main__':
+    main()
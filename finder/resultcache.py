@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Tuple, Union
+
+# ---------------------------------------------------------------------------- #
+#         Content-addressed cache of correlation outcomes in SQLite            #
+# ---------------------------------------------------------------------------- #
+
+# Results are keyed by what determines them, not by where they came from:
+#
+#   query_hash   SHA-1 of the query samples
+#   audio_hash   SHA-1 of the decoded samples of a bin
+#   params       scoring parameters, e.g. engine, rate, threshold mode
+#
+# so re-plotting, re-ordering bins or changing `max_dl` never triggers a
+# recomputation, and overlapping searches share scores for identical bins.
+# A second table remembers the audio hash of each bin file (by path, size and
+# modification time), so cached bins do not even have to be decoded again.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    query_hash TEXT NOT NULL,
+    audio_hash TEXT NOT NULL,
+    params TEXT NOT NULL,
+    peak REAL NOT NULL,
+    argmax INTEGER NOT NULL,
+    candidates TEXT,
+    created REAL NOT NULL,
+    PRIMARY KEY (query_hash, audio_hash, params)
+);
+CREATE TABLE IF NOT EXISTS peaks (
+    query_hash TEXT NOT NULL,
+    audio_hash TEXT NOT NULL,
+    params TEXT NOT NULL,
+    peaks TEXT NOT NULL,
+    PRIMARY KEY (query_hash, audio_hash, params)
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    audio_hash TEXT NOT NULL,
+    rate INTEGER NOT NULL
+);
+"""
+
+
+class CachedResult(NamedTuple):
+    peak: float
+    argmax: int
+    candidates: Union[Tuple[int, int], None]
+
+
+def hash_samples(data: np.ndarray) -> str:
+    """SHA-1 of an array's samples"""
+    return hashlib.sha1(np.ascontiguousarray(data).tobytes()).hexdigest()
+
+
+def params_key(**params) -> str:
+    """Canonical string for a set of scoring parameters"""
+    return json.dumps(params, sort_keys=True, separators=(',', ':'))
+
+
+class ResultCache:
+    def __init__(self, path: Union[Path, str]) -> None:
+        """Store peak, argmax and candidate times of each (query, bin, parameters)
+
+        Args:
+            path (Union[Path, str]): SQLite database file, created if missing
+        """
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+
+        self.hits = 0
+        self.misses = 0
+
+    def close(self) -> None:
+        self._db.close()
+
+    def lookup(
+            self,
+            query_hash: str,
+            audio_hash: str,
+            params: str) -> Union[CachedResult, None]:
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT peak, argmax, candidates FROM results "
+                "WHERE query_hash=? AND audio_hash=? AND params=?",
+                (query_hash, audio_hash, params)
+            ).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        peak, argmax, candidates = row
+        candidates = None if candidates is None else tuple(json.loads(candidates))
+        return CachedResult(peak, argmax, candidates)
+
+    def store(
+            self,
+            query_hash: str,
+            audio_hash: str,
+            params: str,
+            peak: float,
+            argmax: int,
+            candidates: Union[Tuple[int, int], None]) -> None:
+
+        if candidates is not None:
+            candidates = json.dumps([int(t) for t in candidates])
+
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (query_hash, audio_hash, params, float(peak), int(argmax),
+                 candidates, time.time())
+            )
+
+    def lookup_peaks(
+            self,
+            query_hash: str,
+            audio_hash: str,
+            params: str) -> Union[List[Tuple[float, float, float]], None]:
+        """Top-K occurrences stored by `store_peaks`, as (start, stop, value) in seconds of the bin"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT peaks FROM peaks "
+                "WHERE query_hash=? AND audio_hash=? AND params=?",
+                (query_hash, audio_hash, params)
+            ).fetchone()
+
+        return None if row is None else [tuple(p) for p in json.loads(row[0])]
+
+    def store_peaks(
+            self,
+            query_hash: str,
+            audio_hash: str,
+            params: str,
+            peaks: List[Tuple[float, float, float]]) -> None:
+
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO peaks VALUES (?, ?, ?, ?)",
+                (query_hash, audio_hash, params,
+                 json.dumps([[float(x) for x in p] for p in peaks]))
+            )
+
+    # --------------------- Audio hashes of files on disk -------------------- #
+
+    def file_hash(self, path: Path) -> Union[Tuple[str, int], None]:
+        """Audio hash and sampling rate of a previously decoded file, if unchanged"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT audio_hash, rate FROM files "
+                "WHERE path=? AND size=? AND mtime_ns=?",
+                (str(Path(path).resolve()), st.st_size, st.st_mtime_ns)
+            ).fetchone()
+
+        return None if row is None else (row[0], row[1])
+
+    def remember_file(self, path: Path, audio_hash: str, rate: int) -> None:
+        st = os.stat(path)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                (str(Path(path).resolve()), st.st_size, st.st_mtime_ns,
+                 audio_hash, rate)
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            n = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return dict(entries=n, hits=self.hits, misses=self.misses)
@@ -1,60 +1,206 @@
-from ast import Assert
+import os
+import json
 import math
-import time
 import yt_dlp
 import logging
 import numpy as np
-from random import shuffle
 import matplotlib.pyplot as plt
+from pathlib import Path
 from typing import List, Tuple, Dict, Any, Union
 
-from finder.common import InvalidArgumentException, seconds2str, vec_seconds2str
+from finder import instrument
+from finder.common import InvalidArgumentException, seconds2str
+from finder.download import get_source_id
 
 # ---------------------------------------------------------------------------- #
 #         Functions that discretize a video into bins of equal duration        #
 # ---------------------------------------------------------------------------- #
 
 
+# fields of `yt-dlp` metadata kept in the caches; the rest is megabytes of thumbnails, signed urls and captions
+META_KEYS = ['id', 'title', 'duration', 'was_live', 'heatmap', 'chapters', 'formats']
+# fields kept for each format, for `download.audio_formats`
+FORMAT_KEYS = ['format_id', 'ext', 'acodec', 'vcodec', 'abr', 'tbr', 'asr', 'filesize', 'filesize_approx']
+
+
+def get_video_meta(
+        url: str,
+        cache=None,
+        loc: Path = None) -> Dict[str, Any]:
+    """Metadata of a YouTube video, resolved once
+
+    Looked up in `cache`, then in `loc/<id>.meta.json`, then with `yt-dlp`; only `META_KEYS`, and `FORMAT_KEYS` of each format, are kept.
+
+    Args:
+        url (str): video URL
+        cache (LRUCache, optional): cache of video metadata keyed by url. Defaults to None.
+        loc (Path, optional): directory of metadata files. Defaults to None (not saved).
+
+    Returns:
+        Dict[str, Any]: metadata
+    """
+    meta: Dict[str, Any] = None
+    if cache is not None:
+        meta = cache.get(url)
+
+    path = None if loc is None else Path(loc) / f"{get_source_id(url)}.meta.json"
+    if meta is None and path is not None and path.is_file():
+        with open(path, 'r') as io:
+            meta = json.load(io)
+
+    # saved before a field was added to `META_KEYS`
+    if meta is not None and not all(k in meta for k in META_KEYS):
+        meta = None
+
+    if meta is None:
+        with instrument.stage('resolve'):
+            info = yt_dlp.YoutubeDL().extract_info(
+                url, download=False
+            )
+        meta = {k: info.get(k) for k in META_KEYS}
+        meta['formats'] = [
+            {k: f.get(k) for k in FORMAT_KEYS} for f in meta['formats'] or []]
+
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, 'w') as io:
+                json.dump(meta, io)
+            os.replace(tmp, path)
+
+    if cache is not None:
+        cache.put(url, meta)
+    return meta
+
+
 def get_video_duration(
-        url: str) -> Tuple[int, str]:
+        url: str,
+        cache=None,
+        loc: Path = None) -> Tuple[int, str]:
     """Get duration of a YouTube video
 
     Args:
         url (str): video URL
+        cache (LRUCache, optional): cache of video metadata keyed by url. Defaults to None.
+        loc (Path, optional): directory of metadata files; see `get_video_meta`. Defaults to None.
 
     Returns:
         Tuple[int, str]: duration in seconds, and as a HH:MM:SS string
     """
-    meta: Dict[str, Any] = yt_dlp.YoutubeDL().extract_info(
-        url, download=False
-    )
-    seconds = meta['duration']
+    seconds = get_video_meta(url, cache=cache, loc=loc)['duration']
 
     return seconds, seconds2str(seconds)
 
 
-def get_bin_edges(
-        i: int,
-        start: int,
-        nbins: int,
-        rbinedges: List[int],
-        binorder: str = 'mirrored') -> Tuple[int, int]:
+def heatmap_rate(heatmap: List[Dict[str, float]], duration: int = 0) -> np.ndarray:
+    """Replay intensity in each second, from the `heatmap` of `get_video_meta`
 
-    if binorder == 'mirrored':
-        ind = (i // 2) * (-1)**(i % 2)
-        ind += start
-    else:
-        ind = i
+    Args:
+        heatmap (List[Dict[str, float]]): segments with `start_time`, `end_time` and `value`
+        duration (int, optional): minimum length of the output. Defaults to 0.
+
+    Returns:
+        np.ndarray: intensity per second
+    """
+    start = np.array([h['start_time'] for h in heatmap], dtype=np.float64)
+    stop = np.array([h['end_time'] for h in heatmap], dtype=np.float64)
+    value = np.array([h['value'] for h in heatmap], dtype=np.float64)
+
+    start = np.floor(start).astype(np.int64)
+    stop = np.maximum(np.ceil(stop).astype(np.int64), start + 1)
+    size = max(duration, int(stop.max(initial=0)))
+
+    # +value at each start, -value at each stop
+    steps = np.zeros(size + 1)
+    np.add.at(steps, start, value)
+    np.add.at(steps, stop, -value)
+    return np.cumsum(steps[:-1])
+
+
+BINORDERS = ['linear', 'mirrored', 'random', 'chat', 'heatmap']
+
+
+def mirrored_order(nbins: int) -> np.ndarray:
+    """Bin indices from the middle outwards, alternating right and left, then bin 0
+
+    For `nbins=6`: `[3, 4, 2, 5, 1, 0]`.
+    """
+    i = np.arange(1, nbins + 1)
+    ind = (i // 2) * np.where(i % 2, -1, 1) + (nbins + 1) // 2
+    ind = ind[(ind >= 1) & (ind < nbins)]
+    return np.append(ind, 0)
+
+
+def bin_density(prior: np.ndarray, bins: np.ndarray) -> np.ndarray:
+    """Mean of a per-second `prior` over each `[start, stop]` bin, in seconds of the source"""
+    cum = np.concatenate(([0.], np.cumsum(prior, dtype=np.float64)))
+    lo = np.clip(bins[:, 0] - 1, 0, prior.size)
+    hi = np.clip(bins[:, 1], 0, prior.size)
+    return (cum[hi] - cum[lo]) / np.maximum(bins[:, 1] - bins[:, 0] + 1, 1)
+
+
+def prior_order(density: np.ndarray) -> np.ndarray:
+    """Bin indices by decreasing `density`, ties in `mirrored_order`"""
+    order = mirrored_order(density.size)
+    return order[np.argsort(-density[order], kind='stable')]
 
-    if ind >= nbins:
-        return None
 
-    left, right = rbinedges[ind-1] + 1, rbinedges[ind]
+def skip_order(order: np.ndarray, skipsize: int) -> np.ndarray:
+    """Visit every `skipsize`-th element of `order`, then the ones after them, and so on
 
-    if left > right:
-        raise ValueError
+    For `skipsize=3`: positions `0, 3, 6, ..., 1, 4, 7, ..., 2, 5, 8, ...`.
+    """
+    if skipsize <= 0:
+        return order
+    pos = np.arange(order.size)
+    return order[np.argsort(pos % skipsize, kind='stable')]
+
+
+def bin_order(
+        nbins: int,
+        binorder: Union[str, List[int]] = 'mirrored',
+        skipsize: int = 0,
+        seed: int = None,
+        density: np.ndarray = None) -> np.ndarray:
+    """Order in which bins `0, ..., nbins-1` are visited
+
+    Args:
+        nbins (int): number of bins
+        binorder (Union[str, List[int]], optional): `linear`, `mirrored`, `random`, `chat`, `heatmap`, or a list of bin indices. Defaults to 'mirrored'.
+        skipsize (int, optional): see `skip_order`. Not applied to `random`, `chat` and `heatmap`. Defaults to 0.
+        seed (int, optional): seed for `random`. Defaults to None.
+        density (np.ndarray, optional): activity of each bin, highest first for `chat` and `heatmap`; see `prior_order`. Defaults to None.
+
+    Returns:
+        np.ndarray: bin indices
+    """
+    if isinstance(binorder, (list, tuple, np.ndarray)):
+        order = np.asarray(binorder, dtype=np.int64)
+        if order.size and (order.min() < 0 or order.max() >= nbins):
+            raise ValueError(
+                f"Bin indices must be between 0 and {nbins-1}")
+    elif binorder == 'mirrored':
+        order = mirrored_order(nbins)
+    elif binorder == 'linear':
+        order = np.arange(nbins)
+    elif binorder == 'random':
+        order = np.random.default_rng(seed).permutation(nbins)
+        logging.info(f"Shuffled bin indices:\n{order}\n")
+        return order
+    elif binorder == 'chat':
+        if density is None:
+            raise ValueError("binorder 'chat' needs the activity of each bin")
+        return prior_order(density)
+    elif binorder == 'heatmap':
+        if density is not None:
+            return prior_order(density)
+        logging.info("No replay heatmap, bins are in mirrored order")
+        order = mirrored_order(nbins)
     else:
-        return left, right
+        raise InvalidArgumentException('binorder', binorder, BINORDERS)
+
+    return skip_order(order, skipsize)
+
 
 def _plotbins(bins: List[List[int]]) -> None:
     _, ax = plt.subplots()
@@ -70,40 +216,6 @@ def _plotbins(bins: List[List[int]]) -> None:
     
     plt.show()
 
-def _randomize_bins(
-    bins: List[List[int]],
-    inds: List[int], 
-    nbins: int) -> List[List[int]]:
-    
-    shuffle(inds)
-    logging.info("Shuffled bin indices:\n", inds, '\n')
-    return [bins[i] for i in inds]
-
-def _skip_bins(
-    bins: List[List[int]], 
-    inds: List[int],
-    nbins: int, 
-    skipsize: int) -> List[List[int]]:
-
-    skipped: List[int] = [] 
-    for i in range(skipsize):
-        skipped.extend(inds[i:nbins:skipsize])
-    
-    if len(skipped) == nbins:
-        skipped.extend(
-            [i for i in range(nbins) if i not in skipped]
-        )
-    
-    out = [bins[i] for i in skipped]
-    try:
-        assert len(out) == nbins 
-    except AssertionError:
-        raise ValueError(
-            f"Number of bins do not match before ({nbins}) and after ({len(out)} applying skip size {skipsize}."
-        )
-
-    return out 
-
 def get_bins(
         duration: int,
         nbins: int = 10,
@@ -112,9 +224,15 @@ def get_bins(
         min_binwidth: int = 30,
         max_binwidth: int = 120,
         start_delta: int = 0,
+        overlap: int = 0,
+        priority: List[Tuple[float, float]] = None,
+        prior: np.ndarray = None,
+        seed: int = None,
         plot=False) -> np.ndarray:
     """Get bins containing start and stop times that cover the given duration
 
+    Bin `k` covers seconds `k * binwidth + 1` to `(k + 1) * binwidth + overlap` after `start_delta`, clipped to `duration`. All times are integer seconds.
+
     Args:
         duration (int): duration in seconds
         nbins (int, optional): initial number of bins. Defaults to 10.
@@ -123,20 +241,22 @@ def get_bins(
         min_binwidth (int, optional): minimum bin duration. Defaults to 30.
         max_binwidth (int, optional): maximum bin duration. Defaults to 120.
         start_delta (int, optional): offset for beginning. Defaults to 0.
+        overlap (int, optional): seconds each bin extends into the next, so that a query up to this long is wholly inside some bin. Defaults to 0.
+        priority (List[Tuple[float, float]], optional): `[start, stop]` windows in seconds of the source, best first, whose bins go first; see `prioritize_bins`. Defaults to None.
+        prior (np.ndarray, optional): activity of the source in each second from its start, e.g. chat messages from `chatprior.chat_rate` or replays from `heatmap_rate`; `binorder='chat'` or `'heatmap'` visits the bins with the highest mean first. Defaults to None.
+        seed (int, optional): seed for `binorder='random'`. Defaults to None.
         plot (bool, optional): whether to plot bin order and duration. Defaults to False.
 
     Returns:
-        np.ndarray: 2D array of `[start times, end times]` 
+        np.ndarray: 2D integer array of `[start times, end times]` 
     """
 
-    if (not isinstance(binorder, list)) and\
-        (binorder not in ['linear', 'mirrored', 'random']):
+    if (not isinstance(binorder, (list, tuple, np.ndarray))) and\
+        (binorder not in BINORDERS):
         raise InvalidArgumentException(
-            'binorder', binorder,
-            ['linear', 'mirrored', 'random']
+            'binorder', binorder, BINORDERS
         )
 
-    bins: List[List[int]] = []
     binwidth = math.floor(duration / nbins)
 
     if binwidth < min_binwidth:
@@ -152,41 +272,76 @@ def get_bins(
         """
     )
 
-    bininds = np.arange(1, nbins+1)
-    rbinedges = bininds * binwidth
-    ind0 = int(np.median(bininds))
+    positions = np.arange(nbins)
+    bins = np.stack(
+        (positions * binwidth + 1,
+         np.minimum((positions + 1) * binwidth + overlap, max(duration, binwidth))),
+        axis=1
+    ).astype(np.int64)
+
+    density = None if prior is None else bin_density(prior, bins + start_delta)
+    order = bin_order(nbins, binorder, skipsize=skipsize, seed=seed, density=density)
+    bins = bins[order]
 
-    for i in range(1, nbins+1):
-        try:
-            edges = get_bin_edges(
-                i, ind0, nbins, rbinedges, binorder=binorder
-            )
-        except ValueError:
-            break
-
-        if edges is not None:
-            bins.append(edges)
-            
-    if binorder == 'mirrored':
-        bins.append((1, rbinedges[0]))
-    else:
-        bins.insert(0, (1, rbinedges[0]))
-
-    if binorder == 'random' or skipsize > 0:
-        inds = list(range(len(bins)))
-        if binorder == 'random':
-            bins = _randomize_bins(
-                bins, inds, nbins)
-        elif skipsize > 0:
-            bins = _skip_bins(
-                bins, inds, nbins, skipsize)
-            
     if plot:
         _plotbins(bins)
 
     # N x 2 array
-    return np.array(bins) + start_delta 
+    bins = bins + start_delta
+    if priority:
+        bins = prioritize_bins(bins, priority)
+    return bins
+
+
+def prioritize_bins(
+        bins: np.ndarray,
+        windows: List[Tuple[float, float]]) -> np.ndarray:
+    """Move the bins covering each window, best window first, to the front
+
+    The bins of a window are those overlapping it, most overlap first; a bin that wholly contains the window is the only one taken. The other bins keep their order.
+    """
+    order: List[np.ndarray] = []
+    taken = np.zeros(len(bins), dtype=bool)
+    for w0, w1, *_ in windows:
+        overlap = np.minimum(bins[:, 1], w1) - np.maximum(bins[:, 0], w0)
+        inside = np.flatnonzero((bins[:, 0] <= w0) & (bins[:, 1] >= w1))
+
+        if inside.size:
+            # the narrowest containing bin, then the one first in the plan
+            picks = inside[np.argsort(bins[inside, 1] - bins[inside, 0], kind='stable')[:1]]
+        else:
+            touching = np.flatnonzero(overlap > 0)
+            picks = touching[np.argsort(-overlap[touching], kind='stable')]
+
+        picks = picks[~taken[picks]]
+        taken[picks] = True
+        order.append(picks)
+
+    order.append(np.flatnonzero(~taken))
+    return bins[np.concatenate(order).astype(np.int64)]
+
+
+def format_hms(secs: np.ndarray) -> np.ndarray:
+    """Vectorized `HH:MM:SS` formatting of integer seconds; hours may exceed 24"""
+    secs = np.asarray(secs, dtype=np.int64)
+    h, rem = np.divmod(secs, 3600)
+    m, s = np.divmod(rem, 60)
+
+    def pad(x: np.ndarray) -> np.ndarray:
+        return np.char.zfill(x.astype(str), 2)
+
+    return np.char.add(
+        np.char.add(np.char.add(pad(h), ':'), np.char.add(pad(m), ':')),
+        pad(s)
+    )
+
+
+def bin2str(bin: np.ndarray) -> str:
+    """Format one bin as in the log files, e.g. `['00:05:01' '00:06:00']`"""
+    a, b = format_hms(bin)
+    return f"['{a}' '{b}']"
+
 
 def bins2str(bin_arr: np.ndarray) -> np.ndarray:
     print(f"Min Time: {np.min(bin_arr[:,0]):<8} Max Time: {np.max(bin_arr[:,1]):<8}")
-    return vec_seconds2str(bin_arr)
+    return format_hms(bin_arr)
@@ -0,0 +1,148 @@
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Iterator
+
+from finder.fftbackend import BACKEND
+
+# ---------------------------------------------------------------------------- #
+#           Admit fetch, decode and score work under a byte budget             #
+# ---------------------------------------------------------------------------- #
+
+# Each stage of a bin reserves an estimate of its peak memory before it starts
+# and releases it when it ends:
+#
+#   fetch     a yt-dlp/ffmpeg child process, plus the media bytes when fragments
+#             are held in memory
+#   score     decoded samples (float32 from the pipe and a float64 copy), the
+#             FFT buffers and spectra of the correlation, and its output
+#
+# Reservations are granted in arrival order as soon as they fit, except that
+# scoring goes first: downloads queue behind bins waiting to be scored instead
+# of piling up, and as much work runs at once as the budget allows. A reservation larger than the whole budget
+# is granted when nothing else is reserved.
+
+# resident size of one yt-dlp + ffmpeg download
+PROCESS_BYTES = 48 * 2**20
+
+# approximate bitrates of the `yt-dl` formats used for bins, in bytes per second
+FORMAT_BYTES_PER_S = {
+    139: 6_000, 140: 16_000, 599: 4_000,
+    249: 6_500, 250: 8_500, 251: 17_000, 600: 4_500,
+    160: 12_000, 278: 12_000,
+}
+
+
+def fetch_bytes(seconds: float, fmt: int = 139, fragments: bool = False) -> int:
+    """Peak memory of downloading a bin of `seconds`"""
+    media = int(seconds * FORMAT_BYTES_PER_S.get(fmt, 16_000))
+    # fragments are held in memory, then piped to ffmpeg
+    return PROCESS_BYTES + (2 * media if fragments else 0)
+
+
+def decode_bytes(seconds: float, rate: int) -> int:
+    """Peak memory of decoding `seconds` to float64 samples at `rate` through a float32 pipe"""
+    return int(seconds * rate) * (4 + 8)
+
+
+def correlate_bytes(data_size: int, query_size: int) -> int:
+    """Peak memory of correlating `data_size` samples with `query_size` samples"""
+    nfft = BACKEND.plan_len(query_size, data_size)
+    spectrum = (nfft // 2 + 1) * 16
+    # padded input, data spectrum, product, inverse transform, correlation
+    return nfft * 8 + 2 * spectrum + nfft * 8 + (data_size + query_size) * 8
+
+
+def score_bytes(seconds: float, rate: int, query_size: int) -> int:
+    """Peak memory of decoding and scoring a bin of `seconds`"""
+    return decode_bytes(seconds, rate) + correlate_bytes(int(seconds * rate), query_size)
+
+
+class MemoryBudget:
+    def __init__(self, limit: int = None) -> None:
+        """Byte budget shared by all stages, granting reservations in arrival order
+
+        Args:
+            limit (int, optional): bytes available. Defaults to None (unlimited).
+        """
+        self.limit = limit
+        self.in_use = 0
+        self.peak = 0
+        self.waits = 0
+
+        self._cond = threading.Condition()
+        self._queue: Deque[object] = deque()
+
+    def set_limit(self, limit: int = None) -> None:
+        with self._cond:
+            self.limit = limit
+            self._cond.notify_all()
+
+    def _fits(self, nbytes: int) -> bool:
+        if self.limit is None:
+            return True
+        return self.in_use == 0 or self.in_use + nbytes <= self.limit
+
+    def acquire(self, nbytes: int, timeout: float = None, urgent: bool = False) -> int:
+        """Wait until `nbytes` fit in the budget and reserve them
+
+        Args:
+            nbytes (int): bytes to reserve
+            timeout (float, optional): seconds to wait. Defaults to None (wait forever).
+            urgent (bool, optional): queue ahead of other waiters, e.g. work that frees memory of finished downloads. Defaults to False.
+
+        Raises:
+            TimeoutError: raised if they do not fit within `timeout` seconds
+
+        Returns:
+            int: bytes reserved, to pass to `release`
+        """
+        nbytes = max(int(nbytes), 0)
+        ticket = object()
+
+        with self._cond:
+            if self.limit is not None and nbytes > self.limit:
+                logging.warning(
+                    f"Reservation of {nbytes / 2**20:.0f} MiB exceeds the budget of {self.limit / 2**20:.0f} MiB")
+
+            if urgent:
+                self._queue.appendleft(ticket)
+            else:
+                self._queue.append(ticket)
+            ready = lambda: self._queue[0] is ticket and self._fits(nbytes)
+            waited = not ready()
+            try:
+                if not self._cond.wait_for(ready, timeout):
+                    raise TimeoutError(
+                        f"{nbytes} bytes did not fit in the memory budget")
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+            self.waits += waited
+
+        return nbytes
+
+    def release(self, nbytes: int) -> None:
+        with self._cond:
+            self.in_use -= nbytes
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(
+            self,
+            nbytes: int,
+            timeout: float = None,
+            urgent: bool = False) -> Iterator[int]:
+        granted = self.acquire(nbytes, timeout=timeout, urgent=urgent)
+        try:
+            yield granted
+        finally:
+            self.release(granted)
+
+
+# shared by every `Finder` in this process; unlimited until `set_limit`
+BUDGET = MemoryBudget()
@@ -0,0 +1,206 @@
+import logging
+import numpy as np
+from typing import List, NamedTuple, Tuple
+
+from finder.fftbackend import BACKEND
+
+# ---------------------------------------------------------------------------- #
+#      Split a query into short distinctive segments and vote on offsets       #
+# ---------------------------------------------------------------------------- #
+
+EPS = 1e-12
+
+
+def frame_rms(x: np.ndarray, frame: int) -> np.ndarray:
+    """Root-mean-square amplitude of consecutive, non-overlapping frames"""
+    n = x.size // frame
+    if n < 1:
+        return np.sqrt(np.mean(x**2, keepdims=True))
+    return np.sqrt(np.mean(x[:n*frame].reshape(n, frame)**2, axis=1))
+
+
+def trim_query(
+        query: np.ndarray,
+        rate: int,
+        frame_s: float = 0.5,
+        rel_threshold: float = 0.1) -> Tuple[np.ndarray, int]:
+    """Remove silent or flat stretches from the start and end of a query
+
+    A frame is silent if its RMS amplitude is below `rel_threshold` times the median RMS of all frames.
+
+    Returns:
+        Tuple[np.ndarray, int]: trimmed query, and the number of samples removed from its start
+    """
+    frame = max(int(frame_s * rate), 1)
+    rms = frame_rms(query, frame)
+    active = np.flatnonzero(rms >= rel_threshold * np.median(rms))
+
+    if active.size == 0:
+        return query, 0
+
+    start = active[0] * frame
+    stop = min((active[-1] + 1) * frame, query.size)
+    if active[-1] == rms.size - 1:
+        stop = query.size
+
+    return query[start:stop], int(start)
+
+
+def distinctiveness(segment: np.ndarray, rate: int, mainlobe_s: float = 0.05) -> float:
+    """How sharply a segment matches only itself, between 0 and 1
+
+    One minus the largest normalized autocorrelation outside the main lobe. Silence, noise floors and loops (music, repeated sounds) have high sidelobes and score low.
+    """
+    x = segment - np.mean(segment)
+    energy = np.dot(x, x)
+    if energy < EPS:
+        return 0.
+
+    nfft = BACKEND.fast_len(2 * x.size)
+    spec = BACKEND.rfft(x, nfft)
+    ac = BACKEND.irfft(spec * np.conj(spec), nfft)[:x.size] / energy
+
+    lobe = max(int(mainlobe_s * rate), 1)
+    if lobe >= ac.size:
+        return 0.
+    return float(1 - np.max(np.abs(ac[lobe:])))
+
+
+class Segment(NamedTuple):
+    offset: int
+    samples: np.ndarray
+    score: float
+
+
+class Verdict(NamedTuple):
+    """Outcome of scoring one bin with a segmented query
+
+    `start` is the best implied start of the (untrimmed) query in samples of the bin, whether or not it was `found`. `rejected` bins failed the first segment.
+    """
+    found: bool
+    start: int
+    peak: float
+    votes: int
+    rejected: bool
+
+
+class SegmentedQuery:
+    def __init__(
+            self,
+            query: np.ndarray,
+            rate: int,
+            segment_s: float = 5.,
+            min_segments: int = 2,
+            trim: bool = True) -> None:
+        """A query split into short segments, ranked by how distinctive they are
+
+        Args:
+            query (np.ndarray): query signal
+            rate (int): sampling rate
+            segment_s (float, optional): segment length in seconds. Defaults to 5.
+            min_segments (int, optional): shorten segments so that the query yields at least this many. Defaults to 2.
+            trim (bool, optional): whether to remove silent stretches at the start and end of the query. Defaults to True.
+        """
+        self.rate = rate
+        self.size = query.size
+
+        self.offset = 0
+        if trim:
+            query, self.offset = trim_query(query, rate)
+
+        seglen = min(
+            int(segment_s * rate),
+            max(query.size // max(min_segments, 1), 1)
+        )
+
+        segments = []
+        for off in range(0, query.size - seglen + 1, seglen):
+            seg = query[off:off + seglen].astype(np.float64)
+            score = distinctiveness(seg, rate)
+            if score > 0:
+                segments.append(Segment(self.offset + off, seg, score))
+
+        if not segments:
+            raise ValueError("The query has no segments with signal.")
+
+        self.segments: List[Segment] = sorted(
+            segments, key=lambda s: s.score, reverse=True)
+
+        logging.info(
+            f"Segmented query: {len(self.segments)} segments of {seglen/rate:.1f} s, trimmed {self.offset/rate:.1f} s"
+        )
+
+    @staticmethod
+    def _ncc(
+            data_spec: np.ndarray,
+            energy: np.ndarray,
+            nfft: int,
+            n: int,
+            seg: np.ndarray) -> np.ndarray:
+        """Valid-mode normalized cross-correlation from a precomputed data spectrum"""
+        m = seg.size
+        spec = np.conj(BACKEND.rfft(seg, nfft))
+        spec *= data_spec
+        corr = BACKEND.irfft(spec, nfft)
+        corr = corr[:n - m + 1]
+
+        # sliding energy of `data` over windows of length `m`
+        window = energy[m:] - energy[:-m]
+        return corr / (np.sqrt(np.maximum(window, EPS)) * np.linalg.norm(seg) + EPS)
+
+    def score(
+            self,
+            data: np.ndarray,
+            reject_below: float = 0.3,
+            accept: float = 0.5,
+            min_votes: int = 2,
+            tolerance_s: float = 0.5) -> Verdict:
+        """Score a bin: early rejection with the best segment, then offset voting
+
+        Args:
+            data (np.ndarray): bin signal at the same rate as the query
+            reject_below (float, optional): reject the bin if the most distinctive segment peaks below this normalized correlation. Defaults to 0.3.
+            accept (float, optional): minimum mean normalized correlation of the voting segments. Defaults to 0.5.
+            min_votes (int, optional): minimum number of segments that agree on the offset. Defaults to 2.
+            tolerance_s (float, optional): maximum disagreement between offsets, in seconds. Defaults to 0.5.
+
+        Returns:
+            Verdict: whether the query was found, and where it starts in samples of `data`
+        """
+        n = data.size
+        usable = [s for s in self.segments if s.samples.size <= n]
+        if not usable:
+            return Verdict(False, 0, 0., 0, True)
+
+        nfft = BACKEND.fast_len(n + usable[0].samples.size)
+        data = data.astype(np.float64)
+        data_spec = BACKEND.rfft(data, nfft)
+        energy = np.concatenate(([0.], np.cumsum(data**2)))
+
+        starts: List[int] = []
+        peaks: List[float] = []
+
+        for k, seg in enumerate(usable):
+            ncc = self._ncc(data_spec, energy, nfft, n, seg.samples)
+            i = int(np.argmax(ncc))
+
+            if k == 0 and ncc[i] < reject_below:
+                return Verdict(False, i - seg.offset, float(ncc[i]), 0, True)
+
+            starts.append(i - seg.offset)
+            peaks.append(float(ncc[i]))
+
+        # the offset implied by the most segments wins
+        starts = np.array(starts)
+        peaks = np.array(peaks)
+        tol = tolerance_s * self.rate
+        agree = np.abs(starts[:, None] - starts[None, :]) <= tol
+        votes = agree.sum(axis=1)
+        best = int(np.argmax(votes + peaks / (peaks.size + 1)))
+
+        voters = agree[best]
+        peak = float(np.mean(peaks[voters]))
+        start = int(np.median(starts[voters]))
+
+        found = votes[best] >= min(min_votes, len(usable)) and peak >= accept
+        return Verdict(bool(found), start, peak, int(votes[best]), False)
@@ -0,0 +1,400 @@
+import json
+import asyncio
+import logging
+import argparse
+import itertools
+import threading
+from pathlib import Path
+from datetime import datetime
+from typing import Any, Dict, List, Tuple, Union
+
+from finder.cache import SharedCaches
+from finder.fftbackend import BACKEND
+from finder.scheduler import BUDGET
+from finder.main import Finder, DATADIR
+
+# ---------------------------------------------------------------------------- #
+#             Long-running local search service with a job queue               #
+# ---------------------------------------------------------------------------- #
+
+# Endpoints (JSON over HTTP/1.1, localhost only by default):
+#
+#   POST   /jobs              submit a search, returns `{"id": ...}`
+#   GET    /jobs              list jobs
+#   GET    /jobs/<id>         status and result of a job
+#   GET    /jobs/<id>/events  per-bin progress, streamed as newline-delimited JSON
+#   DELETE /jobs/<id>         cancel a job; a running job stops after its current bin
+#   GET    /health            queue length and cache statistics
+#
+# A job is a JSON object with the arguments of `Finder` and `Finder.run`:
+#
+#   {
+#       "source": "https://youtu.be/...",
+#       "query": "data/clip.m4a",
+#       "priority": 0,
+#       "source_start": "00:05:00",
+#       "source_stop": "00:30:00",
+#       "query_kwargs": {},
+#       "bin_kwargs": {"max_binwidth": 150, "skipsize": 5},
+#       "run_kwargs": {"max_dl": 50, "fmt": 139},
+#       "start_bin": 1,
+#       "max_bin": 50
+#   }
+#
+# Jobs with a lower `priority` run first; ties run in submission order.
+
+JOB_STATES = ['queued', 'running', 'done', 'failed', 'cancelled']
+
+REASONS = {
+    200: 'OK', 201: 'Created', 400: 'Bad Request',
+    404: 'Not Found', 405: 'Method Not Allowed', 409: 'Conflict',
+    500: 'Internal Server Error'
+}
+
+
+class Job:
+    def __init__(self, id: int, spec: Dict[str, Any]) -> None:
+        if 'source' not in spec or 'query' not in spec:
+            raise ValueError("A job needs at least `source` and `query`.")
+
+        self.id = id
+        self.spec = spec
+        self.priority = int(spec.get('priority', 0))
+
+        self.state = 'queued'
+        self.events: List[Dict[str, Any]] = []
+        self.result: Dict[str, Any] = None
+        self.error: str = None
+        self.submitted = datetime.now().isoformat(timespec='seconds')
+
+        self._changed = asyncio.Event()
+        self.stop = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ['done', 'failed', 'cancelled']
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        """Append an event and wake up all streams. Must run in the event loop."""
+        self.events.append(event)
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def set_state(self, state: str, **fields) -> None:
+        self.state = state
+        for k, v in fields.items():
+            setattr(self, k, v)
+        self.publish(dict(event='state', state=state))
+
+    async def wait(self) -> None:
+        await self._changed.wait()
+
+    def summary(self) -> Dict[str, Any]:
+        return dict(
+            id=self.id,
+            state=self.state,
+            priority=self.priority,
+            submitted=self.submitted,
+            source=self.spec['source'],
+            query=str(self.spec['query']),
+            bins_done=sum(e.get('event') == 'bin' for e in self.events),
+            result=self.result,
+            error=self.error
+        )
+
+
+class SearchService:
+    def __init__(
+            self,
+            host: str = '127.0.0.1',
+            port: int = 8765,
+            workers: int = 1,
+            caches: SharedCaches = None,
+            datadir: Path = DATADIR) -> None:
+        """Serve search jobs from a priority queue, keeping caches warm between jobs
+
+        Args:
+            host (str, optional): address to bind. Defaults to '127.0.0.1'.
+            port (int, optional): port to bind. Defaults to 8765.
+            workers (int, optional): number of jobs that run at the same time. Defaults to 1.
+            caches (SharedCaches, optional): caches of decoded audio, query spectra and media urls. Defaults to new caches.
+            datadir (Path, optional): directory for downloaded bins. Defaults to `DATADIR`.
+        """
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.caches = SharedCaches() if caches is None else caches
+        self.datadir = datadir
+
+        self.jobs: Dict[int, Job] = {}
+        self._ids = itertools.count(1)
+        self._queue: asyncio.PriorityQueue = None
+        self._server: asyncio.AbstractServer = None
+        self._tasks: List[asyncio.Task] = []
+
+    # ------------------------------- Job queue ------------------------------ #
+
+    def submit(self, spec: Dict[str, Any]) -> Job:
+        job = Job(next(self._ids), spec)
+        self.jobs[job.id] = job
+        self._queue.put_nowait((job.priority, job.id, job))
+        return job
+
+    def cancel(self, job: Job) -> bool:
+        if job.state == 'running':
+            # the worker marks it cancelled once the search has stopped
+            job.stop.set()
+            return True
+        if job.state != 'queued':
+            return False
+        job.set_state('cancelled')
+        return True
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                if job.state != 'queued':
+                    continue
+
+                job.set_state('running')
+
+                def publish(event: Dict[str, Any]) -> None:
+                    loop.call_soon_threadsafe(job.publish, event)
+
+                try:
+                    result = await asyncio.to_thread(
+                        self._run_job, job.spec, publish, job.stop)
+                except Exception as e:
+                    logging.exception(f"Job {job.id} failed.")
+                    job.set_state('failed', error=f"{type(e).__name__}: {e}")
+                else:
+                    job.set_state(
+                        'cancelled' if job.stop.is_set() else 'done', result=result)
+            finally:
+                self._queue.task_done()
+
+    def _run_job(
+            self,
+            spec: Dict[str, Any],
+            publish,
+            stop: threading.Event = None) -> Dict[str, Any]:
+        """Run one search in a worker thread, stopping at the first hit or when `stop` is set"""
+
+        finder = Finder(
+            source=spec['source'],
+            query=spec['query'],
+            source_start=spec.get('source_start'),
+            source_stop=spec.get('source_stop'),
+            caches=self.caches,
+            logfile=False,
+            **spec.get('query_kwargs', {})
+        )
+        finder.get_bins(**spec.get('bin_kwargs', {}))
+
+        run_kwargs = dict(loc=self.datadir)
+        run_kwargs.update(spec.get('run_kwargs', {}))
+        # results are streamed as events, not plotted
+        run_kwargs.pop('plot', None)
+        max_dl = run_kwargs.setdefault('max_dl', 50)
+
+        start_bin = int(spec.get('start_bin', 0))
+        max_bin = int(spec.get('max_bin', len(finder._bins)))
+        hits: List[Dict[str, Any]] = []
+        checked: List[int] = []
+
+        while start_bin < min(max_bin, len(finder._bins)) and not hits:
+            # leaving the loop at a hit abandons the rest of the batch
+            for rec in finder.iter_run(start_bin=start_bin, stop=stop, **run_kwargs):
+                record = rec.as_dict()
+                checked.append(rec.bin)
+                publish(dict(event='bin', **record))
+                if rec.result is not None:
+                    hits.append(record)
+                    break
+
+            if stop is not None and stop.is_set():
+                break
+            start_bin += max_dl
+
+        return dict(hits=hits, bins_checked=len(checked))
+
+    # --------------------------------- HTTP --------------------------------- #
+
+    async def _read_request(
+            self,
+            reader: asyncio.StreamReader) -> Tuple[str, str, Any]:
+
+        request_line = (await reader.readline()).decode('latin-1').strip()
+        if not request_line:
+            raise ConnectionError("Empty request")
+
+        method, path, _ = request_line.split(' ', 2)
+
+        headers: Dict[str, str] = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            k, _, v = line.partition(':')
+            headers[k.strip().lower()] = v.strip()
+
+        body = None
+        length = int(headers.get('content-length', 0))
+        if length > 0:
+            body = json.loads(await reader.readexactly(length))
+
+        return method.upper(), path.split('?')[0].rstrip('/'), body
+
+    @staticmethod
+    async def _respond(
+            writer: asyncio.StreamWriter,
+            status: int,
+            payload: Union[Dict, List]) -> None:
+
+        body = json.dumps(payload).encode('utf-8')
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    @staticmethod
+    async def _stream_events(writer: asyncio.StreamWriter, job: Job) -> None:
+        """Send all events of `job` as chunked NDJSON until the job finishes"""
+
+        writer.write((
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: application/x-ndjson\r\n"
+            "Transfer-Encoding: chunked\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode('latin-1'))
+
+        sent = 0
+        while True:
+            waiter = asyncio.ensure_future(job.wait())
+            for event in job.events[sent:]:
+                line = (json.dumps(event) + "\n").encode('utf-8')
+                writer.write(f"{len(line):X}\r\n".encode('latin-1') + line + b"\r\n")
+            sent = len(job.events)
+            await writer.drain()
+
+            if job.finished:
+                waiter.cancel()
+                break
+            await waiter
+
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _handle(
+            self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter) -> None:
+        try:
+            try:
+                method, path, body = await self._read_request(reader)
+            except (ValueError, json.JSONDecodeError) as e:
+                await self._respond(writer, 400, dict(error=str(e)))
+                return
+
+            parts = [p for p in path.split('/') if p]
+
+            if parts == ['health']:
+                await self._respond(writer, 200, dict(
+                    queued=sum(j.state == 'queued' for j in self.jobs.values()),
+                    running=sum(j.state == 'running' for j in self.jobs.values()),
+                    caches=self.caches.stats()
+                ))
+            elif parts == ['jobs'] and method == 'GET':
+                await self._respond(
+                    writer, 200, [j.summary() for j in self.jobs.values()])
+            elif parts == ['jobs'] and method == 'POST':
+                try:
+                    job = self.submit(body or {})
+                except (ValueError, TypeError) as e:
+                    await self._respond(writer, 400, dict(error=str(e)))
+                else:
+                    await self._respond(writer, 201, dict(id=job.id))
+            elif len(parts) >= 2 and parts[0] == 'jobs':
+                try:
+                    job = self.jobs[int(parts[1])]
+                except (KeyError, ValueError):
+                    await self._respond(writer, 404, dict(error=path))
+                    return
+
+                if len(parts) == 3 and parts[2] == 'events':
+                    await self._stream_events(writer, job)
+                elif method == 'DELETE':
+                    if self.cancel(job):
+                        await self._respond(writer, 200, job.summary())
+                    else:
+                        await self._respond(writer, 409, dict(
+                            error=f"Job {job.id} is {job.state}"))
+                else:
+                    await self._respond(writer, 200, job.summary())
+            else:
+                await self._respond(writer, 404, dict(error=path))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    # ------------------------------- Lifecycle ------------------------------ #
+
+    async def start(self) -> None:
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [
+            asyncio.create_task(self._worker())
+            for _ in range(self.workers)
+        ]
+        self._server = await asyncio.start_server(
+            self._handle, self.host, self.port)
+
+        self.port = self._server.sockets[0].getsockname()[1]
+        print(f"Search service listening on http://{self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in self._tasks:
+            task.cancel()
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Local clip search service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--datadir', type=Path, default=DATADIR)
+    parser.add_argument('--memory-budget-mb', type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    BACKEND.load(args.datadir / 'fft_config.json')
+    if args.memory_budget_mb is not None:
+        BUDGET.set_limit(args.memory_budget_mb * 2**20)
+    service = SearchService(
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        datadir=args.datadir
+    )
+    asyncio.run(service.serve_forever())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import os
+import time
+import socket
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Union
+
+# ---------------------------------------------------------------------------- #
+#          Coalesce identical fetches within and across processes              #
+# ---------------------------------------------------------------------------- #
+
+
+class FileLock:
+    def __init__(
+            self,
+            path: Union[Path, str],
+            timeout: float = None,
+            poll: float = 0.2,
+            stale_after: float = 3600) -> None:
+        """Cross-process lock backed by an exclusively created lock file
+
+        Works on any platform and filesystem that supports `O_EXCL`. A lock file older than `stale_after` seconds is assumed to belong to a crashed process and is removed.
+
+        Args:
+            path (Union[Path, str]): path of the lock file
+            timeout (float, optional): seconds to wait before raising `TimeoutError`. Defaults to None (wait forever).
+            poll (float, optional): seconds between attempts. Defaults to 0.2.
+            stale_after (float, optional): age in seconds after which a lock is broken. Defaults to 3600.
+        """
+        self.path = Path(path)
+        self.timeout = timeout
+        self.poll = poll
+        self.stale_after = stale_after
+        self._held = False
+
+    def _is_stale(self) -> bool:
+        try:
+            age = time.time() - self.path.stat().st_mtime
+        except FileNotFoundError:
+            return False
+        return age > self.stale_after
+
+    def acquire(self) -> None:
+        t0 = time.monotonic()
+        while True:
+            try:
+                fd = os.open(
+                    self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self._is_stale():
+                    logging.warning(f"Breaking stale lock {self.path}")
+                    self.path.unlink(missing_ok=True)
+                    continue
+
+                if self.timeout is not None and\
+                        time.monotonic() - t0 > self.timeout:
+                    raise TimeoutError(f"Could not acquire {self.path}")
+
+                time.sleep(self.poll)
+                continue
+
+            with os.fdopen(fd, 'w') as io:
+                io.write(f"{socket.gethostname()} {os.getpid()}")
+
+            self._held = True
+            return
+
+    def release(self) -> None:
+        if self._held:
+            self.path.unlink(missing_ok=True)
+            self._held = False
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class SingleFlight:
+    def __init__(self, max_workers: int = 64) -> None:
+        """Run at most one call per key at a time; concurrent callers share its `Future`
+
+        Args:
+            max_workers (int, optional): maximum number of calls running at once. Defaults to 64.
+        """
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='singleflight'
+        )
+        self._inflight: Dict[Hashable, Future] = {}
+        self._refs: Dict[Hashable, int] = {}
+        self._abandoned: set = set()
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.shared = 0
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def _forget(self, key: Hashable, fut: Future) -> None:
+        with self._lock:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+                self._refs.pop(key, None)
+                self._abandoned.discard(key)
+
+    def submit(
+            self,
+            key: Hashable,
+            fn: Callable[..., Any],
+            *args, **kwargs) -> Future:
+        """Start `fn(*args, **kwargs)` unless a call with the same `key` is in flight
+
+        Returns:
+            Future: the new call, or the one already in flight for `key`
+        """
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None and key not in self._abandoned:
+                self.shared += 1
+                self._refs[key] += 1
+                return fut
+
+            fut = self._executor.submit(fn, *args, **kwargs)
+            self._inflight[key] = fut
+            self._refs[key] = 1
+            self._abandoned.discard(key)
+            self.calls += 1
+
+        fut.add_done_callback(lambda f: self._forget(key, f))
+        return fut
+
+    def abandon(self, key: Hashable, fut: Future) -> bool:
+        """Give up on a call returned by `submit`; it is cancelled once no caller wants it
+
+        A call that has not started is cancelled outright. One that is running can check `abandoned(key)` and stop early.
+
+        Returns:
+            bool: whether no caller wants the call anymore
+        """
+        with self._lock:
+            if self._inflight.get(key) is not fut:
+                return False
+            self._refs[key] -= 1
+            if self._refs[key] > 0:
+                return False
+            self._abandoned.add(key)
+
+        fut.cancel()
+        return True
+
+    def abandoned(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._abandoned
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Blocking version of `submit`"""
+        return self.submit(key, fn, *args, **kwargs).result()
+
+
+# shared by every `Finder` in this process
+FETCHES = SingleFlight()
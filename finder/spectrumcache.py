@@ -0,0 +1,133 @@
+import os
+import logging
+import numpy as np
+from pathlib import Path
+from typing import List
+
+from finder import instrument
+from finder.overlapsave import OverlapAdd
+from finder.singleflight import FileLock
+
+# ---------------------------------------------------------------------------- #
+#             Spectra of source blocks, computed once for all queries          #
+# ---------------------------------------------------------------------------- #
+
+# The forward FFTs of a full-source search depend only on the source when it is
+# cut into fixed blocks (`overlapsave.OverlapAdd`). They are saved as complex64
+# `.npy` files, one row per block, next to the raw decode:
+#
+#   <loc>/<id>_<rate>hz_<nfft>.spectra.npy
+#
+# A file takes about 4.6 bytes per source sample, a little more than the
+# float32 decode. A query then costs one product and one inverse FFT per block,
+# instead of a forward and an inverse FFT per block of overlap-save. Files are
+# memory-mapped when read, so only the rows of the current block are resident,
+# and the least recently used files are deleted when the directory holds more
+# than `quota` bytes of them.
+
+SPECTRA_SUFFIX = '.spectra.npy'
+
+
+def spectra_path(source_id: str, rate: int, nfft: int, loc: Path = None) -> Path:
+    """Path of the block spectra of a source, e.g. `data/abc_441hz_1048576.spectra.npy`"""
+    loc = Path.cwd() if loc is None else Path(loc)
+    return loc / f"{source_id}_{rate}hz_{nfft}{SPECTRA_SUFFIX}"
+
+
+def build_spectra(source: np.ndarray, out: Path, nfft: int) -> Path:
+    """Compute the spectrum of every block of `source` once and save them to `out`
+
+    The file is written to a temporary path under a lock and renamed when complete, as in `decode.decode_to_raw`.
+    """
+    out = Path(out)
+
+    with FileLock(out.with_name(f".{out.name}.lock")):
+        if out.is_file():
+            return out
+
+        engine = OverlapAdd(np.zeros(1), nfft)
+        block = engine.block
+        nblocks = -(-source.shape[0] // block)
+        part = out.with_name(f"{out.stem}.part{os.getpid()}.npy")
+        logging.info(f"Computing {nblocks} block spectra for {out.name}")
+
+        try:
+            spectra = np.lib.format.open_memmap(
+                part, mode='w+', dtype=np.complex64, shape=(nblocks, nfft // 2 + 1))
+            for b in range(nblocks):
+                spectra[b] = engine.block_spectrum(source[b * block:(b + 1) * block])
+            spectra.flush()
+            del spectra
+
+            os.replace(part, out)
+        finally:
+            part.unlink(missing_ok=True)
+
+    return out
+
+
+class SpectrumCache:
+    def __init__(self, loc: Path, quota: int = 4 * 2**30) -> None:
+        """Block spectra of sources on disk, bounded in total size
+
+        Args:
+            loc (Path): directory of the spectra files
+            quota (int, optional): bytes of spectra files kept in `loc`. Defaults to 4 GiB.
+        """
+        self.loc = Path(loc)
+        self.quota = quota
+        self.hits = 0
+        self.misses = 0
+
+    def files(self) -> List[Path]:
+        """Spectra files, least recently used first"""
+        return sorted(
+            self.loc.glob(f"*{SPECTRA_SUFFIX}"), key=lambda p: p.stat().st_mtime)
+
+    def usage(self) -> int:
+        return sum(p.stat().st_size for p in self.files())
+
+    def get(
+            self,
+            source_id: str,
+            rate: int,
+            nfft: int,
+            source: np.ndarray) -> np.ndarray:
+        """Memory-mapped spectra of the blocks of `source`, computed and saved on first use
+
+        Args:
+            source_id (str): id of the source, e.g. `download.get_source_id`
+            rate (int): sampling rate of `source`
+            nfft (int): FFT length of `overlapsave.OverlapAdd`
+            source (np.ndarray): source samples, e.g. `decode.open_raw`; only read when the spectra are not cached
+
+        Returns:
+            np.ndarray: complex64 array of `nfft // 2 + 1` frequencies per block
+        """
+        path = spectra_path(source_id, rate, nfft, self.loc)
+
+        if path.is_file():
+            self.hits += 1
+            # most recently used
+            os.utime(path)
+        else:
+            self.misses += 1
+            with instrument.stage('spectra'):
+                build_spectra(source, path, nfft)
+            self.evict(keep=path)
+
+        return np.load(path, mmap_mode='r')
+
+    def evict(self, keep: Path = None) -> None:
+        """Delete the least recently used files until the rest fit in `quota`"""
+        files = self.files()
+        total = sum(p.stat().st_size for p in files)
+
+        for p in files:
+            if total <= self.quota:
+                break
+            if p == keep:
+                continue
+            total -= p.stat().st_size
+            p.unlink(missing_ok=True)
+            logging.info(f"Evicted {p.name} from the spectrum cache")
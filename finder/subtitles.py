@@ -0,0 +1,251 @@
+import re
+import html
+import math
+import logging
+import unicodedata
+import numpy as np
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Union
+
+import yt_dlp
+
+from finder import instrument
+from finder.download import get_source_id
+from finder.peaks import Occurrence, rank_occurrences
+from finder.singleflight import FileLock
+
+# ---------------------------------------------------------------------------- #
+#          Narrow the search with the subtitles of the source, if any          #
+# ---------------------------------------------------------------------------- #
+
+# Auto-captions of a VOD are a few KB, against megabytes of audio per bin. The
+# cues are indexed by token (words, or overlapping character pairs for Chinese,
+# Japanese and Korean, which are written without spaces), and a quote from the
+# clip is matched against every window of `window_s` seconds: a window scores
+# the IDF-weighted fraction of the quote's tokens that occur in it. The best
+# windows, padded for caption drift, are then searched first
+# (`sampling.prioritize_bins`).
+
+SUBTITLE_EXTS = ['.vtt', '.srv1', '.srv2', '.srv3', '.xml']
+
+_CJK = (
+    r'\u3040-\u30ff'                          # hiragana, katakana
+    r'\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'  # han
+    r'\uac00-\ud7af'                          # hangul
+)
+_TOKEN = re.compile(rf'[{_CJK}]+|[^\W{_CJK}]+')
+_CJK_RUN = re.compile(rf'[{_CJK}]+')
+
+
+class Cue(NamedTuple):
+    start: float
+    stop: float
+    text: str
+
+
+class TextWindow(NamedTuple):
+    """A stretch of the source whose subtitles match the quote, times in seconds"""
+    start: float
+    stop: float
+    score: float
+
+
+# --------------------------------- Parsing ---------------------------------- #
+
+
+def _vtt_seconds(ts: str) -> float:
+    parts = ts.replace(',', '.').split(':')
+    return sum(float(p) * 60**i for i, p in enumerate(reversed(parts)))
+
+
+def parse_vtt(text: str) -> List[Cue]:
+    """Cues of a WebVTT file
+
+    Inline timestamps and styling tags of YouTube auto-captions are removed, and so are the lines each auto-caption cue repeats from the previous one.
+    """
+    cues: List[Cue] = []
+    previous: List[str] = []
+
+    for block in re.split(r'\n\s*\n', text.replace('\r\n', '\n')):
+        lines = block.strip().split('\n')
+        for i, line in enumerate(lines):
+            m = re.match(r'\s*([\d:.,]+)\s+-->\s+([\d:.,]+)', line)
+            if m is None:
+                continue
+
+            body = [
+                html.unescape(re.sub(r'<[^>]*>', '', t)).strip()
+                for t in lines[i + 1:]
+            ]
+            body = [t for t in body if t]
+            new = [t for t in body if t not in previous]
+            previous = body
+
+            if new:
+                cues.append(Cue(
+                    _vtt_seconds(m.group(1)), _vtt_seconds(m.group(2)),
+                    " ".join(new)))
+            break
+
+    return cues
+
+
+def parse_srv(text: str) -> List[Cue]:
+    """Cues of YouTube's XML timed text: `srv1` (`<text start dur>`, seconds) or `srv2`/`srv3` (`<p t d>`, milliseconds)"""
+    root = ET.fromstring(text)
+    cues = []
+
+    for el in root.iter():
+        if el.tag == 'text' and 'start' in el.attrib:
+            start = float(el.get('start'))
+            stop = start + float(el.get('dur', 0))
+        elif el.tag == 'p' and 't' in el.attrib:
+            start = int(el.get('t')) / 1000
+            stop = start + int(el.get('d', 0)) / 1000
+        else:
+            continue
+
+        body = html.unescape("".join(el.itertext())).strip()
+        if body:
+            cues.append(Cue(start, stop, " ".join(body.split())))
+
+    return cues
+
+
+def read_subtitles(path: Union[Path, str]) -> List[Cue]:
+    path = Path(path)
+    if path.suffix not in SUBTITLE_EXTS:
+        raise ValueError(f"Unknown subtitle format: {path.name}")
+
+    with open(path, 'r', encoding='utf-8') as io:
+        text = io.read()
+
+    return parse_vtt(text) if path.suffix == '.vtt' else parse_srv(text)
+
+
+def fetch_subtitles(
+        url: str,
+        loc: Path = None,
+        lang: str = 'en',
+        ext: str = 'vtt') -> Path:
+    """Download the subtitles of a video once, preferring uploaded over automatic ones
+
+    `lang='live_chat', ext='json'` gets the chat replay of a past stream.
+
+    Raises:
+        FileNotFoundError: raised if the video has no subtitles in `lang`
+
+    Returns:
+        Path: path of the file, `loc/<id>.<lang>.<ext>`
+    """
+    loc = Path.cwd() if loc is None else Path(loc)
+    source_id = get_source_id(url)
+    path = loc / f"{source_id}.{lang}.{ext}"
+
+    with FileLock(loc / f".{path.name}.lock"):
+        if path.is_file():
+            return path
+
+        opts = dict(
+            quiet=True, skip_download=True,
+            writesubtitles=True, writeautomaticsub=True,
+            subtitleslangs=[lang], subtitlesformat=ext,
+            outtmpl=str(loc / source_id)
+        )
+        with instrument.stage('resolve'):
+            yt_dlp.YoutubeDL(opts).download([url])
+
+    if not path.is_file():
+        raise FileNotFoundError(f"No {lang} subtitles for {url}")
+    return path
+
+
+# --------------------------------- Search ----------------------------------- #
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words, and overlapping character pairs of CJK runs"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    tokens = []
+    for tok in _TOKEN.findall(text):
+        if _CJK_RUN.fullmatch(tok) and len(tok) > 1:
+            tokens += [tok[i:i + 2] for i in range(len(tok) - 1)]
+        else:
+            tokens.append(tok)
+    return tokens
+
+
+class SubtitleIndex:
+    def __init__(self, cues: List[Cue]) -> None:
+        """Inverted index from tokens to the cues containing them"""
+        self.cues = sorted(cues, key=lambda c: c.start)
+        self.starts = np.array([c.start for c in self.cues])
+
+        postings: Dict[str, List[int]] = defaultdict(list)
+        for i, cue in enumerate(self.cues):
+            for tok in set(tokenize(cue.text)):
+                postings[tok].append(i)
+
+        self.postings = {k: np.array(v) for k, v in postings.items()}
+
+    @classmethod
+    def from_file(cls, path: Union[Path, str]) -> "SubtitleIndex":
+        return cls(read_subtitles(path))
+
+    def idf(self, token: str) -> float:
+        n = len(self.postings.get(token, ()))
+        return math.log(1 + len(self.cues) / (1 + n))
+
+    def search(
+            self,
+            quote: str,
+            window_s: float = 60.,
+            k: int = 3,
+            pad_s: float = 15.,
+            min_score: float = 0.3) -> List[TextWindow]:
+        """Windows of the source whose subtitles best match `quote`
+
+        Args:
+            quote (str): a quote from the clip, or keywords
+            window_s (float, optional): length of the matched windows, at least as long as the clip. Defaults to 60.
+            k (int, optional): maximum number of windows. Defaults to 3.
+            pad_s (float, optional): seconds added on both sides for caption drift. Defaults to 15.
+            min_score (float, optional): smallest IDF-weighted fraction of the quote's tokens in a window. Defaults to 0.3.
+
+        Returns:
+            List[TextWindow]: windows, best first
+        """
+        tokens = [t for t in dict.fromkeys(tokenize(quote)) if t in self.postings]
+        weights = np.array([self.idf(t) for t in tokens])
+        total = sum(self.idf(t) for t in dict.fromkeys(tokenize(quote)))
+        if not tokens or total <= 0:
+            return []
+
+        # windows start at each cue that matches some token
+        anchors = np.unique(np.concatenate([self.postings[t] for t in tokens]))
+        t0 = self.starts[anchors]
+
+        # token `j` is in the window of anchor `a` if a cue with it starts within window_s
+        hit = np.zeros((len(anchors), len(tokens)), dtype=bool)
+        for j, tok in enumerate(tokens):
+            starts = self.starts[self.postings[tok]]
+            first = np.searchsorted(starts, t0, side='left')
+            hit[:, j] = first < len(starts)
+            hit[hit[:, j], j] = starts[first[hit[:, j]]] < t0[hit[:, j]] + window_s
+
+        scores = hit @ weights / total
+        candidates = [
+            Occurrence(float(a), float(a) + window_s, float(s))
+            for a, s in zip(t0, scores) if s >= min_score
+        ]
+        best = rank_occurrences(candidates, min_distance=window_s, k=k)
+
+        windows = [
+            TextWindow(max(o.start - pad_s, 0.), o.stop + pad_s, o.value)
+            for o in best
+        ]
+        for w in windows:
+            logging.info(f"Subtitles match {w.score:.0%}: {w.start:.0f} - {w.stop:.0f} s")
+        return windows
@@ -0,0 +1,165 @@
+import logging
+import numpy as np
+from pathlib import Path
+from scipy import fft as sp_fft
+from subprocess import run, CalledProcessError
+from numpy.lib.stride_tricks import sliding_window_view
+from typing import List, NamedTuple, Union
+
+from finder.peaks import top_k_peaks
+
+# ---------------------------------------------------------------------------- #
+#        Find clips by their frames when the audio has been replaced           #
+# ---------------------------------------------------------------------------- #
+
+# Frames are sampled at a low rate (about 1-2 fps) from low-resolution video
+# formats, scaled to 32 x 32 gray, and reduced to a 64-bit perceptual hash: the
+# signs of the 8 x 8 lowest DCT coefficients against their median. A source is
+# a `uint64` array of hashes, one per frame, searched at once by the mean
+# Hamming distance of the query at every offset. The best offsets are confirmed
+# by aligning the query with the source frames, which tolerates dropped,
+# duplicated or edited frames.
+
+FRAME_SIZE = 32
+HASH_SIZE = 8
+
+
+class VideoMatch(NamedTuple):
+    """A match of the query frames, times in seconds of the hashed source"""
+    start: float
+    stop: float
+    distance: float
+    matched: float
+
+
+def frames_cmd(src: Union[Path, str], fps: float) -> List[str]:
+    """`ffmpeg` command writing `fps` gray 32 x 32 frames per second to stdout"""
+    return [
+        "ffmpeg", "-loglevel", "error", "-i", str(src), "-an",
+        "-vf", f"fps={fps},scale={FRAME_SIZE}:{FRAME_SIZE}:flags=area,format=gray",
+        "-f", "rawvideo", "pipe:1"
+    ]
+
+
+def read_frames(
+        src: Union[Path, str],
+        fps: float = 1.,
+        timeout: float = None) -> np.ndarray:
+    """Decode frames of a video at `fps` as a `(frames, 32, 32)` uint8 array
+
+    Raises:
+        CalledProcessError: raised if `ffmpeg` fails
+    """
+    cmd = frames_cmd(src, fps)
+    proc = run(cmd, timeout=timeout, capture_output=True)
+    if proc.returncode != 0:
+        raise CalledProcessError(proc.returncode, cmd, None, proc.stderr)
+
+    frames = np.frombuffer(proc.stdout, dtype=np.uint8)
+    n = frames.size // FRAME_SIZE**2
+    return frames[:n * FRAME_SIZE**2].reshape(n, FRAME_SIZE, FRAME_SIZE)
+
+
+def phash(frames: np.ndarray) -> np.ndarray:
+    """64-bit perceptual hashes of `(frames, 32, 32)` gray images, as `uint64`"""
+    frames = np.asarray(frames, dtype=np.float64).reshape(-1, FRAME_SIZE, FRAME_SIZE)
+    low = sp_fft.dctn(frames, type=2, axes=(1, 2), norm='ortho')[:, :HASH_SIZE, :HASH_SIZE]
+    low = low.reshape(len(frames), -1)
+
+    # the DC term only measures brightness, so it does not set the threshold
+    bits = low > np.median(low[:, 1:], axis=1, keepdims=True)
+    return np.packbits(bits, axis=1).view('>u8').astype(np.uint64).ravel()
+
+
+def hash_video(src: Union[Path, str], fps: float = 1., timeout: float = None) -> np.ndarray:
+    return phash(read_frames(src, fps=fps, timeout=timeout))
+
+
+def popcount(x: np.ndarray) -> np.ndarray:
+    """Number of set bits of each element of a `uint64` array"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x)
+    # numpy < 2.0
+    table = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+    x = np.ascontiguousarray(x, dtype=np.uint64)
+    return table[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1)
+
+
+def hamming(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Hamming distances between hashes, broadcasting `a` against `b`"""
+    return popcount(np.bitwise_xor(a, b))
+
+
+def sliding_distance(source: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Mean Hamming distance of `query` to `source[o:o+len(query)]` for every offset `o`"""
+    windows = sliding_window_view(source, len(query))
+    return hamming(windows, query[None, :]).mean(axis=1)
+
+
+def align(
+        source: np.ndarray,
+        query: np.ndarray,
+        max_bits: int = 10) -> int:
+    """Longest in-order matching of query frames to source frames
+
+    Frames match if their hashes differ in at most `max_bits` bits. Frames may be skipped on either side, so dropped, duplicated or re-timed frames do not break the alignment.
+
+    Returns:
+        int: number of matched query frames
+    """
+    match = hamming(query[:, None], source[None, :]) <= max_bits
+    row = np.zeros(len(source) + 1, dtype=np.int64)
+
+    for i in range(len(query)):
+        cand = np.maximum(row[1:], row[:-1] + match[i])
+        row = np.concatenate(([0], np.maximum.accumulate(cand)))
+
+    return int(row[-1])
+
+
+def search_hashes(
+        source: np.ndarray,
+        query: np.ndarray,
+        fps: float,
+        k: int = 3,
+        max_bits: int = 10,
+        min_matched: float = 0.6,
+        slack: float = 0.25,
+        times: np.ndarray = None) -> List[VideoMatch]:
+    """Find `query` hashes in `source` hashes
+
+    Args:
+        source (np.ndarray): hashes of the source frames, `fps` per second
+        query (np.ndarray): hashes of the query frames at the same `fps`
+        fps (float): frames per second of both
+        k (int, optional): offsets to confirm, best first. Defaults to 3.
+        max_bits (int, optional): largest Hamming distance of matching frames. Defaults to 10.
+        min_matched (float, optional): fraction of query frames that must align. Defaults to 0.6.
+        slack (float, optional): extra source frames around an offset for alignment, as a fraction of the query length. Defaults to 0.25.
+        times (np.ndarray, optional): time of each source frame in seconds, e.g. when frames come from separate bins. Defaults to None (frame `i` at `i / fps`).
+
+    Returns:
+        List[VideoMatch]: confirmed matches, best first
+    """
+    m = len(query)
+    if m == 0 or len(source) < m:
+        return []
+    if times is None:
+        times = np.arange(len(source)) / fps
+
+    dist = sliding_distance(source, query)
+    offsets, _ = top_k_peaks(-dist, k, m)
+
+    pad = int(np.ceil(slack * m))
+    matches = []
+    for o in offsets[offsets >= 0]:
+        window = source[max(o - pad, 0):o + m + pad]
+        matched = align(window, query, max_bits=max_bits) / m
+        logging.debug(f"Offset {times[o]:.1f} s: {dist[o]:.1f} bits, {matched:.0%} aligned")
+
+        if matched >= min_matched:
+            matches.append(VideoMatch(
+                float(times[o]), float(times[o + m - 1] + 1 / fps),
+                float(dist[o]), matched))
+
+    return matches
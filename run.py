@@ -1,10 +1,15 @@
-from typing import Any
+from typing import Any, Union
 from pathlib import Path 
 import logging 
 import re 
 
 from finder.main import Finder, DATADIR
 from finder.postplot import ReadLog
+from finder.instrument import Instrumentation
+from finder.resultcache import ResultCache
+from finder.fftbackend import BACKEND
+from finder.scheduler import BUDGET
+from finder.chatprior import chat_rate, fetch_chat, read_chat
 
 # ---------------------------------------------------------------------------- #
 
@@ -23,7 +28,7 @@ def main(
     source_url: str, 
     source_start: str, 
     source_stop: str, 
-    dl_fmt: int=139,
+    dl_fmt: Union[int, str]='auto',
     keepfiles=True,
     query_path: Path=None,
     query_url: str=None, 
@@ -33,7 +38,16 @@ def main(
     start_bin: int=1, 
     max_bin: int=50,
     max_wait_time: int=180,
-    datadir: Path=DATADIR) -> None:
+    datadir: Path=DATADIR,
+    metrics_dir: Path=None,
+    profile: bool=False,
+    cache_results: bool=True,
+    autotune: bool=False,
+    memory_budget_mb: int=None,
+    quote: str=None,
+    subtitles: Path=None,
+    chat: Union[Path, bool]=None,
+    preflight: bool=False) -> None:
         
     if query_path is None:
         if query_url is None:
@@ -51,17 +65,75 @@ def main(
     if not datadir.is_dir():
         raise FileNotFoundError(f"Invalid directory:\n{datadir}")
 
-    myfinder = Finder(
+    # FFT lengths and threads saved by `python -m finder.fftbackend`
+    BACKEND.load(datadir / 'fft_config.json')
+
+    # downloads wait while decoding and scoring would not fit
+    if memory_budget_mb is not None:
+        BUDGET.set_limit(memory_budget_mb * 2**20)
+
+    metrics = None 
+    if metrics_dir is not None:
+        metrics = Instrumentation(
+            trace_memory=True,
+            profile_dir=metrics_dir if profile else None
+        )
+
+    finder_kwargs = dict(
         source=source_url, 
         source_start=source_start, 
         source_stop=source_stop, 
         query=query,
-        fmt=dl_fmt, 
+        metrics=metrics,
+        results=ResultCache(datadir / 'results.sqlite') if cache_results else None,
+        fmt=139 if dl_fmt == 'auto' else dl_fmt, 
         loc=datadir,
         **query_kwargs
     )
+    myfinder = Finder(**finder_kwargs)
+
+    if preflight:
+        # check the query before any bin is downloaded
+        report = myfinder.preflight(apply=True)
+        if report.rate != myfinder.query_rate:
+            myfinder.close()
+            myfinder = Finder(
+                **finder_kwargs, engine=report.engine, rate=report.rate)
+            myfinder.threshold = report.threshold
+
+        if not report.localizable:
+            go = input(
+                "The query is unlikely to be found. Continue anyway? [y/n]"
+            ).lower()
+            if go != 'y':
+                return
 
-    myfinder.get_bins(**bin_kwargs)
+    # the cheapest audio format offered at the analysis rate, or `dl_fmt` if offered
+    dl_fmt = myfinder.choose_format(dl_fmt)
+
+    if quote is not None:
+        # bins where the subtitles match the quote are searched first
+        windows = myfinder.text_windows(quote, subtitles=subtitles, loc=datadir)
+        bin_kwargs = {**bin_kwargs, 'priority': windows}
+
+    if chat is not None:
+        # bins where chat is busiest are searched first
+        chat_path = fetch_chat(source_url, loc=datadir) if chat is True else chat
+        bin_kwargs = {
+            **bin_kwargs, 'binorder': 'chat', 'prior': chat_rate(*read_chat(chat_path))}
+
+    if autotune:
+        # bin width, overlap and batch size from costs probed on the source
+        costs = myfinder.measure_costs(fmt=dl_fmt, loc=datadir)
+        plan = myfinder.plan_bins(
+            costs=costs,
+            binorder=bin_kwargs.get('binorder', 'mirrored'),
+            priority=bin_kwargs.get('priority'),
+            prior=bin_kwargs.get('prior'),
+            skipsize=bin_kwargs.get('skipsize', 0))
+        max_dl = plan.batch
+    else:
+        myfinder.get_bins(**bin_kwargs)
     if myfinder.logname.is_file():
         skip = input(
             "Skip to processing the log? [y/n]"
@@ -94,6 +166,11 @@ def main(
         if start_bin > max_bin:
             print(f"Finished checking max bins: {max_bin}")
             break
+
+    if metrics is not None:
+        metrics_dir.mkdir(parents=True, exist_ok=True)
+        metrics.write_json(metrics_dir / f"{myfinder.name}_metrics.json")
+        metrics.write_prometheus(metrics_dir / f"{myfinder.name}_metrics.prom")
     
     read_log(
         myfinder.logname, 
@@ -0,0 +1,68 @@
+import time
+import numpy as np
+from pathlib import Path
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder.cache import LRUCache, SharedCaches, audio_key
+
+# ---------------------------------------------------------------------------- #
+#                           Tests for finder/cache.py                          #
+# ---------------------------------------------------------------------------- #
+
+
+def test_evicts_least_recently_used_by_size():
+    cache = LRUCache(max_bytes=3 * 800)
+    for k in 'abc':
+        cache.put(k, np.zeros(100))
+    assert cache.size == 2400
+
+    # `a` is used, so `b` is the least recent when `d` arrives
+    assert cache.get('a') is not None
+    cache.put('d', np.zeros(100))
+    assert 'b' not in cache
+    assert all(k in cache for k in 'acd')
+    assert cache.size == 2400
+
+    # too large to cache at all
+    cache.put('e', np.zeros(1000))
+    assert 'e' not in cache and len(cache) == 3
+
+    # replacing a key does not count it twice
+    cache.put('a', np.zeros(50))
+    assert cache.size == 2000
+    assert cache.stats() == dict(entries=3, bytes=2000, hits=1, misses=0)
+
+
+def test_entries_expire():
+    cache = LRUCache(ttl=0.05)
+    cache.put('short', 'x')
+    cache.put('long', 'y', ttl=60)
+
+    time.sleep(0.1)
+    assert cache.get('short') is None
+    assert cache.get('long') == 'y'
+    assert len(cache) == 1
+    assert cache.misses == 1
+
+    assert cache.get_or_create('short', lambda: 'z') == 'z'
+    assert cache.get('short') == 'z'
+
+
+def test_shared_caches_reuse_bins():
+    caches = SharedCaches(audio_bytes=2**20)
+    key = audio_key('abcdefghijk', 1, 151)
+
+    # bins are keyed by their range, whatever the type of the times
+    assert key == audio_key('abcdefghijk', '1', '151')
+    caches.audio.put(key, (np.ones(10), 441))
+    data, rate = caches.audio.get(audio_key('abcdefghijk', '1', '151'))
+    assert rate == 441 and data.sum() == 10
+
+    assert audio_key('abcdefghijk', 1, 150) not in caches.audio
+    stats = caches.stats()
+    assert stats['audio']['entries'] == 1 and stats['audio']['hits'] == 1
+    assert stats['queries']['entries'] == 0
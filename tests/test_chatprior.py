@@ -0,0 +1,90 @@
+import json
+import numpy as np
+from pathlib import Path
+
+import pytest
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder.chatprior import REACTION_S, chat_rate, parse_chat, read_chat, replay
+from finder.sampling import get_bins
+
+# ---------------------------------------------------------------------------- #
+#                         Tests for finder/chatprior.py                        #
+# ---------------------------------------------------------------------------- #
+
+# the best bin of logs/uruha_oden.log is 00:50:31 - 00:53:00
+HIT = 3031
+
+
+def chat_line(t: float, text: str) -> str:
+    item = {'liveChatTextMessageRenderer': {'message': {'runs': [
+        {'text': text},
+        {'emoji': {'shortcuts': [':_laugh:']}},
+    ]}}}
+    return json.dumps({'replayChatItemAction': {
+        'actions': [{'addChatItemAction': {'item': item}}],
+        'videoOffsetTimeMsec': str(int(t * 1000)),
+    }})
+
+
+@pytest.fixture
+def chat(tmp_path):
+    """Steady chat over an hour, a burst of laughter just after HIT + 60 s, and a larger plain burst elsewhere"""
+    rng = np.random.default_rng(0)
+    lines = [chat_line(t, 'hello') for t in np.sort(rng.uniform(0, 3600, 600))]
+    lines += [chat_line(t, 'LOL ｗｗｗ') for t in HIT + 70 + rng.uniform(0, 20, 60)]
+    lines += [chat_line(t, 'hi') for t in 1000 + rng.uniform(0, 20, 100)]
+    # not a chat message
+    lines.append(json.dumps({'replayChatItemAction': {'actions': [{'addLiveChatTickerItemAction': {}}]}}))
+
+    path = tmp_path / 'abcdefghijk.live_chat.json'
+    path.write_text("\n".join(lines) + "\n", encoding='utf-8')
+    return path
+
+
+def test_parse_and_rate(chat):
+    times, texts = read_chat(chat)
+    assert times.size == 760
+    # NFKC folds full-width letters, and emojis become their shortcut
+    assert texts[-1] == 'hi:_laugh:'
+    assert 'lol www:_laugh:' in texts
+
+    plain = chat_rate(times)
+    # messages sent within the reaction time of the start are dropped
+    assert plain.sum() == np.sum(times >= REACTION_S) < 760
+    assert np.argmax(np.convolve(plain, np.ones(20), 'valid')) == pytest.approx(990, abs=10)
+
+    boosted = chat_rate(times, texts, duration=7200)
+    assert boosted.size == 7200
+    # laughter outweighs the larger plain burst
+    assert boosted[HIT + 60:HIT + 80].sum() > boosted[990:1010].sum()
+
+    assert parse_chat(["", "{}"])[0].size == 0
+
+
+def test_messages_before_reaction_are_dropped():
+    rate = chat_rate(np.array([0., 3., 9.5, 12.]), reaction_s=10)
+    assert rate.tolist() == [0., 0., 1.]
+
+
+def test_chat_order_visits_busy_bins_first(chat):
+    rate = chat_rate(*read_chat(chat))
+
+    bins = get_bins(3600, nbins=24, max_binwidth=150, binorder='chat', prior=rate)
+    assert bins[0, 0] <= HIT + 60 < bins[0, 1]
+    assert sorted(bins[:, 0]) == list(range(1, 3600, 150))
+
+    with pytest.raises(ValueError):
+        get_bins(3600, nbins=24, binorder='chat')
+
+
+def test_replay_past_log(chat):
+    result = replay(Path('logs') / 'uruha_oden.log', chat_rate(*read_chat(chat)))
+    assert result.hit == (HIT, HIT + 149)
+    assert result.nbins == 19
+    assert result.logged == 15
+    assert result.chat == 1 < result.mirrored
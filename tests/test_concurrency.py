@@ -0,0 +1,109 @@
+import time
+import threading
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder.concurrency import AIMDController, classify_error
+from finder.fragments import ConnectionPool
+
+# ---------------------------------------------------------------------------- #
+#                        Tests for finder/concurrency.py                       #
+# ---------------------------------------------------------------------------- #
+
+BODY = bytes(20_000)
+SERVE_S = 0.05
+
+
+@pytest.fixture
+def throttling_server():
+    """Answers 429 above `cap` concurrent requests; each request takes `SERVE_S`"""
+    state = dict(cap=6, active=0, peak=0, throttled=0)
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            with lock:
+                state['active'] += 1
+                state['peak'] = max(state['peak'], state['active'])
+                over = state['active'] > state['cap']
+                state['throttled'] += over
+            try:
+                if over:
+                    self.send_response(429)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                time.sleep(SERVE_S)
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(BODY)))
+                self.end_headers()
+                self.wfile.write(BODY)
+            finally:
+                with lock:
+                    state['active'] -= 1
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}/media", state
+    httpd.shutdown()
+
+
+def run_tasks(controller, url, n, workers=32):
+    pool = ConnectionPool(max_per_host=workers)
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futs = [
+            ex.submit(controller.call, '127.0.0.1', pool.get, url)
+            for _ in range(n)
+        ]
+        return [f.result() for f in futs]
+
+
+def test_classify_error():
+    assert classify_error(ConnectionError("GET host/x: HTTP 429")) == 'throttle'
+    assert classify_error(subprocess.CalledProcessError(
+        1, 'yt-dlp', stderr=b"ERROR: HTTP Error 429: Too Many Requests")) == 'throttle'
+    assert classify_error(subprocess.TimeoutExpired('ffmpeg', 5)) == 'timeout'
+    assert classify_error(ValueError("bad box")) == 'other'
+
+
+def test_aimd_backs_off_under_rate_limit(throttling_server):
+    url, state = throttling_server
+    controller = AIMDController(initial=1, max_limit=32, backoff_s=0.05, retries=5)
+
+    results = run_tasks(controller, url, 150)
+    assert all(r == BODY for r in results)
+
+    limits = [limit for _, limit in controller.history]
+    # grew from 1, hit the server's cap, and was cut back
+    assert max(limits) > 2
+    assert controller.errors['throttle'] > 0
+    assert any(b < a for a, b in zip(limits, limits[1:]))
+    assert max(limits) < 32
+    # throttled requests are a small part of all requests
+    assert state['throttled'] < 0.25 * len(results)
+
+
+def test_pinned_host_cap(throttling_server):
+    url, state = throttling_server
+    controller = AIMDController(initial=16, max_limit=32)
+    controller.pin_host('127.0.0.1', 2)
+
+    run_tasks(controller, url, 20)
+    assert state['peak'] <= 2
+    assert controller.errors['throttle'] == 0
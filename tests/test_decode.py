@@ -0,0 +1,45 @@
+import shutil
+import audiofile
+import numpy as np
+from pathlib import Path
+
+import pytest
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder.decode import decode_cmd, decode_to_array
+
+# ---------------------------------------------------------------------------- #
+#                            Tests for finder/decode.py                        #
+# ---------------------------------------------------------------------------- #
+
+
+def test_decode_cmd_mono_at_rate():
+    cmd = decode_cmd("in.m4a", 441)
+    assert cmd[cmd.index("-ac") + 1] == "1"
+    assert cmd[cmd.index("-ar") + 1] == "441"
+    assert cmd[cmd.index("-f") + 1] == "f32le"
+    assert cmd[-1] == "pipe:1"
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_decode_to_array_matches_rates(tmp_path):
+    t = np.arange(48000 * 2) / 48000
+    tone = np.sin(2 * np.pi * 50 * t).astype(np.float32)
+    path48 = tmp_path / "a48.wav"
+    audiofile.write(str(path48), np.stack([tone, tone]), 48000)
+
+    t = np.arange(44100 * 2) / 44100
+    path44 = tmp_path / "a44.wav"
+    audiofile.write(str(path44), np.sin(2 * np.pi * 50 * t).astype(np.float32), 44100)
+
+    a = decode_to_array(path48, 441)
+    b = decode_to_array(path44, 441)
+    c = decode_to_array(path44.read_bytes(), 441)
+
+    assert abs(a.size - 882) <= 1 and abs(b.size - 882) <= 1
+    assert np.array_equal(b, c)
+    assert np.corrcoef(a[:800], b[:800])[0, 1] > 0.99
@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import numpy as np
+from pathlib import Path
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder.distributed import (
+    Worker, publish, read_results, spawn_workers, coordinate, status)
+
+# ---------------------------------------------------------------------------- #
+#                        Tests for finder/distributed.py                       #
+# ---------------------------------------------------------------------------- #
+
+RATE = 441
+
+
+def make_source(tmp_path, seconds=600, at=250, query_s=20):
+    rng = np.random.default_rng(5)
+    source = rng.standard_normal(seconds * RATE).astype(np.float32)
+    query = source[at * RATE:(at + query_s) * RATE].astype(np.float64).copy()
+
+    path = tmp_path / f"src_{RATE}hz.float32"
+    source.tofile(path)
+    with open(f"{path}.json", 'w') as io:
+        json.dump(dict(rate=RATE, dtype='float32', samples=source.size), io)
+    return path, query
+
+
+def bins(seconds=600, width=60):
+    starts = np.arange(0, seconds, width)
+    return np.stack([starts, starts + width + 30], axis=1).clip(0, seconds)
+
+
+def test_processes_stop_at_match(tmp_path):
+    path, query = make_source(tmp_path)
+    queue = publish(tmp_path / 'queue', str(path), query, RATE, bins())
+
+    procs = spawn_workers(queue, 2, max_idle=5)
+    try:
+        matches = coordinate(queue, poll=0.1, timeout=120)
+    finally:
+        for proc in procs:
+            proc.wait(timeout=60)
+
+    # overlapping bins may both be scored before the stop is seen
+    assert matches
+    for match in matches:
+        start, stop = match['range']
+        t0, t1 = match['result']
+        assert abs(start + t0 - 250) <= 1
+    assert status(queue)['stopped']
+    assert status(queue)['done'] < len(bins())
+
+
+def test_expired_claim_is_taken_over(tmp_path):
+    path, query = make_source(tmp_path, seconds=120, at=30)
+    queue = publish(
+        tmp_path / 'queue', str(path), query, RATE, bins(120),
+        stop_on_match=False, lease_s=10)
+
+    # a worker died holding bin 0
+    todo = queue / 'todo' / '000000.json'
+    dead = queue / 'claimed' / '000000.dead'
+    os.rename(todo, dead)
+    os.utime(dead, (time.time() - 60, time.time() - 60))
+
+    worker = Worker(queue, name='alive', poll=0.05)
+    assert sorted(worker.run(max_idle=1)) == [0, 1]
+
+    results = read_results(queue)
+    assert sorted(results) == [0, 1]
+    assert results[0]['result'] is not None
+    # the query ends 50 s into bin 0
+    assert abs(results[0]['t_peak'] - 50) <= 1
+    assert 0 <= results[1]['t_peak'] <= 60 + 20
+    assert not list((queue / 'claimed').iterdir())
+
+
+def test_slow_claim_is_duplicated(tmp_path):
+    path, query = make_source(tmp_path, seconds=120, at=30)
+    queue = publish(
+        tmp_path / 'queue', str(path), query, RATE, bins(120),
+        stop_on_match=False, lease_s=600)
+
+    slow = queue / 'claimed' / '000001.slow'
+    os.rename(queue / 'todo' / '000001.json', slow)
+
+    worker = Worker(queue, name='fast', poll=0.05, steal_after=0)
+    assert sorted(worker.run(max_idle=1)) == [0, 1]
+    # the slow worker's claim is left alone; its late result would be discarded
+    assert slow.is_file()
@@ -86,3 +86,37 @@ def test_download_cmd(create_download):
         assert f == repr(create_download.filename)
 
 
+
+# ---------------------------------------------------------------------------- #
+
+def yt_format(format_id, ext, abr, asr, vcodec='none'):
+    return dict(format_id=format_id, ext=ext, abr=abr, asr=asr, vcodec=vcodec, acodec='x')
+
+def test_select_audio_format():
+    meta = dict(duration=600, formats=[
+        yt_format('140', 'm4a', 129.5, 44100),
+        yt_format('251', 'webm', 135.2, 48000),
+        yt_format('251-drc', 'webm', 135.2, 48000),
+        yt_format('249', 'webm', 52.1, 48000),
+        yt_format('599', 'm4a', 30.8, 22050),
+        yt_format('160', 'mp4', None, None, vcodec='avc1'),
+    ])
+
+    formats = dl.audio_formats(meta)
+    assert [f.fmt for f in formats] == [599, 249, 140, 251]
+    assert formats[1].ext == 'webm'
+
+    # the cheapest, unless its sampling rate is below the analysis rate
+    assert dl.select_audio_format(formats, 441) == 599
+    assert dl.select_audio_format(formats, 32000) == 249
+    # a requested format is kept if offered, otherwise replaced
+    assert dl.select_audio_format(formats, 441, fmt=140) == 140
+    assert dl.select_audio_format(formats, 441, fmt=139) == 599
+
+    with pytest.raises(ValueError):
+        dl.select_audio_format(formats, 96000)
+
+def test_opus_bins_keep_their_extension():
+    cmd, fn = dl.get_cmd(
+        "https://youtu.be/H8a2odhdruY", "1:40", "1:50", 249, loc=Path('data'))
+    assert fn.endswith("H8a2odhdruY.webm") and "-f 249" in cmd
@@ -0,0 +1,60 @@
+import numpy as np
+from pathlib import Path
+from scipy.signal import correlate
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder.fftbackend import FFTBackend, BACKEND, full_correlate, save_tuning, size_key
+from finder.findsignal import xcorr
+
+# ---------------------------------------------------------------------------- #
+#                          Tests for finder/fftbackend.py                      #
+# ---------------------------------------------------------------------------- #
+
+
+def test_full_correlate_whole_and_blocks():
+    rng = np.random.default_rng(0)
+    # a bin length with a large prime factor
+    data = rng.standard_normal(9973)
+    query = rng.standard_normal(1000)
+    expected = correlate(data, query, method='fft')
+
+    for nfft in [2048, 4096, BACKEND.plan_len(query.size, data.size)]:
+        qspec = np.conj(BACKEND.rfft(query, nfft))
+        assert np.allclose(full_correlate(data, query, qspec, nfft), expected)
+
+    assert np.allclose(xcorr(data, query), expected)
+
+
+def test_plan_len_uses_tuned_sizes(tmp_path):
+    backend = FFTBackend()
+    assert backend.plan_len(1000, 9973) == backend.fast_len(10972)
+
+    path = tmp_path / "fft_config.json"
+    save_tuning(dict(nfft=4096, workers=2, seconds=0.1), 1000, 9973, path=path)
+    assert backend.load(path)
+
+    assert backend.workers == 2
+    assert backend.tuned == {size_key(1000, 9973): 4096}
+    assert backend.plan_len(1000, 9973) == 4096
+    # too short for the query
+    backend.tuned[size_key(3000, 9973)] = 4096
+    assert backend.plan_len(3000, 9973) == backend.fast_len(12972)
+
+
+def test_plan_len_near_tuned_sizes():
+    backend = FFTBackend()
+    backend.tuned[size_key(1000, 9973)] = 4096
+    # a bin a few samples off the tuned size reuses its block length
+    assert backend.plan_len(1000, 9970) == 4096
+    assert backend.plan_len(1003, 9981) == 4096
+    # too far from any tuned size
+    assert backend.plan_len(1000, 20000) == backend.fast_len(20999)
+
+    # a length tuned to correlate the whole bin is not used as a block for a longer bin
+    backend.tuned = {size_key(1000, 9973): 11025}
+    assert backend.plan_len(1000, 9970) == 11025
+    assert backend.plan_len(1000, 10030) == backend.fast_len(11029)
@@ -0,0 +1,114 @@
+import re
+import struct
+import threading
+import numpy as np
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder.fragments import ConnectionPool, read_index, read_range
+
+# ---------------------------------------------------------------------------- #
+#                         Tests for finder/fragments.py                        #
+# ---------------------------------------------------------------------------- #
+
+TIMESCALE = 44100
+FRAGMENT_S = 10
+NFRAGMENTS = 12
+
+
+def box(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I', 8 + len(payload)) + kind + payload
+
+
+def fragmented_mp4() -> bytes:
+    """ftyp | moov (larger than one probe) | sidx | (moof mdat) x NFRAGMENTS"""
+    ftyp = box(b'ftyp', b'dash' + bytes(4))
+    moov = box(b'moov', bytes(100_000))
+
+    fragments = [
+        box(b'moof', bytes(8)) + box(b'mdat', bytes([k]) * (1000 + 37 * k))
+        for k in range(NFRAGMENTS)
+    ]
+    refs = b''.join(
+        struct.pack('>III', len(f), FRAGMENT_S * TIMESCALE, 0x90000000)
+        for f in fragments
+    )
+    sidx = box(b'sidx', struct.pack(
+        '>IIIIIHH', 0, 1, TIMESCALE, 0, 0, 0, NFRAGMENTS) + refs)
+
+    return ftyp + moov + sidx + b''.join(fragments)
+
+
+@pytest.fixture
+def server():
+    data = fragmented_mp4()
+    connections = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            connections.append(self.client_address)
+
+        def do_GET(self):
+            m = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+            if m is None:
+                body, status = data, 200
+            else:
+                a = int(m.group(1))
+                b = int(m.group(2)) if m.group(2) else len(data) - 1
+                body, status = data[a:b + 1], 206
+
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{httpd.server_port}/audio.m4a", data, connections
+
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_read_index(server):
+    url, data, _ = server
+    index = read_index(url, ConnectionPool())
+
+    assert index.init_size == 16 + 100_008
+    assert np.allclose(index.starts, np.arange(NFRAGMENTS) * FRAGMENT_S)
+    assert index.offsets[-1] + index.sizes[-1] == len(data)
+    assert data[index.offsets[3] + 4:index.offsets[3] + 8] == b'moof'
+
+
+def test_read_range_reuses_connection(server):
+    url, data, connections = server
+    pool = ConnectionPool()
+    index = read_index(url, pool)
+
+    for start, stop, first, last in [(25, 47, 2, 4), (0, 10, 0, 0), (101, 120, 10, 11)]:
+        body, t0 = read_range(url, start, stop, pool)
+
+        a = index.offsets[first]
+        b = index.offsets[last] + index.sizes[last]
+        assert t0 == first * FRAGMENT_S
+        assert body == data[:index.init_size] + data[a:b]
+
+    # index, init segment and three ranges over one keep-alive connection
+    assert pool.opened == 1
+    assert len(connections) == 1
+    pool.close()
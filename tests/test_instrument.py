@@ -0,0 +1,90 @@
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder import instrument
+from finder.instrument import Instrumentation
+
+# ---------------------------------------------------------------------------- #
+#                        Tests for finder/instrument.py                        #
+# ---------------------------------------------------------------------------- #
+
+
+def test_nested_stages_inherit_bin():
+    metrics = Instrumentation()
+
+    def correlate() -> None:
+        with instrument.stage('correlate'):
+            pass
+
+    with metrics.activate():
+        with instrument.stage('download', bin=3):
+            with instrument.stage('decode'):
+                instrument.count(audio_seconds=150)
+            # a thread started in the stage records into the same bin
+            with ThreadPoolExecutor(1) as pool:
+                pool.submit(instrument.bind(correlate)).result()
+        with instrument.stage('plot'):
+            pass
+
+    # outside an active recorder nothing is recorded
+    with instrument.stage('resolve') as rec:
+        instrument.count(bytes=10)
+    assert rec['stage'] == 'resolve'
+
+    bins = {r['stage']: r['bin'] for r in metrics.records}
+    assert bins == {'download': 3, 'decode': 3, 'correlate': 3, 'plot': None}
+    assert next(r for r in metrics.records if r['stage'] == 'decode')['audio_seconds'] == 150
+
+
+def test_summary_totals():
+    metrics = Instrumentation(trace_memory=True)
+
+    with metrics.run('test'):
+        for b in range(3):
+            with instrument.stage('download', bin=b, bytes=1000):
+                pass
+            with instrument.stage('correlate', bin=b, audio_seconds=150):
+                np.ones(2**16)
+
+    summary = metrics.summary()
+    download = summary['stages']['download']
+    assert download['count'] == 3
+    assert download['bytes'] == 3000
+    assert download['bytes_per_s'] == pytest.approx(3000 / download['wall_s'])
+
+    correlate = summary['stages']['correlate']
+    assert correlate['audio_seconds'] == 450
+    assert correlate['peak_bytes'] >= 2**16 * 8
+    assert correlate['wall_s'] == pytest.approx(
+        sum(b['correlate']['wall_s'] for b in summary['bins'].values()))
+
+    assert sorted(summary['bins']) == ['0', '1', '2']
+    assert summary['bins']['1']['download']['bytes'] == 1000
+
+
+def test_prometheus_exposition(tmp_path):
+    metrics = Instrumentation()
+    with metrics.activate():
+        with instrument.stage('download', bin=0, bytes=512):
+            pass
+
+    path = tmp_path / 'metrics.prom'
+    metrics.write_prometheus(path, prefix='test')
+    lines = path.read_text().splitlines()
+
+    assert '# TYPE test_stage_runs_total counter' in lines
+    assert '# TYPE test_stage_peak_bytes gauge' in lines
+    assert 'test_stage_runs_total{stage="download"} 1' in lines
+    assert 'test_stage_bytes_total{stage="download"} 512' in lines
+    # every sample follows its HELP and TYPE lines
+    samples = [l for l in lines if not l.startswith('#')]
+    assert len(samples) == 7
+    assert all(l.split()[0].startswith('test_stage_') for l in samples)
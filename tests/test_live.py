@@ -0,0 +1,104 @@
+import time
+import threading
+import numpy as np
+from pathlib import Path
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder.live import LiveCorrelator, RingBuffer, follow, tail_raw
+
+# ---------------------------------------------------------------------------- #
+#                             Tests for finder/live.py                         #
+# ---------------------------------------------------------------------------- #
+
+RATE = 441
+
+
+def test_ring_buffer_wraps():
+    ring = RingBuffer(8)
+    x = np.arange(20, dtype=float)
+
+    for k in range(0, 20, 3):
+        ring.extend(x[k:k + 3])
+
+    assert ring.total == 20
+    assert ring.latest(8).tolist() == x[-8:].tolist()
+    assert ring.latest(3).tolist() == x[-3:].tolist()
+
+
+def test_every_start_scored_once():
+    rng = np.random.default_rng(1)
+    source = rng.standard_normal(120 * RATE)
+    t0 = 77 * RATE + 13
+    query = source[t0:t0 + 5 * RATE].copy()
+
+    corr = LiveCorrelator(query, RATE, segment_s=2)
+    matches = []
+    pos = 0
+    for size in rng.integers(1, 4 * RATE, size=1000):
+        matches += corr.feed(source[pos:pos + size])
+        pos += size
+        if pos >= source.size:
+            break
+
+    assert corr.scanned == source.size - query.size + 1
+    assert len(matches) == 1
+    assert matches[0].start == t0 / RATE
+    assert matches[0].peak > 0.99
+    # found within one segment of the end of the clip
+    assert matches[0].detected - matches[0].stop <= 2 + 4
+
+
+def test_repeats_within_one_segment():
+    rng = np.random.default_rng(3)
+    source = rng.standard_normal(60 * RATE)
+    query = source[10 * RATE:12 * RATE].copy()
+    source[15 * RATE:17 * RATE] = query
+
+    corr = LiveCorrelator(query, RATE, segment_s=30)
+    matches = corr.feed(source)
+
+    assert [m.start for m in matches] == [10., 15.]
+
+
+def test_tail_restarts_on_rewritten_file(tmp_path):
+    path = tmp_path / "live_441hz.float32"
+    np.arange(100, dtype=np.float32).tofile(path)
+    chunks = tail_raw(path, chunk=100, poll=0.01, idle_timeout=1)
+    assert next(chunks).tolist() == list(range(100))
+
+    # a new decode replaces the file of the previous session
+    path.unlink()
+    np.arange(10, dtype=np.float32).tofile(path)
+    assert next(chunks).tolist() == list(range(10))
+
+    with open(path, 'wb') as io:
+        np.ones(5, dtype=np.float32).tofile(io)
+    assert next(chunks).tolist() == [1.] * 5
+
+
+def test_follow_growing_file(tmp_path):
+    rng = np.random.default_rng(2)
+    source = rng.standard_normal(60 * RATE).astype(np.float32)
+    t0 = 41 * RATE
+    query = source[t0:t0 + 4 * RATE].copy()
+    path = tmp_path / "live_441hz.float32"
+
+    def writer():
+        with open(path, 'wb') as io:
+            # odd sizes split samples across writes
+            for chunk in np.array_split(source.view(np.uint8), 37):
+                io.write(chunk.tobytes())
+                io.flush()
+                time.sleep(0.01)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    matches = list(follow(
+        path, query, RATE, segment_s=3, poll=0.01, idle_timeout=1))
+    thread.join()
+
+    assert [m.start for m in matches] == [41.]
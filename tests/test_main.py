@@ -0,0 +1,147 @@
+import time
+import asyncio
+import numpy as np
+from pathlib import Path
+
+import pytest
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+import finder.main as fm
+from finder.download import get_filename, range_suffix
+
+# ---------------------------------------------------------------------------- #
+#                    Tests for the streaming API of finder/main.py             #
+# ---------------------------------------------------------------------------- #
+
+RATE = 441
+URL = 'https://www.youtube.com/watch?v=abcdefghijk'
+AT = 450
+
+
+@pytest.fixture
+def offline(tmp_path, monkeypatch):
+    """A Finder whose bins are decoded from a synthetic source; only the first bin is on disk"""
+    rng = np.random.default_rng(2)
+    source = rng.standard_normal(1200 * RATE)
+    query = source[AT * RATE:(AT + 20) * RATE].copy()
+    fetched = []
+
+    def fake_read(path, *args, **kwargs):
+        start, stop = bins[[str(path) for path in paths].index(str(path))]
+        return source[start * RATE:stop * RATE], RATE
+
+    def fake_fetch(url, start, stop, fmt, loc=None, **kwargs):
+        fetched.append(start)
+        time.sleep(0.2)
+        path = Path(get_filename(url, loc=loc, suffix=range_suffix(start, stop)))
+        path.touch()
+        return str(path)
+
+    monkeypatch.setattr(fm, 'read_audio_file', fake_read)
+    monkeypatch.setattr(fm, 'fetch_bin', fake_fetch)
+
+    finder = fm.Finder(
+        URL, query, source_start='00:00:00', source_stop='00:20:00',
+        logfile=False, engine='segments')
+    finder.get_bins(nbins=12, binorder='linear', max_binwidth=100, overlap=30)
+
+    bins = finder._bins.tolist()
+    paths = [
+        Path(get_filename(URL, loc=tmp_path, suffix=range_suffix(a, b)))
+        for a, b in bins
+    ]
+    paths[0].touch()
+    return finder, tmp_path, fetched
+
+
+def test_iter_run_yields_each_bin(offline):
+    finder, loc, _ = offline
+
+    records = list(finder.iter_run(0, max_dl=12, loc=loc))
+    assert [r.bin for r in records] == list(range(12))
+    assert all(r.wait_s >= 0 and r.score_s >= 0 for r in records)
+
+    hits = [r for r in records if r.result is not None]
+    assert len(hits) == 1
+    assert hits[0].start + hits[0].result[0] == pytest.approx(AT, abs=1)
+
+
+def test_run_is_a_wrapper(offline):
+    finder, loc, _ = offline
+    events = []
+
+    candidates = finder.run(0, max_dl=12, loc=loc, plot=False, on_bin=events.append)
+    assert len(candidates) == 1
+    assert len(events) == 12
+    assert events[0]['range'] == ['00:00:01', '00:02:10']
+    assert 'score_s' in events[0]
+
+
+def test_closing_abandons_pending_downloads(offline):
+    finder, loc, fetched = offline
+
+    for rec in finder.iter_run(0, max_dl=12, loc=loc):
+        break
+    time.sleep(1.)
+    # downloads already running finish; the others never start
+    assert 0 < len(fetched) < 11
+
+
+def test_async_iterator_stops_early(offline):
+    finder, loc, fetched = offline
+
+    async def first_two():
+        seen = []
+        async for rec in finder.aiter_run(start_bin=0, max_dl=12, loc=loc):
+            seen.append(rec.bin)
+            if len(seen) == 2:
+                break
+        return seen
+
+    assert asyncio.run(first_two()) == [0, 1]
+    time.sleep(1.)
+    assert len(fetched) < 11
+
+
+def test_threshold_applies_to_bins(offline):
+    finder, loc, _ = offline
+    # a normalized segment correlation is at most 1
+    finder.threshold = 1.01
+
+    records = list(finder.iter_run(0, max_dl=12, loc=loc))
+    assert all(r.result is None for r in records)
+    assert '"threshold":1.01' in finder._score_params(RATE)
+
+
+def test_threshold_skips_raw_xcorr(offline):
+    finder, loc, _ = offline
+    # raw `xcorr` peaks are not normalized: the preflight level would reject an exact copy
+    finder.engine = 'xcorr'
+    finder.threshold = 1.01
+
+    records = list(finder.iter_run(0, max_dl=12, loc=loc))
+    assert any(r.result is not None for r in records)
+    assert '"threshold":0.5' in finder._score_params(RATE)
+
+
+def test_top_k_skips_rejected_bins(offline, monkeypatch):
+    finder, loc, _ = offline
+    finder.top_k = 3
+    correlated = []
+    find_peaks = fm.FindSignal.find_peaks
+
+    def counted(self, k, *args, **kwargs):
+        correlated.append(self.data.size)
+        return find_peaks(self, k, *args, **kwargs)
+
+    monkeypatch.setattr(fm.FindSignal, 'find_peaks', counted)
+
+    records = list(finder.iter_run(0, max_dl=12, loc=loc))
+    assert len(records) == 12
+    # only bins that passed the first segment are correlated in full
+    assert 1 <= len(correlated) < 12
+    assert any(abs(o.start - AT) < 1 for o in finder.occurrences)
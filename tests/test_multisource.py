@@ -0,0 +1,144 @@
+import os
+import json
+import shutil
+import audiofile
+import numpy as np
+from pathlib import Path
+
+import pytest
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+import finder.main as fm
+from finder.download import get_filename, range_suffix
+from finder.findsignal import read_audio_file
+from finder.multisource import (
+    MultiSourceSearch, SourceInfo, rank_sources, read_playlist, scan_directory)
+
+# ---------------------------------------------------------------------------- #
+#                         Tests for finder/multisource.py                      #
+# ---------------------------------------------------------------------------- #
+
+RATE = 441
+DAY = 86400
+
+
+def test_rank_sources():
+    sources = [
+        SourceInfo('old', 3600, '20240101', 'old'),
+        SourceInfo('short', 10, '20240301', 'short'),
+        SourceInfo('new', 7200, '20240301', 'new'),
+        SourceInfo('newer', 9000, '20240302', 'newer'),
+        SourceInfo('unknown', 600, None, 'unknown'),
+    ]
+
+    ranked = [s.source for s in rank_sources(sources, query_duration=20)]
+    assert ranked == ['newer', 'new', 'old', 'unknown']
+
+    ranked = [s.source for s in rank_sources(sources, 20, near_date='20240105')]
+    assert ranked == ['old', 'new', 'newer', 'unknown']
+
+
+def test_read_playlist(tmp_path):
+    path = tmp_path / "channel.json"
+    with open(path, 'w') as io:
+        json.dump(dict(entries=[
+            dict(entries=[dict(id='abc', duration=100, title='a')]),
+            dict(url='https://www.youtube.com/watch?v=def', upload_date='20240101'),
+            None,
+        ]), io)
+
+    sources = read_playlist(path)
+    assert [s.source for s in sources] == [
+        'https://www.youtube.com/watch?v=abc',
+        'https://www.youtube.com/watch?v=def',
+    ]
+    assert sources[0].duration == 100
+
+
+def test_offline_search_stops_at_first_match(tmp_path):
+    rng = np.random.default_rng(3)
+    now = 1.7e9
+
+    # newest first: a, b (has the query), c
+    signals = {}
+    for k, name in enumerate('abc'):
+        signals[name] = rng.standard_normal(300 * RATE).astype(np.float32)
+        # as written by `decode.decode_to_raw`
+        path = tmp_path / f"{name}_{RATE}hz.float32"
+        signals[name].tofile(path)
+        with open(f"{path}.json", 'w') as io:
+            json.dump(dict(src=name, rate=RATE, dtype='float32', samples=signals[name].size), io)
+        os.utime(path, (now - k * DAY, now - k * DAY))
+
+    query = signals['b'][123 * RATE:143 * RATE]
+
+    search = MultiSourceSearch(query, rate=RATE, max_sources=1, segment_s=30, loc=tmp_path)
+    match = search.run(scan_directory(tmp_path))
+
+    assert Path(match.source).name == f'b_{RATE}hz.float32'
+    assert abs(match.start - 123) < 1 / RATE
+    assert match.peak > 0.9
+    assert [Path(s).name for s in search.searched] == [f'a_{RATE}hz.float32', f'b_{RATE}hz.float32']
+
+
+def test_remote_bins_are_scored_outside_the_download_slot(tmp_path, monkeypatch):
+    rng = np.random.default_rng(5)
+    url = 'https://www.youtube.com/watch?v=abcdefghijk'
+    source = rng.standard_normal(600 * RATE)
+    query = source[250 * RATE:270 * RATE].copy()
+    search = MultiSourceSearch(
+        query, rate=RATE, max_dl=3, loc=tmp_path,
+        bin_kwargs=dict(nbins=6, binorder='linear', max_binwidth=100))
+    bins, slots = {}, []
+
+    def fake_fetch(url, start, stop, fmt, loc=None, **kwargs):
+        path = Path(get_filename(url, loc=loc, suffix=range_suffix(start, stop)))
+        path.touch()
+        bins[str(path)] = (start, stop)
+        return str(path)
+
+    def fake_read(path, *args, **kwargs):
+        # which slots are taken while the bin is scored
+        net_free = search._net.acquire(blocking=False)
+        cpu_free = search._cpu.acquire(blocking=False)
+        for free, sem in ((net_free, search._net), (cpu_free, search._cpu)):
+            if free:
+                sem.release()
+        slots.append((net_free, cpu_free))
+
+        start, stop = bins[str(path)]
+        return source[start * RATE:stop * RATE], RATE
+
+    monkeypatch.setattr(fm.Finder, 'video_meta', lambda self, loc=None: dict(duration=600))
+    monkeypatch.setattr(fm, 'fetch_bin', fake_fetch)
+    monkeypatch.setattr(fm, 'read_audio_file', fake_read)
+
+    match = search.run([SourceInfo(url, 600, None, 'remote')])
+
+    assert match is not None and abs(match.start - 250) < 1
+    # scored under the correlation slot, never under the download slot
+    assert set(slots) == {(True, False)}
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_local_audio_is_decoded_to_raw(tmp_path):
+    rng = np.random.default_rng(4)
+    source = tmp_path / "src"
+    source.mkdir()
+
+    # stereo at 48 kHz, the query in both channels
+    signal = rng.standard_normal(60 * 48000).astype(np.float32) * 0.1
+    audiofile.write(str(source / "vod.wav"), np.stack([signal, signal]), 48000)
+    query, _ = read_audio_file(source / "vod.wav", rate=RATE)
+    query = query[20 * RATE:30 * RATE]
+
+    search = MultiSourceSearch(query, rate=RATE, segment_s=15, loc=tmp_path)
+    match = search.run(scan_directory(source))
+
+    assert abs(match.start - 20) < 0.1
+    # decoded once, next to the other raw files
+    assert len(list(tmp_path.glob(f"vod_*_{RATE}hz.float32"))) == 1
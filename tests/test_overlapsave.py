@@ -0,0 +1,112 @@
+import pytest
+import numpy as np
+from pathlib import Path
+from scipy.signal import correlate
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder.overlapsave import OverlapAdd, OverlapSave, block_size_for_budget
+from finder.fullsource import correlate_source
+from finder.spectrumcache import SpectrumCache
+
+# ---------------------------------------------------------------------------- #
+#       Tests for finder/overlapsave.py, fullsource.py and spectrumcache.py   #
+# ---------------------------------------------------------------------------- #
+
+
+@pytest.fixture
+def signals():
+    rng = np.random.default_rng(0)
+    source = rng.standard_normal(441 * 600).astype(np.float32)
+    query = source[441 * 321:441 * 351].astype(np.float64)
+    return source, query
+
+
+def test_overlapsave_matches_valid_correlation(signals):
+    source, query = signals
+    source, query = source[:50000], query[:700]
+
+    engine = OverlapSave(query, 4096)
+    blocks = list(engine.iter_correlate(source))
+
+    assert [off for off, _ in blocks] == list(
+        range(0, source.size - query.size + 1, engine.step))
+    assert np.allclose(
+        np.concatenate([c for _, c in blocks]),
+        correlate(source.astype(np.float64), query, mode='valid')
+    )
+
+
+def test_block_size_for_budget():
+    assert block_size_for_budget(2**20, 1000) == 16384
+
+    with pytest.raises(ValueError):
+        block_size_for_budget(2**20, 10000)
+
+
+def test_correlate_source_memmap(signals, tmp_path: Path):
+    source, query = signals
+    path = tmp_path / "abc_441hz.float32"
+    source.tofile(path)
+
+    mm = np.memmap(path, dtype='float32', mode='r')
+    best = max(
+        correlate_source(mm, query, 441, memory_budget=2**22),
+        key=lambda b: b.peak
+    )
+
+    assert round(best.start) == 321
+    assert round(best.stop) == 351
+
+
+def test_overlapadd_matches_valid_correlation(signals):
+    source, query = signals
+    source, query = source[:50000], query[:700]
+    expected = correlate(source.astype(np.float64), query, mode='valid')
+
+    engine = OverlapAdd(query, 8192)
+    assert engine.block == 7168
+    spectra = np.stack([
+        engine.block_spectrum(source[b:b + engine.block])
+        for b in range(0, source.size, engine.block)
+    ]).astype(np.complex64)
+
+    blocks = list(engine.iter_correlate(spectra, source.size))
+    assert np.allclose(np.concatenate([c for _, c in blocks]), expected, atol=1e-3)
+
+    # a range starting and stopping inside blocks
+    blocks = list(engine.iter_correlate(spectra, source.size, start=3000, stop=9000))
+    assert blocks[0][0] == 3000
+    assert np.allclose(
+        np.concatenate([c for _, c in blocks]), expected[3000:9000 - 700 + 1], atol=1e-3)
+
+
+def test_spectrum_cache(signals, tmp_path: Path):
+    source, query = signals
+    cache = SpectrumCache(tmp_path, quota=2**30)
+
+    direct = list(correlate_source(source, query, 441, memory_budget=2**23))
+    cached = [
+        list(correlate_source(
+            source, q, 441, memory_budget=2**23, spectra=cache, source_id='abc'))
+        for q in (query, query[:441 * 10])
+    ]
+    assert cache.misses == 1 and cache.hits == 1
+
+    best = max(cached[0], key=lambda b: b.peak)
+    assert round(best.start) == 321
+    assert best.peak == pytest.approx(max(b.peak for b in direct), rel=1e-4)
+    assert round(max(cached[1], key=lambda b: b.peak).start) == 321
+
+    # the least recently used source goes first
+    cache.get('def', 441, 65536, source)
+    cache.quota = cache.usage()
+    cache.get('ghi', 441, 65536, source)
+    assert [p.name for p in cache.files()] == [
+        'def_441hz_65536.spectra.npy', 'ghi_441hz_65536.spectra.npy']
+
+    with pytest.raises(ValueError):
+        OverlapAdd(query, 65536)
@@ -0,0 +1,64 @@
+import numpy as np
+from pathlib import Path
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder.peaks import Occurrence, top_k_peaks, rank_occurrences
+from finder.findsignal import FindSignal
+
+# ---------------------------------------------------------------------------- #
+#                             Tests for finder/peaks.py                        #
+# ---------------------------------------------------------------------------- #
+
+RATE = 441
+
+
+def test_top_k_suppresses_neighbours():
+    corr = np.zeros(100)
+    corr[[10, 12, 50, 90]] = [5, 4, 3, 6]
+
+    ind, val = top_k_peaks(corr, 3, window=9)
+    assert ind.tolist() == [90, 10, 50]
+    assert val.tolist() == [6, 5, 3]
+
+    # fewer peaks than k
+    ind, val = top_k_peaks(corr, 10, window=201)
+    assert ind[0] == 90 and np.all(ind[1:] == -1)
+
+
+def test_top_k_stack_matches_rows():
+    rng = np.random.default_rng(0)
+    stack = rng.standard_normal((4, 1000))
+
+    ind, val = top_k_peaks(stack, 5, window=21)
+    for row, i, v in zip(stack, ind, val):
+        i1, v1 = top_k_peaks(row, 5, window=21)
+        assert np.array_equal(i, i1) and np.array_equal(v, v1)
+
+
+def test_find_peaks_reports_every_occurrence():
+    rng = np.random.default_rng(1)
+    query = rng.standard_normal(5 * RATE)
+    data = 0.1 * rng.standard_normal(120 * RATE)
+    for t in [10, 17, 80]:
+        data[t * RATE:(t + 5) * RATE] += query
+
+    occ = FindSignal(data, query, RATE).find_peaks(k=5)
+    starts = sorted(round(o.start, 3) for o in occ[:3])
+    assert starts == [10, 17, 80]
+    assert occ[3].value < 0.5 * occ[2].value
+
+
+def test_rank_occurrences_across_bins():
+    occ = [
+        Occurrence(100., 105., 9.),
+        Occurrence(100.5, 105.5, 8.),   # same occurrence in an overlapping bin
+        Occurrence(300., 305., 7.),
+        Occurrence(500., 505., 1.),
+    ]
+    ranked = rank_occurrences(occ, min_distance=2.5, min_ratio=0.5)
+    assert [o.start for o in ranked] == [100., 300.]
+    assert len(rank_occurrences(occ, min_distance=2.5, k=1)) == 1
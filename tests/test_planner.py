@@ -0,0 +1,117 @@
+import time
+import numpy as np
+from pathlib import Path
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+import finder.main as fm
+from finder import sampling
+from finder.download import get_filename, range_suffix
+from finder.planner import (
+    CostModel, SimulatedBackend, expected_batches, measure, plan, time_to_hit)
+
+# ---------------------------------------------------------------------------- #
+#                          Tests for finder/planner.py                         #
+# ---------------------------------------------------------------------------- #
+
+COSTS = CostModel(latency_s=3., bandwidth=40., correlate_s=0.004, link_bandwidth=400.)
+DURATION = 4 * 3600
+QUERY_S = 45
+
+
+def simulate(backend, duration, binwidth, overlap, batch, clips):
+    bins = sampling.get_bins(
+        duration, nbins=duration // binwidth, min_binwidth=binwidth,
+        max_binwidth=binwidth, overlap=overlap)
+    return np.array([
+        backend.search(bins, batch, t, QUERY_S) for t in clips
+    ])
+
+
+def test_expected_batches():
+    for nbins in [1, 7, 20]:
+        for batch in [1, 3, 20, 50]:
+            brute = np.mean([np.ceil(j / batch) for j in range(1, nbins + 1)])
+            assert np.isclose(expected_batches(nbins, batch), brute)
+
+
+def test_measure_recovers_costs():
+    backend = SimulatedBackend(COSTS)
+    measured = measure(
+        backend.fetch, backend.score, lengths=(10, 60, 120), clock=backend.now)
+
+    assert np.isclose(measured.latency_s, COSTS.latency_s)
+    assert np.isclose(measured.bandwidth, COSTS.bandwidth)
+    assert np.isclose(measured.correlate_s, COSTS.correlate_s)
+
+
+def test_plan_against_simulation():
+    chosen = plan(DURATION, QUERY_S, COSTS)
+    assert chosen.overlap >= QUERY_S
+    assert chosen.binwidth * chosen.nbins <= DURATION
+
+    backend = SimulatedBackend(COSTS)
+    covered = chosen.binwidth * chosen.nbins - QUERY_S
+    clips = np.linspace(1, covered, 200)
+
+    planned = simulate(
+        backend, DURATION, chosen.binwidth, chosen.overlap, chosen.batch, clips)
+    # every clip is inside a bin, and the model predicts the simulated mean
+    assert np.all(np.isfinite(planned))
+    assert abs(planned.mean() - chosen.expected_s) < 0.05 * chosen.expected_s
+
+    # the hard-coded defaults miss clips across bin edges, and are slower even with overlap
+    fixed = simulate(backend, DURATION, 150, 0, 50, clips)
+    assert np.any(np.isinf(fixed))
+    fixed = simulate(backend, DURATION, 150, chosen.overlap, 50, clips)
+    assert fixed.mean() > planned.mean()
+
+
+def test_plan_follows_latency():
+    fast = plan(DURATION, QUERY_S, COSTS._replace(latency_s=0.1))
+    slow = plan(DURATION, QUERY_S, COSTS._replace(latency_s=20.))
+
+    per_batch = lambda p: p.binwidth * p.batch
+    assert per_batch(slow) > per_batch(fast)
+    assert time_to_hit(DURATION, fast.binwidth, fast.overlap, fast.batch, COSTS) > 0
+
+
+def test_finder_probes_source_costs(tmp_path, monkeypatch):
+    rate = 441
+    url = 'https://www.youtube.com/watch?v=abcdefghijk'
+    source = np.random.default_rng(7).standard_normal(3600 * rate)
+    fetched = []
+
+    def fake_fetch(url, start, stop, fmt, loc=None, **kwargs):
+        fetched.append((start, stop))
+        time.sleep(0.05 + (stop - start) * 0.002)
+        path = Path(get_filename(url, loc=loc, suffix=range_suffix(start, stop)))
+        path.touch()
+        return str(path)
+
+    def fake_read(path, *args, **kwargs):
+        start, stop = fetched[-1]
+        return source[start * rate:stop * rate], rate
+
+    monkeypatch.setattr(fm, 'fetch_bin', fake_fetch)
+    monkeypatch.setattr(fm, 'read_audio_file', fake_read)
+
+    finder = fm.Finder(
+        url, source[:QUERY_S * rate].copy(),
+        source_start='00:10:00', source_stop='01:00:00', logfile=False)
+    costs = finder.measure_costs(loc=tmp_path, lengths=(10, 60))
+
+    # probes start at the searched range and are not kept
+    assert fetched == [(600, 610), (600, 660)]
+    assert list(tmp_path.iterdir()) == []
+    assert costs.latency_s > 0.03
+    assert costs.correlate_s > 0
+
+    plain = finder.plan_bins(costs=costs, binorder='linear')
+    bins = finder._bins.copy()
+    skipped = finder.plan_bins(costs=costs, binorder='linear', skipsize=2)
+    assert skipped == plain
+    assert np.array_equal(finder._bins, np.concatenate((bins[::2], bins[1::2])))
@@ -0,0 +1,68 @@
+import numpy as np
+from pathlib import Path
+
+import pytest
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder.preflight import active_span, energy_band, preflight
+
+# ---------------------------------------------------------------------------- #
+#                         Tests for finder/preflight.py                        #
+# ---------------------------------------------------------------------------- #
+
+RATE = 441
+
+
+def noise(seconds: float, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal(int(seconds * RATE))
+
+
+def test_noise_is_localizable():
+    report = preflight(noise(10), RATE)
+
+    assert report.localizable, report.warnings
+    assert report.span == (0., 10.)
+    assert report.sidelobe < 0.5
+    assert report.rate == RATE
+    assert report.engine == 'xcorr'
+    assert 0.4 <= report.threshold < 0.7
+
+
+def test_mostly_silent():
+    query = np.zeros(20 * RATE)
+    query[8 * RATE:10 * RATE] = noise(2)
+
+    start, stop, active = active_span(query, RATE)
+    # to whole frames
+    assert 8 * RATE - RATE // 2 < start <= 8 * RATE
+    assert 10 * RATE <= stop < 10 * RATE + RATE // 2
+    assert active == pytest.approx(0.1, abs=0.03)
+
+    report = preflight(query, RATE)
+    assert not report.localizable
+    assert report.span == (start / RATE, stop / RATE)
+    # segments scores the active span only
+    assert report.engine == 'segments'
+    assert any('has signal' in w for w in report.warnings)
+
+    assert not preflight(np.zeros(10 * RATE), RATE).localizable
+
+
+def test_loop_and_narrow_band():
+    loop = np.tile(noise(1), 12)
+    report = preflight(loop, RATE)
+    assert report.sidelobe > 0.9
+    assert any('repeats' in w for w in report.warnings)
+    # above the query's own repeats
+    assert report.threshold == 0.9
+
+    t = np.arange(10 * RATE) / RATE
+    low = np.sin(2 * np.pi * 20 * t) * (1 + noise(10)[:t.size] * 0.1)
+    lo, hi = energy_band(low, RATE)
+    assert lo <= 20 <= hi < 40
+    # energy far below Nyquist: half the rate keeps it
+    assert preflight(low, RATE).rate < RATE
@@ -0,0 +1,139 @@
+import os
+import numpy as np
+from pathlib import Path
+
+import matplotlib
+matplotlib.use('Agg')
+
+import pytest
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+import finder.main as fm
+from finder.common import str2td
+from finder.download import get_filename, range_suffix
+from finder.resultcache import ResultCache, hash_samples, params_key
+
+# ---------------------------------------------------------------------------- #
+#                       Tests for finder/resultcache.py                        #
+# ---------------------------------------------------------------------------- #
+
+RATE = 441
+URL = 'https://www.youtube.com/watch?v=abcdefghijk'
+AT = 450
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResultCache(tmp_path / 'results.sqlite')
+    yield cache
+    cache.close()
+
+
+def test_hit_and_misses(cache):
+    q, a = hash_samples(np.ones(10)), hash_samples(np.zeros(10))
+    params = params_key(engine='xcorr', rate=RATE)
+    cache.store(q, a, params, 3.5, 1234, (10, 30))
+
+    hit = cache.lookup(q, a, params)
+    assert hit.peak == 3.5 and hit.argmax == 1234
+    assert hit.candidates == (10, 30)
+
+    # any part of the key changes the entry
+    assert cache.lookup(hash_samples(np.ones(11)), a, params) is None
+    assert cache.lookup(q, hash_samples(np.zeros(11)), params) is None
+    assert cache.lookup(q, a, params_key(engine='segments', rate=RATE)) is None
+    # parameters are keyed regardless of their order
+    assert cache.lookup(q, a, params_key(rate=RATE, engine='xcorr')) is not None
+
+    cache.store(q, a, params, 0.1, 5, None)
+    assert cache.lookup(q, a, params).candidates is None
+    assert cache.stats() == dict(entries=1, hits=3, misses=3)
+
+
+def test_file_hash_follows_size_and_mtime(cache, tmp_path):
+    path = tmp_path / 'bin.m4a'
+    path.write_bytes(b'abc')
+    assert cache.file_hash(path) is None
+
+    cache.remember_file(path, 'hash', RATE)
+    assert cache.file_hash(path) == ('hash', RATE)
+
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert cache.file_hash(path) is None
+
+    cache.remember_file(path, 'hash', RATE)
+    path.write_bytes(b'abcd')
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert cache.file_hash(path) is None
+
+    assert cache.file_hash(tmp_path / 'missing.m4a') is None
+
+
+def test_peaks(cache):
+    params = params_key(engine='xcorr', rate=RATE, top_k=3, window=1.)
+    assert cache.lookup_peaks('q', 'a', params) is None
+
+    cache.store_peaks('q', 'a', params, [(1., 21., 0.9), (50, 70, 0.4)])
+    assert cache.lookup_peaks('q', 'a', params) == [(1., 21., 0.9), (50., 70., 0.4)]
+    assert cache.lookup_peaks('q', 'a', params_key(top_k=3)) is None
+
+
+def test_rerun_is_not_recomputed(cache, tmp_path, monkeypatch):
+    rng = np.random.default_rng(5)
+    source = rng.standard_normal(2400 * RATE)
+    query = source[AT * RATE:(AT + 20) * RATE].copy()
+    reads, scores = [], []
+
+    def fake_read(path, *args, **kwargs):
+        reads.append(path)
+        start, stop = (
+            int(str2td(t).total_seconds())
+            for t in bins[[str(p) for p in paths].index(str(path))])
+        return source[start * RATE:stop * RATE], RATE
+
+    findsignal = fm.FindSignal.findsignal
+
+    def counted(self, *args, **kwargs):
+        scores.append(1)
+        return findsignal(self, *args, **kwargs)
+
+    monkeypatch.setattr(fm, 'read_audio_file', fake_read)
+    monkeypatch.setattr(fm.FindSignal, 'findsignal', counted)
+
+    def make_finder() -> fm.Finder:
+        finder = fm.Finder(
+            URL, query, source_start='00:00:00', source_stop='00:20:00',
+            logfile=False, results=cache)
+        finder.get_bins(nbins=12, binorder='linear', max_binwidth=100)
+        return finder
+
+    def search(max_dl: int, plot: bool) -> list:
+        finder = make_finder()
+        candidates = []
+        for start_bin in range(0, 12, max_dl):
+            candidates += finder.run(start_bin, max_dl=max_dl, loc=tmp_path, plot=plot)
+        finder.close()
+        return candidates
+
+    bins = make_finder()._bins_str.tolist()
+    paths = [
+        Path(get_filename(URL, loc=tmp_path, suffix=range_suffix(a, b)))
+        for a, b in bins
+    ]
+    for p in paths:
+        p.touch()
+
+    first = search(max_dl=12, plot=False)
+    assert first
+    assert len(reads) == len(scores) == 12
+
+    # another batch size and plotting: every bin is served from the cache
+    second = search(max_dl=4, plot=True)
+    assert second == first
+    assert len(reads) == len(scores) == 12
+    assert cache.hits >= 12
@@ -0,0 +1,84 @@
+import numpy as np
+from pathlib import Path
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder import sampling
+
+# ---------------------------------------------------------------------------- #
+#                           Tests for finder/sampling.py                       #
+# ---------------------------------------------------------------------------- #
+
+
+def test_mirrored_order():
+    assert sampling.mirrored_order(6).tolist() == [3, 4, 2, 5, 1, 0]
+    assert sorted(sampling.mirrored_order(7).tolist()) == list(range(7))
+
+
+def test_skip_order():
+    order = np.arange(7)
+    assert sampling.skip_order(order, 3).tolist() == [0, 3, 6, 1, 4, 2, 5]
+    assert sampling.skip_order(order, 0).tolist() == order.tolist()
+
+
+def test_get_bins_integer_seconds():
+    bins = sampling.get_bins(
+        600, nbins=10, binorder='linear', start_delta=100)
+
+    assert bins.dtype == np.int64
+    assert bins.shape == (10, 2)
+    assert bins[0].tolist() == [101, 160]
+    assert np.all(bins[1:, 0] == bins[:-1, 1] + 1)
+
+
+def test_random_order_is_seeded_permutation():
+    a = sampling.get_bins(3600, nbins=60, binorder='random', seed=1)
+    b = sampling.get_bins(3600, nbins=60, binorder='random', seed=1)
+
+    assert np.array_equal(a, b)
+    assert sorted(a[:, 0].tolist()) == list(range(1, 3600, 60))
+
+
+def test_format_hms_beyond_one_day():
+    assert sampling.format_hms([59, 3661, 90061]).tolist() == \
+        ['00:00:59', '01:01:01', '25:01:01']
+    assert sampling.bin2str(np.array([301, 360])) == "['00:05:01' '00:06:00']"
+
+
+def test_heatmap_order(tmp_path, monkeypatch):
+    # 100 segments of 36 s; the most replayed one is 2160-2196
+    heatmap = [
+        dict(start_time=36. * i, end_time=36. * (i + 1), value=1. if i == 60 else 0.1)
+        for i in range(100)
+    ]
+    calls = []
+
+    class FakeYDL:
+        def extract_info(self, url, download=False):
+            calls.append(url)
+            return dict(
+                id='abcdefghijk', duration=3600, heatmap=heatmap,
+                thumbnails=[{}] * 50, formats=[dict(format_id='139', url='https://...')])
+
+    monkeypatch.setattr(sampling.yt_dlp, 'YoutubeDL', FakeYDL)
+    url = 'https://www.youtube.com/watch?v=abcdefghijk'
+
+    meta = sampling.get_video_meta(url, loc=tmp_path)
+    assert 'thumbnails' not in meta
+    assert meta['formats'][0]['format_id'] == '139' and 'url' not in meta['formats'][0]
+    assert sampling.get_video_duration(url, loc=tmp_path)[0] == 3600
+    # read back from `<id>.meta.json`
+    assert len(calls) == 1
+
+    rate = sampling.heatmap_rate(meta['heatmap'])
+    assert rate.size == 3600 and rate[2170] == 1.
+
+    bins = sampling.get_bins(3600, nbins=30, binorder='heatmap', prior=rate)
+    assert bins[0].tolist() == [2161, 2280]
+
+    # no heatmap: mirrored order
+    fallback = sampling.get_bins(3600, nbins=30, binorder='heatmap')
+    assert np.array_equal(fallback, sampling.get_bins(3600, nbins=30, binorder='mirrored'))
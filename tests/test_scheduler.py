@@ -0,0 +1,108 @@
+import time
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder.scheduler import (
+    MemoryBudget, PROCESS_BYTES, fetch_bytes, score_bytes)
+
+# ---------------------------------------------------------------------------- #
+#                         Tests for finder/scheduler.py                        #
+# ---------------------------------------------------------------------------- #
+
+
+def test_estimates_grow_with_bins():
+    assert fetch_bytes(120) == PROCESS_BYTES
+    assert fetch_bytes(120, 140, fragments=True) > fetch_bytes(60, 140, fragments=True)
+
+    short = score_bytes(60, 441, 441 * 20)
+    long = score_bytes(600, 441, 441 * 20)
+    # at least the float32 and float64 samples, and roughly linear in the bin
+    assert short >= 60 * 441 * 12
+    assert 5 < long / short < 15
+
+
+def test_budget_bounds_concurrent_work():
+    budget = MemoryBudget(100)
+    state = dict(active=0, peak=0)
+    lock = threading.Lock()
+
+    def work(nbytes):
+        with budget.reserve(nbytes):
+            with lock:
+                state['active'] += nbytes
+                state['peak'] = max(state['peak'], state['active'])
+            time.sleep(0.02)
+            with lock:
+                state['active'] -= nbytes
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        list(ex.map(work, [30] * 24))
+    elapsed = time.perf_counter() - t0
+
+    assert state['peak'] <= 100
+    assert budget.peak == 90
+    assert budget.in_use == 0
+    # three at a time: about 8 rounds, not 24
+    assert elapsed < 24 * 0.02
+
+
+def test_oversized_and_urgent():
+    budget = MemoryBudget(100)
+    # larger than the budget, but admitted alone
+    with budget.reserve(500):
+        with pytest.raises(TimeoutError):
+            budget.acquire(1, timeout=0.05)
+    assert budget.in_use == 0
+
+    order = []
+    held = budget.acquire(100)
+
+    def wait(name, urgent):
+        with budget.reserve(60, urgent=urgent):
+            order.append(name)
+
+    threads = [threading.Thread(target=wait, args=('download', False))]
+    threads[0].start()
+    time.sleep(0.05)
+    threads.append(threading.Thread(target=wait, args=('score', True)))
+    threads[1].start()
+    time.sleep(0.05)
+
+    budget.release(held)
+    for t in threads:
+        t.join(timeout=5)
+    assert order == ['score', 'download']
+
+
+def test_downloads_reserve_memory_only_in_a_slot(monkeypatch):
+    import finder.main as fm
+
+    budget = MemoryBudget()
+    seen = {}
+
+    class Slots:
+        def call(self, host, fn, *args, **kwargs):
+            # still waiting for a download slot
+            seen['queued'] = budget.in_use
+            return fn(*args, **kwargs)
+
+    def fetch(url, start, stop):
+        seen['fetching'] = budget.in_use
+        return 'bin.m4a'
+
+    monkeypatch.setattr(fm, 'BUDGET', budget)
+    monkeypatch.setattr(fm, 'DOWNLOADS', Slots())
+
+    key = ('abcdefghijk', 0, 60, 139)
+    assert fm.Finder._fetch(0, key, 1000, fetch, 'https://youtu.be/abcdefghijk', 0, 60) == 'bin.m4a'
+    assert seen == dict(queued=0, fetching=1000)
+    assert budget.in_use == 0
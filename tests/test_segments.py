@@ -0,0 +1,90 @@
+import numpy as np
+from scipy import fft as sp_fft
+from pathlib import Path
+
+import pytest
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder.segments import SegmentedQuery, distinctiveness, trim_query
+
+# ---------------------------------------------------------------------------- #
+#                          Tests for finder/segments.py                        #
+# ---------------------------------------------------------------------------- #
+
+RATE = 441
+
+
+def noise(seconds: float, seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal(int(seconds * RATE))
+
+
+def full_ncc(data: np.ndarray, query: np.ndarray) -> float:
+    """Best normalized correlation of the whole query anywhere in `data`"""
+    n = data.size
+    nfft = sp_fft.next_fast_len(n + query.size, real=True)
+    energy = np.concatenate(([0.], np.cumsum(data**2)))
+    ncc = SegmentedQuery._ncc(sp_fft.rfft(data, nfft), energy, nfft, n, query)
+    return float(ncc.max())
+
+
+def test_trim_query():
+    signal = noise(10, 0)
+    query = np.concatenate((np.zeros(3 * RATE), signal, np.zeros(2 * RATE)))
+
+    trimmed, offset = trim_query(query, RATE, frame_s=0.5)
+    # to whole frames around the signal
+    assert 3 * RATE - RATE // 2 < offset <= 3 * RATE
+    assert offset + trimmed.size >= 13 * RATE
+    assert trimmed.size <= 10 * RATE + RATE
+
+    # nothing to trim
+    assert trim_query(signal, RATE)[1] == 0
+    assert trim_query(signal, RATE)[0].size == signal.size
+
+    assert distinctiveness(signal, RATE) > 0.8
+    # a loop of ten repeats matches itself at 90% one repeat away
+    assert distinctiveness(np.tile(signal[:RATE], 10), RATE) == pytest.approx(0.1)
+
+
+def test_unrelated_bin_is_rejected_after_one_segment(monkeypatch):
+    seg = SegmentedQuery(noise(20, 1), RATE)
+    assert len(seg.segments) == 4
+
+    calls = []
+    ncc = SegmentedQuery._ncc
+
+    def counted(*args):
+        calls.append(1)
+        return ncc(*args)
+
+    monkeypatch.setattr(SegmentedQuery, '_ncc', staticmethod(counted))
+
+    verdict = seg.score(noise(120, 2), reject_below=0.3)
+    assert verdict.rejected and not verdict.found
+    assert verdict.peak < 0.3
+    assert len(calls) == 1
+
+
+def test_votes_survive_an_inserted_gap():
+    source = noise(300, 3)
+    at = 100 * RATE
+    query = source[at:at + 30 * RATE]
+
+    # the bin holds the clip with 4 s of other audio inserted after 20 s
+    cut = at + 20 * RATE
+    data = np.concatenate((source[:cut], noise(4, 4), source[cut:]))[60 * RATE:200 * RATE]
+
+    # one alignment of the whole query only matches two thirds of it
+    assert full_ncc(data, query) < 0.85
+
+    seg = SegmentedQuery(query, RATE, segment_s=5)
+    verdict = seg.score(data, accept=0.9)
+    assert verdict.found and not verdict.rejected
+    # the start agreed by the segments before the gap
+    assert verdict.start == pytest.approx(40 * RATE, abs=RATE // 100)
+    assert verdict.votes == 4
+    assert verdict.peak > 0.95
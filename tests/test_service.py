@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import numpy as np
+from pathlib import Path
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+import finder.main as fm
+from finder.cache import SharedCaches, audio_key
+from finder.service import SearchService
+
+# ---------------------------------------------------------------------------- #
+#                          Tests for finder/service.py                         #
+# ---------------------------------------------------------------------------- #
+
+RATE = 441
+URL = 'https://www.youtube.com/watch?v=abcdefghijk'
+
+
+async def until_finished(*jobs, timeout: float = 10.) -> None:
+    async def wait(job) -> None:
+        while not job.finished:
+            await job.wait()
+    await asyncio.wait_for(asyncio.gather(*map(wait, jobs)), timeout)
+
+
+def test_jobs_run_in_priority_order(tmp_path):
+    order = []
+
+    async def scenario():
+        service = SearchService(port=0, datadir=tmp_path)
+        service._run_job = lambda spec, *_: order.append(spec['name']) or {}
+        await service.start()
+
+        # all queued before the worker takes the first one
+        jobs = [
+            service.submit(dict(source=URL, query='q', name=name, priority=priority))
+            for name, priority in [('late', 2), ('first', 0), ('second', 1), ('tie', 0)]
+        ]
+        await until_finished(*jobs)
+        await service.stop()
+        return jobs
+
+    jobs = asyncio.run(scenario())
+    assert order == ['first', 'tie', 'second', 'late']
+    assert all(j.state == 'done' for j in jobs)
+
+
+def test_cancel_queued_and_running(tmp_path):
+    started = threading.Event()
+    ran = []
+
+    def run_job(spec, publish, stop):
+        ran.append(spec['name'])
+        started.set()
+        # a search checks `stop` between bins
+        stop.wait(10)
+        return dict(hits=[])
+
+    async def scenario():
+        service = SearchService(port=0, datadir=tmp_path)
+        service._run_job = run_job
+        await service.start()
+
+        running = service.submit(dict(source=URL, query='q', name='running'))
+        queued = service.submit(dict(source=URL, query='q', name='queued'))
+        await asyncio.to_thread(started.wait, 10)
+
+        assert service.cancel(queued)
+        assert service.cancel(running)
+        await until_finished(running, queued)
+        # finished jobs cannot be cancelled
+        assert not service.cancel(running)
+
+        await service.stop()
+        return running, queued
+
+    running, queued = asyncio.run(scenario())
+    assert running.state == queued.state == 'cancelled'
+    assert ran == ['running']
+
+
+def test_cached_bins_are_not_fetched(tmp_path, monkeypatch):
+    rng = np.random.default_rng(6)
+    source = rng.standard_normal(1200 * RATE)
+    fetched = []
+
+    def fake_fetch(*args, **kwargs):
+        fetched.append(args)
+        raise AssertionError("cached bins must not be fetched")
+
+    monkeypatch.setattr(fm, 'fetch_bin', fake_fetch)
+    monkeypatch.setattr(fm, 'fetch_fragments', fake_fetch)
+
+    caches = SharedCaches()
+    bin_kwargs = dict(nbins=5, binorder='linear', max_binwidth=120)
+    spec = dict(
+        source=URL, query=source[300 * RATE:320 * RATE].copy(),
+        source_start='00:00:00', source_stop='00:10:00',
+        bin_kwargs=bin_kwargs, run_kwargs=dict(max_dl=5))
+
+    # a previous job left every bin in the shared cache
+    finder = fm.Finder(URL, spec['query'], source_start='00:00:00', source_stop='00:10:00', logfile=False)
+    finder.get_bins(**bin_kwargs)
+    for start, stop in finder._bins.tolist():
+        caches.audio.put(
+            audio_key(finder.source_id, start, stop), (source[start * RATE:stop * RATE], RATE))
+
+    async def scenario():
+        service = SearchService(port=0, datadir=tmp_path, caches=caches)
+        await service.start()
+        job = service.submit(spec)
+        await until_finished(job)
+        await service.stop()
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.state == 'done', job.error
+    assert fetched == []
+    assert job.result['bins_checked'] >= 1
+    assert caches.audio.hits >= job.result['bins_checked']
@@ -0,0 +1,74 @@
+import time
+import threading
+import multiprocessing as mp
+from pathlib import Path
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder.singleflight import FileLock, SingleFlight
+
+# ---------------------------------------------------------------------------- #
+#                       Tests for finder/singleflight.py                       #
+# ---------------------------------------------------------------------------- #
+
+
+def test_singleflight_coalesces_concurrent_calls():
+    sf = SingleFlight(max_workers=4)
+    calls = []
+    gate = threading.Event()
+
+    def fetch(key):
+        calls.append(key)
+        gate.wait(5)
+        return f"{key}.m4a"
+
+    futs = [sf.submit(('abc', 1, 60), fetch, 'a') for _ in range(8)]
+    other = sf.submit(('abc', 61, 120), fetch, 'b')
+    gate.set()
+
+    assert {f.result() for f in futs} == {'a.m4a'}
+    assert other.result() == 'b.m4a'
+    assert sorted(calls) == ['a', 'b']
+    assert sf.shared == 7
+
+    # finished calls are forgotten, so a later request fetches again
+    sf.submit(('abc', 1, 60), fetch, 'a').result()
+    assert len(calls) == 3
+
+# ---------------------------------------------------------------------------- #
+
+
+def _hold_lock(path: str, out: str) -> None:
+    with FileLock(path):
+        with open(out, 'a') as io:
+            io.write("start\n")
+        time.sleep(0.3)
+        with open(out, 'a') as io:
+            io.write("stop\n")
+
+
+def test_filelock_serializes_processes(tmp_path: Path):
+    lock, out = tmp_path / ".bin.lock", tmp_path / "out.txt"
+
+    procs = [
+        mp.Process(target=_hold_lock, args=(str(lock), str(out)))
+        for _ in range(3)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+    assert out.read_text().split() == ["start", "stop"] * 3
+    assert not lock.exists()
+
+
+def test_filelock_breaks_stale_lock(tmp_path: Path):
+    lock = tmp_path / ".bin.lock"
+    lock.write_text("crashed 0")
+
+    with FileLock(lock, timeout=1, stale_after=0):
+        assert lock.exists()
@@ -0,0 +1,95 @@
+import numpy as np
+from pathlib import Path
+
+import pytest
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder.sampling import get_bins, prioritize_bins
+from finder.subtitles import SubtitleIndex, parse_srv, read_subtitles, tokenize
+
+# ---------------------------------------------------------------------------- #
+#                         Tests for finder/subtitles.py                        #
+# ---------------------------------------------------------------------------- #
+
+# auto-caption style: word timestamps and each cue repeating the previous line
+VTT = """WEBVTT
+Kind: captions
+Language: en
+
+00:00:05.000 --> 00:00:09.000 align:start position:0%
+welcome<00:00:05.500><c> back</c><00:00:06.000><c> everyone</c>
+
+00:00:09.000 --> 00:00:12.000 align:start position:0%
+welcome back everyone
+today we play the forest level
+
+{filler}
+
+00:20:01.000 --> 00:20:04.000
+the dragon is finally awake
+
+00:20:04.000 --> 00:20:08.000
+run, run to the castle &amp; hide
+
+00:31:00.000 --> 00:31:03.000
+今日は城に行きます
+"""
+
+FILLER = "\n\n".join(
+    f"00:{m:02d}:{s:02d}.000 --> 00:{m:02d}:{s + 3:02d}.000\nwe play the level again and again"
+    for m in range(1, 20) for s in (10, 40)
+)
+
+SRV3 = """<?xml version="1.0" encoding="utf-8" ?><timedtext format="3"><body>
+<p t="1201000" d="3000">the dragon is <s>finally</s> awake</p>
+<p t="1204000" d="4000">run to the castle</p>
+</body></timedtext>"""
+
+
+@pytest.fixture
+def vtt(tmp_path):
+    path = tmp_path / 'abcdefghijk.en.vtt'
+    path.write_text(VTT.format(filler=FILLER), encoding='utf-8')
+    return path
+
+
+def test_parse(vtt):
+    cues = read_subtitles(vtt)
+    assert cues[0].text == 'welcome back everyone'
+    # the repeated line is dropped
+    assert cues[1].text == 'today we play the forest level'
+    assert cues[-2].text == 'run, run to the castle & hide'
+    assert cues[-1].start == 31 * 60
+
+    srv = parse_srv(SRV3)
+    assert [c.start for c in srv] == [1201., 1204.]
+    assert srv[0].text == 'the dragon is finally awake'
+
+    assert tokenize('今日は城') == ['今日', '日は', 'は城']
+
+
+def test_quote_ranks_window_and_bin_first(vtt):
+    index = SubtitleIndex.from_file(vtt)
+
+    windows = index.search("the dragon is awake, run to the castle", window_s=30)
+    assert windows[0].start <= 1201 and windows[0].stop >= 1208
+    assert windows[0].score > 0.9
+
+    assert index.search("城に行きます", window_s=30)[0].start <= 31 * 60
+    assert index.search("nothing like this") == []
+
+    bins = get_bins(2400, nbins=20, max_binwidth=120, seed=0)
+    first, second = prioritize_bins(bins, windows[:1])[:2]
+    # the window straddles two bins: the one with the matched cues goes first
+    assert first[0] <= 1201 < 1208 <= first[1]
+    assert min(first[0], second[0]) <= windows[0].start
+    assert max(first[1], second[1]) >= windows[0].stop
+
+    ordered = get_bins(2400, nbins=20, max_binwidth=120, seed=0, priority=windows[:1])
+    assert np.array_equal(ordered[0], first)
+    # the same bins, only reordered
+    assert sorted(map(tuple, ordered)) == sorted(map(tuple, bins))
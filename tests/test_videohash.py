@@ -0,0 +1,54 @@
+import numpy as np
+from pathlib import Path
+from scipy.ndimage import gaussian_filter
+
+import sys
+sys.path.append(
+    str(Path.cwd())
+)
+
+from finder.videohash import align, hamming, phash, popcount, search_hashes
+
+# ---------------------------------------------------------------------------- #
+#                          Tests for finder/videohash.py                       #
+# ---------------------------------------------------------------------------- #
+
+FPS = 1
+
+
+def scenes(n: int, seed: int = 0) -> np.ndarray:
+    """Smooth random 32 x 32 frames, like heavily downscaled video"""
+    rng = np.random.default_rng(seed)
+    frames = rng.uniform(0, 255, (n, 32, 32))
+    return gaussian_filter(frames, sigma=(0, 3, 3))
+
+
+def test_popcount():
+    x = np.array([0, 1, 2**63, 2**64 - 1, 0xF0F0], dtype=np.uint64)
+    assert popcount(x).tolist() == [0, 1, 1, 64, 8]
+
+
+def test_phash_is_robust_to_brightness_and_noise():
+    frames = scenes(50)
+    rng = np.random.default_rng(1)
+    edited = 0.9 * frames + 10 + rng.normal(0, 2, frames.shape)
+
+    same = hamming(phash(frames), phash(edited))
+    other = hamming(phash(frames), phash(scenes(50, seed=2)))
+    assert same.mean() < 5 < 20 < other.mean()
+
+
+def test_search_with_dropped_frames():
+    source = phash(scenes(3600))
+    rng = np.random.default_rng(3)
+
+    # a 60 s clip from 1234 s, re-encoded, with two frames dropped
+    clip = scenes(3600)[1234:1294] * 0.95 + rng.normal(0, 2, (60, 32, 32))
+    query = phash(np.delete(clip, [20, 41], axis=0))
+
+    matches = search_hashes(source, query, FPS)
+    assert abs(matches[0].start - 1234) <= 2
+    assert matches[0].matched > 0.9
+
+    assert align(source[1234:1294], query) >= 55
+    assert search_hashes(source, phash(scenes(60, seed=9)), FPS) == []